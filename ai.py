@@ -0,0 +1,117 @@
+"""
+Perfect-play computer opponent for Tic Tac Toe.
+
+The opponent searches the full game tree with negamax. Results are kept
+in a transposition table keyed on the canonical form of a position: the
+8 rotations and reflections of a board are mapped to one entry, so each
+symmetric position is only searched once.
+"""
+
+import rules
+
+# a win is worth more the sooner it happens, so the AI does not dawdle
+WIN_SCORE = rules.NUM_SQUARES + 1
+
+
+def _transform_table(transform):
+    # map every 9-bit bitboard through a (row, col) -> (row, col) transform
+    table = []
+    for bits in range(rules.FULL_MASK + 1):
+        result = 0
+        for row in range(rules.BOARD_ROWS):
+            for col in range(rules.BOARD_COLS):
+                if bits & rules.cell_bit(row, col):
+                    result |= rules.cell_bit(*transform(row, col))
+        table.append(result)
+    return tuple(table)
+
+
+_LAST = rules.BOARD_ROWS - 1
+# the 4 rotations, each with and without a reflection
+SYMMETRIES = tuple(
+    _transform_table(transform)
+    for transform in (
+        lambda r, c: (r, c),
+        lambda r, c: (c, _LAST - r),
+        lambda r, c: (_LAST - r, _LAST - c),
+        lambda r, c: (_LAST - c, r),
+        lambda r, c: (r, _LAST - c),
+        lambda r, c: (c, r),
+        lambda r, c: (_LAST - r, c),
+        lambda r, c: (_LAST - c, _LAST - r),
+    )
+)
+
+# canonical position key -> score for the player to move
+_table = {}
+
+
+def canonical_key(own, opp):
+    """
+    Return the key shared by a position and all its symmetric copies.
+
+    Parameters:
+        own (int): the bitboard of the player to move
+        opp (int): the bitboard of the other player
+
+    Returns:
+        int: the smallest packed position over the 8 symmetries
+    """
+    return min(table[own] | table[opp] << rules.NUM_SQUARES for table in SYMMETRIES)
+
+
+def negamax(own, opp):
+    """
+    Score a position with perfect play from both sides.
+
+    Parameters:
+        own (int): the bitboard of the player to move
+        opp (int): the bitboard of the player who just moved
+
+    Returns:
+        int: positive if the player to move wins, negative if they lose
+        and 0 for a draw. Faster wins have larger scores.
+    """
+    key = canonical_key(own, opp)
+    score = _table.get(key)
+    if score is not None:
+        return score
+    empty = rules.empty_squares(own, opp)
+    if rules.winning_mask(opp):
+        score = -(empty.bit_count() + 1)
+    elif not empty:
+        score = 0
+    else:
+        score = -WIN_SCORE
+        for bit in rules.iter_bits(empty):
+            score = max(score, -negamax(opp, own | bit))
+    _table[key] = score
+    return score
+
+
+def best_move(x_bits, o_bits):
+    """
+    Find the best move for the player whose turn it is.
+
+    X moves first, so it is X's turn when both players have the same
+    number of markers.
+
+    Parameters:
+        x_bits (int): the bitboard of player X
+        o_bits (int): the bitboard of player O
+
+    Returns:
+        int: the bit of the square to play, or 0 if the game is over
+    """
+    if rules.winning_mask(x_bits) or rules.winning_mask(o_bits):
+        return 0
+    if x_bits.bit_count() == o_bits.bit_count():
+        own, opp = x_bits, o_bits
+    else:
+        own, opp = o_bits, x_bits
+    best_bit, best_score = 0, -WIN_SCORE - 1
+    for bit in rules.iter_bits(rules.empty_squares(own, opp)):
+        score = -negamax(opp, own | bit)
+        if score > best_score:
+            best_bit, best_score = bit, score
+    return best_bit
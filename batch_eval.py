@@ -0,0 +1,152 @@
+"""
+Vectorized win and draw detection for many positions at once.
+
+Positions are given as a NumPy array of shape (M, 9) for standard 3x3
+boards, or (M, N, N) for N x N boards, with 0 for an empty square, 1 for
+X and 2 for O. The results match Board.check_winner and Board.check_draw
+for each position, but are computed for all M positions with a few array
+operations instead of one Python call per position.
+
+This module needs NumPy, which the game itself does not.
+
+Usage:
+    python batch_eval.py --positions 1000000 --size 3
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import rules
+
+EMPTY = 0
+X = 1
+O = 2
+
+# 9-bit bitboard -> whether it holds a line of the standard board
+_STANDARD_WINS = np.array(
+    [bool(rules.winning_mask(bits)) for bits in range(rules.FULL_MASK + 1)]
+)
+_STANDARD_WEIGHTS = 1 << np.arange(rules.NUM_SQUARES, dtype=np.int32)
+
+
+def _standard_wins(boards, player):
+    # pack each player's squares into a bitboard and look it up
+    bits = (boards == player).astype(np.int32) @ _STANDARD_WEIGHTS
+    return _STANDARD_WINS[bits]
+
+
+def _has_line(cells, k):
+    # cells: (M, N, N) booleans, True for the squares of one player
+    rows, cols = cells.shape[1:]
+    found = np.zeros(len(cells), dtype=bool)
+    for d_row, d_col in rules.DIRECTIONS:
+        height = rows - d_row * (k - 1)
+        width = cols - abs(d_col) * (k - 1)
+        if height <= 0 or width <= 0:
+            continue
+        # the first square of each line of k, shifted along the line
+        col_start = (k - 1) if d_col < 0 else 0
+        line = cells[:, :height, col_start : col_start + width]
+        for i in range(1, k):
+            r = d_row * i
+            c = col_start + d_col * i
+            line = line & cells[:, r : r + height, c : c + width]
+        found |= line.any(axis=(1, 2))
+    return found
+
+
+def evaluate(boards, win_length=None):
+    """
+    Find the winner and draw flags of many positions.
+
+    Parameters:
+        boards (numpy.ndarray): the positions, of shape (M, 9) or (M, N, N),
+            with 0 for empty squares, 1 for X and 2 for O
+        win_length (int): the number of markers in a line needed to win,
+            defaults to 3 for 3x3 boards and to N up to 5 otherwise
+
+    Returns:
+        tuple: (winners, draws), where winners is an (M,) int8 array with
+        0 for no winner, 1 for X and 2 for O, and draws is an (M,) bool
+        array that is True for full boards without a winner. If both
+        players have a line, X is reported as the winner.
+
+    Raises:
+        ValueError: if the array does not have one of the shapes above
+    """
+    boards = np.asarray(boards)
+    if boards.ndim == 2 and boards.shape[1] == rules.NUM_SQUARES:
+        if win_length in (None, rules.BOARD_ROWS):
+            x_wins = _standard_wins(boards, X)
+            o_wins = _standard_wins(boards, O)
+            full = (boards != EMPTY).all(axis=1)
+            return _results(x_wins, o_wins, full)
+        boards = boards.reshape(-1, rules.BOARD_ROWS, rules.BOARD_COLS)
+    if boards.ndim != 3:
+        raise ValueError(f"expected an (M, 9) or (M, N, N) array, got {boards.shape}")
+    size = max(boards.shape[1:])
+    k = win_length or (rules.BOARD_ROWS if size == rules.BOARD_ROWS else min(size, 5))
+    x_wins = _has_line(boards == X, k)
+    o_wins = _has_line(boards == O, k)
+    full = (boards != EMPTY).all(axis=(1, 2))
+    return _results(x_wins, o_wins, full)
+
+
+def _results(x_wins, o_wins, full):
+    winners = np.where(x_wins, X, np.where(o_wins, O, EMPTY)).astype(np.int8)
+    draws = full & (winners == EMPTY)
+    return winners, draws
+
+
+def random_positions(count, size=3, seed=None):
+    """
+    Create random positions from random games.
+
+    Each position is a game of random moves stopped after a random
+    number of moves, so X has the same number of markers as O or one more.
+    The games do not stop at a win, so both players may have a line.
+
+    Parameters:
+        count (int): the number of positions
+        size (int): the number of rows and columns of the boards
+        seed (int): the seed of the random number generator
+
+    Returns:
+        numpy.ndarray: an (count, size, size) int8 array of positions
+    """
+    rng = np.random.default_rng(seed)
+    squares = size * size
+    order = rng.random((count, squares)).argsort(axis=1)
+    moves = rng.integers(0, squares + 1, size=count)
+    # the player of the i-th move, 0 for moves not yet played
+    players = np.where(np.arange(squares) % 2 == 0, X, O).astype(np.int8)
+    played = np.arange(squares)[None, :] < moves[:, None]
+    boards = np.zeros((count, squares), dtype=np.int8)
+    np.put_along_axis(boards, order, np.where(played, players, EMPTY), axis=1)
+    return boards.reshape(count, size, size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the batch evaluator.")
+    parser.add_argument("--positions", type=int, default=1_000_000)
+    parser.add_argument("--size", type=int, default=3)
+    parser.add_argument("--win-length", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    boards = random_positions(args.positions, args.size, args.seed)
+    if args.size == rules.BOARD_ROWS:
+        boards = boards.reshape(args.positions, -1)
+    start = time.perf_counter()
+    winners, draws = evaluate(boards, args.win_length)
+    elapsed = time.perf_counter() - start
+    print(f"X wins: {(winners == X).sum()}")
+    print(f"O wins: {(winners == O).sum()}")
+    print(f"Draws:  {draws.sum()}")
+    print(f"{args.positions / elapsed:,.0f} positions/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+Microbenchmarks of the hot paths of the game.
+
+Each benchmark calls one function of the Board, the Button or the frame
+drawing over and over, with the SDL dummy video driver so no window is
+opened. The calls are timed in samples of many calls each, and the
+ops/sec and the 50th, 90th and 99th percentile time per call of the
+samples are reported.
+
+With --memory, the memory each game takes is reported instead, as
+bytes per game over many games: a Board as the windowed game draws
+it, a Board that is only played on, and a game hosted by server.py.
+
+The results can be saved as JSON and compared against a saved
+baseline. A benchmark whose median time per call grew by more than the
+threshold counts as a regression, and the run exits with status 1. The
+median is compared rather than the mean, as it is not thrown off by a
+few slow samples.
+
+Usage:
+    python bench.py --save bench_baseline.json
+    python bench.py --baseline bench_baseline.json --threshold 0.2
+    python bench.py --memory
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+import history
+import main as game
+import rules
+import server
+from profiler import percentile
+
+# the time to run each benchmark for, in seconds
+DURATION = 0.5
+# each sample runs for at least this long, so the clock resolution does not matter
+SAMPLE_TIME = 0.001
+MIN_SAMPLES = 20
+# the fraction of its median speed a benchmark may lose before it counts
+# as a regression, runs on the same machine vary by about 10%
+THRESHOLD = 0.2
+PERCENTILES = (50, 90, 99)
+# the number of games the memory per game is measured over
+MEMORY_GAMES = 10000
+
+
+def measure(func, duration=DURATION):
+    """
+    Time a function.
+
+    The number of calls per sample is first doubled until a sample
+    takes at least SAMPLE_TIME. Then samples are taken until the
+    duration has passed and at least MIN_SAMPLES have been taken.
+
+    Parameters:
+        func (callable): the function to time, called without arguments
+        duration (float): the time to take samples for, in seconds
+
+    Returns:
+        dict: the ops/sec over all samples, the time per call of the
+        percentiles in microseconds, and the number of samples and calls
+    """
+    clock = time.perf_counter
+    number = 1
+    while True:
+        start = clock()
+        for _ in range(number):
+            func()
+        if clock() - start >= SAMPLE_TIME:
+            break
+        number *= 2
+    samples = []
+    end = clock() + duration
+    while clock() < end or len(samples) < MIN_SAMPLES:
+        start = clock()
+        for _ in range(number):
+            func()
+        samples.append((clock() - start) / number)
+    samples.sort()
+    result = {"ops_per_sec": len(samples) / sum(samples)}
+    for p in PERCENTILES:
+        result[f"p{p}_us"] = percentile(samples, p) * 1e6
+    result["samples"] = len(samples)
+    result["calls"] = len(samples) * number
+    return result
+
+
+def benchmarks():
+    """
+    Set up the game and return the benchmarks.
+
+    Returns:
+        dict: benchmark name -> function to time
+    """
+    game.init()
+    screen = game.create_screen()
+    board = game.Board()
+    button = game.create_button(board.reset)
+
+    # a game in play, with the last move not winning
+    playing = game.Board()
+    for row, col, marker in ((1, 1, rules.X), (0, 0, rules.O), (2, 2, rules.X)):
+        playing.play(rules.cell_bit(row, col), marker)
+    # a full board without a winner
+    drawn = game.Board()
+    for square, marker in enumerate("XOXXOOOXX"):
+        drawn.play(1 << square, marker)
+
+    # a drawn game, stepped through back and forth
+    line = history.History()
+    for square in (4, 0, 8, 2, 1, 7, 6, 3, 5):
+        line.play(square)
+
+    def undo_redo():
+        line.undo()
+        line.redo()
+
+    center = playing.squares[1][1].rect.center
+    on_button = pygame.event.Event(pygame.MOUSEMOTION, pos=button.rect.center)
+    off_button = pygame.event.Event(pygame.MOUSEMOTION, pos=(0, 0))
+    motion = [on_button, off_button]
+
+    def button_update():
+        # move on and off the button, so the hover state changes every call
+        motion.reverse()
+        button.update(motion[0], screen)
+
+    def frame():
+        game.draw_title(screen)
+        board.draw(screen)
+        game.draw_footer(screen, button)
+        pygame.display.flip()
+
+    return {
+        "Board.check_winner": playing.check_winner,
+        "Board.check_draw": drawn.check_draw,
+        "Board.handle_click": lambda: playing.handle_click(*center),
+        "Board.reset": board.reset,
+        "Board.draw": lambda: board.draw(screen),
+        "History.undo+redo": undo_redo,
+        "History.jump": lambda: line.jump(4),
+        "Button.update": button_update,
+        "Button.draw": lambda: button.draw(screen),
+        "frame": frame,
+    }
+
+
+def bytes_per_game(make, games=MEMORY_GAMES):
+    """
+    Measure the memory a game takes.
+
+    Parameters:
+        make (callable): creates a game, called with its number
+        games (int): the number of games to create and keep
+
+    Returns:
+        float: the bytes allocated per game, including its slot in the
+        list the games are kept in
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = [make(number) for number in range(games)]
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del kept
+    return size / games
+
+
+def memory(games=MEMORY_GAMES):
+    """
+    Measure the memory per game of the ways a game is held.
+
+    Every game has had 4 moves played.
+
+    Parameters:
+        games (int): the number of games to measure over
+
+    Returns:
+        dict: name -> bytes per game
+    """
+    moves = (4, 0, 8, 2)
+
+    def played(board):
+        for ply, square in enumerate(moves):
+            board.set_marker(1 << square, rules.O if ply % 2 else rules.X)
+        return board
+
+    def drawn_board(number):
+        board = played(game.Board())
+        # the squares the windowed game draws and clicks
+        board.squares
+        return board
+
+    def server_game(number):
+        hosted = server.ServerGame(number, None)
+        for square in moves:
+            hosted.state = rules.STANDARD.play_state(hosted.state, square)
+        return hosted
+
+    return {
+        "Board, drawn": bytes_per_game(drawn_board, games),
+        "Board": bytes_per_game(lambda number: played(game.Board()), games),
+        "ServerGame": bytes_per_game(server_game, games),
+    }
+
+
+def run(names=None, duration=DURATION):
+    """
+    Run the benchmarks.
+
+    Parameters:
+        names (list): the names of the benchmarks to run, defaults to all
+        duration (float): the time to run each benchmark for, in seconds
+
+    Returns:
+        dict: the results, with the environment they were measured in
+    """
+    results = {}
+    for name, func in benchmarks().items():
+        if names and name not in names:
+            continue
+        results[name] = measure(func, duration)
+    return {
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "sdl": ".".join(map(str, pygame.get_sdl_version())),
+        "machine": platform.machine(),
+        "video_driver": os.environ["SDL_VIDEODRIVER"],
+        "results": results,
+    }
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Compare results against a baseline.
+
+    Parameters:
+        results (dict): the results of run()
+        baseline (dict): the results of an earlier run()
+        threshold (float): the fraction of its median speed a benchmark
+            may lose
+
+    Returns:
+        tuple: a dict of benchmark name -> change of the median speed as
+        a fraction of the baseline, for the benchmarks in both; and a
+        list of the names of the regressed benchmarks
+    """
+    changes = {}
+    regressions = []
+    for name, result in results["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        change = before["p50_us"] / result["p50_us"] - 1
+        changes[name] = change
+        if change < -threshold:
+            regressions.append(name)
+    return changes, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the game's hot paths.")
+    parser.add_argument("names", nargs="*", help="the benchmarks to run")
+    parser.add_argument("--duration", type=float, default=DURATION)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this JSON file")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help="report the memory per game instead of the speed",
+    )
+    args = parser.parse_args()
+
+    if args.memory:
+        for name, size in memory().items():
+            print(f"{name:<20}{size:>10,.0f} bytes per game")
+        return
+
+    results = run(args.names, args.duration)
+    changes, regressions = {}, []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        changes, regressions = compare(results, baseline, args.threshold)
+
+    header = f"{'benchmark':<20}{'ops/sec':>14}" + "".join(
+        f"{f'p{p} us':>10}" for p in PERCENTILES
+    )
+    print(header + ("  vs baseline" if args.baseline else ""))
+    for name, result in results["results"].items():
+        line = f"{name:<20}{result['ops_per_sec']:>14,.0f}" + "".join(
+            f"{result[f'p{p}_us']:>10.2f}" for p in PERCENTILES
+        )
+        if name in changes:
+            line += f"  {changes[name]:+.1%}"
+            if name in regressions:
+                line += " REGRESSION"
+        print(line)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        print(
+            f"{len(regressions)} benchmark(s) slower than the baseline by more "
+            f"than {args.threshold:.0%}"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
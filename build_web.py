@@ -0,0 +1,404 @@
+"""
+Build the tictactoe.apk bundle loaded by index.html in the browser.
+
+The bundle is a zip file that the custom_site() loader in index.html
+mounts at /data/data/tictactoe, before it runs assets/main.py. Only what
+the game needs is bundled:
+    - main.py, as source, as the loader runs it by path
+    - the local modules main.py imports, found by following its imports,
+      except the desktop-only ones (DESKTOP_MODULES), each as bytecode or as source, whichever compresses smaller.
+      Bytecode is only an option when this is run by the Python version
+      the page loads (data-python in index.html).
+    - tablebase.bin
+    - arial.ttf, subset to the characters the game renders (needs
+      fontTools, otherwise the whole font is bundled)
+
+The size of every asset is reported, and the bundle is then checked by
+mounting it the way the loader does and running the game from it for a
+few frames.
+
+Usage:
+    python build_web.py --output tictactoe.apk
+"""
+
+import argparse
+import ast
+import io
+import logging
+import os
+import py_compile
+import re
+import subprocess
+import sys
+import tempfile
+import zipfile
+import zlib
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+INDEX_FILE = os.path.join(ROOT, "index.html")
+APK_FILE = os.path.join(ROOT, "tictactoe.apk")
+ENTRY = "main.py"
+FONT = "arial.ttf"
+DATA_FILES = ("tablebase.bin",)
+# modules main.py imports only for options the page cannot pass: the
+# replay of recorded input, and the MCTS engine, whose worker processes
+# the browser could not start anyway
+DESKTOP_MODULES = ("replay", "mcts")
+ASSETS_DIR = "assets"
+
+# the characters bundled when some rendered text is only known at run time
+PRINTABLE_ASCII = "".join(chr(code) for code in range(0x20, 0x7F))
+# the characters of a number formatted with a d, f or % format spec
+NUMBER_CHARS = "0123456789+-.,%"
+
+# the passes of the main loop the check runs; the computer moves first
+CHECK_FRAMES = 10
+
+# run by the check in a clean interpreter from the mounted assets folder,
+# which runs main.py as __main__ the way the loader does
+CHECK_SCRIPT = """
+import importlib, os, runpy, sys
+assets = os.getcwd()
+sys.path.insert(0, assets)
+frames, *modules = sys.argv[1:]
+sys.argv = ["main.py", "--computer", "X", "--record", "check.ttr", "--frames", frames]
+runpy.run_path("main.py", run_name="__main__")
+for name in modules:
+    module = importlib.import_module(name)
+    if os.path.dirname(os.path.abspath(module.__file__)) != assets:
+        sys.exit(f"{name} was imported from {module.__file__}")
+import records
+if not [game for game in records.read_records("check.ttr") if game.moves]:
+    sys.exit("the computer did not move")
+import tablebase
+if tablebase.open_default() is None:
+    sys.exit("tablebase.bin could not be opened")
+"""
+
+
+def local_imports(filename):
+    """
+    Return the local modules a source file imports, at any level.
+
+    Imports inside functions count too, as the game imports some
+    modules on first use.
+
+    Parameters:
+        filename (str): the name of a Python file in this folder
+
+    Returns:
+        set: the names of the modules that are Python files in this folder
+    """
+    with open(os.path.join(ROOT, filename)) as f:
+        tree = ast.parse(f.read(), filename)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module)
+    return {name for name in names if os.path.isfile(os.path.join(ROOT, f"{name}.py"))}
+
+
+def game_modules(entry=ENTRY, exclude=DESKTOP_MODULES):
+    """
+    Find every local module the game imports, directly or not.
+
+    Parameters:
+        entry (str): the file the loader runs
+        exclude (tuple): the modules to leave out, along with what only
+            they import
+
+    Returns:
+        list: the sorted module names, without the entry itself
+    """
+    # the entry is bundled as source, a module importing it back is not
+    # a reason to bundle it twice
+    entry_name = os.path.splitext(entry)[0]
+    found = {entry_name}
+    pending = [entry]
+    while pending:
+        for name in local_imports(pending.pop()):
+            if name not in found and name not in exclude:
+                found.add(name)
+                pending.append(f"{name}.py")
+    return sorted(found - {entry_name})
+
+
+def rendered_text(entry=ENTRY):
+    """
+    Return the characters the game renders with the font.
+
+    These are the string literals passed to render_text() and as the
+    text of a Button. A Button renders its own text, so render_text()
+    calls with a text attribute are covered by the Button texts. In an
+    f-string, the values with a number format spec (like {fps:.0f}) add
+    the characters of numbers. If any other text is not a literal,
+    every printable ASCII character is included.
+
+    Parameters:
+        entry (str): the file that renders the text
+
+    Returns:
+        str: the sorted characters
+    """
+    with open(os.path.join(ROOT, entry)) as f:
+        tree = ast.parse(f.read(), entry)
+    texts = []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Name):
+            continue
+        if node.func.id == "render_text" and len(node.args) > 1:
+            text = node.args[1]
+            if not (isinstance(text, ast.Attribute) and text.attr == "text"):
+                texts.append(text)
+        elif node.func.id == "Button":
+            texts.extend(k.value for k in node.keywords if k.arg == "text")
+    chars = set()
+    for text in texts:
+        parts = text.values if isinstance(text, ast.JoinedStr) else [text]
+        for part in parts:
+            if isinstance(part, ast.Constant) and isinstance(part.value, str):
+                chars.update(part.value)
+            elif _is_number_format(part):
+                chars.update(NUMBER_CHARS)
+            else:
+                chars.update(PRINTABLE_ASCII)
+    return "".join(sorted(chars))
+
+
+def _is_number_format(node):
+    # a constant format spec ending in d, f or %, e.g. {count:,d} or {ms:.1f}
+    if not isinstance(node, ast.FormattedValue) or node.format_spec is None:
+        return False
+    spec = node.format_spec.values
+    return (
+        len(spec) == 1
+        and isinstance(spec[0], ast.Constant)
+        and spec[0].value[-1:] in ("d", "f", "%")
+    )
+
+
+def subset_font(path, text):
+    """
+    Strip a font down to the glyphs of the given characters.
+
+    Parameters:
+        path (str): the font file
+        text (str): the characters to keep
+
+    Returns:
+        bytes: the subset font, or None if fontTools is not installed
+    """
+    try:
+        from fontTools import subset
+    except ImportError:
+        return None
+    # arial.ttf has a few sloppy tables that fontTools warns about
+    logging.getLogger("fontTools").setLevel(logging.ERROR)
+    options = subset.Options()
+    options.notdef_outline = True
+    font = subset.load_font(path, options)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(text=text)
+    subsetter.subset(font)
+    data = io.BytesIO()
+    subset.save_font(font, data, options)
+    return data.getvalue()
+
+
+def compile_module(filename):
+    """
+    Compile a module to bytecode that can be imported without its source.
+
+    Docstrings are left out, as with python -OO.
+
+    Parameters:
+        filename (str): the name of a Python file in this folder
+
+    Returns:
+        bytes: the contents of the .pyc file
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        cfile = os.path.join(tmp, "module.pyc")
+        py_compile.compile(
+            os.path.join(ROOT, filename),
+            cfile=cfile,
+            dfile=filename,
+            doraise=True,
+            optimize=2,
+        )
+        with open(cfile, "rb") as f:
+            return f.read()
+
+
+def _deflated_size(data):
+    # the size of the data in the bundle, compressed as build() does
+    return len(zlib.compress(data, 9))
+
+
+def read_loader(index=INDEX_FILE):
+    """
+    Read the settings of the custom_site() loader from a page.
+
+    Parameters:
+        index (str): the HTML page that loads the bundle
+
+    Returns:
+        dict: the "apk" and "bundle" names, the "main" path in the bundle
+        and the "python" version as a (major, minor) tuple
+
+    Raises:
+        ValueError: if the page does not have the expected loader
+    """
+    with open(index) as f:
+        html = f.read()
+    apk = re.search(r'^\s*apk\s*=\s*"([^"]+)"', html, re.M)
+    bundle = re.search(r'^\s*bundle\s*=\s*"([^"]+)"', html, re.M)
+    main = re.search(r'^\s*main\s*=\s*appdir((?:\s*/\s*"[^"]+")+)', html, re.M)
+    python = re.search(r"data-python=python(\d+)\.(\d+)", html)
+    if "async def custom_site()" not in html or not (apk and bundle and main):
+        raise ValueError(f"{index} does not have the custom_site() loader")
+    return {
+        "apk": apk.group(1),
+        "bundle": bundle.group(1),
+        "main": "/".join(re.findall(r'"([^"]+)"', main.group(1))),
+        "python": (int(python.group(1)), int(python.group(2))) if python else None,
+    }
+
+
+def build(output=APK_FILE, compile_modules=True, subset=True, index=INDEX_FILE):
+    """
+    Write the bundle.
+
+    Parameters:
+        output (str): the bundle file to write
+        compile_modules (bool): whether to bundle each imported module as
+            bytecode when that is smaller than its source, only done if
+            this Python is the one the page loads
+        subset (bool): whether to subset the font
+        index (str): the HTML page that loads the bundle
+
+    Returns:
+        tuple: (list of (name, size, compressed size, note) per asset,
+        list of the bundled module names)
+    """
+    loader = read_loader(index)
+    modules = game_modules()
+    if compile_modules and loader["python"] != sys.version_info[:2]:
+        target = ".".join(map(str, loader["python"] or ("?",)))
+        print(
+            f"Bundling sources: the page loads Python {target}, "
+            f"bytecode from Python {sys.version_info[0]}.{sys.version_info[1]} "
+            "would not load there"
+        )
+        compile_modules = False
+
+    assets = [(ENTRY, None, "")]
+    for name in modules:
+        source = f"{name}.py"
+        if compile_modules:
+            bytecode = compile_module(source)
+            with open(os.path.join(ROOT, source), "rb") as f:
+                data = f.read()
+            # bytecode skips the compile on load, but is often the larger
+            # download, with its names and line tables
+            if _deflated_size(bytecode) < _deflated_size(data):
+                assets.append((f"{name}.pyc", bytecode, "bytecode"))
+            else:
+                assets.append((source, data, "source, smaller than bytecode"))
+        else:
+            assets.append((source, None, ""))
+    assets.extend((name, None, "") for name in DATA_FILES)
+    font, note = None, ""
+    if subset:
+        text = rendered_text()
+        font = subset_font(os.path.join(ROOT, FONT), text)
+        note = f"subset to {text!r}" if font else "fontTools not installed, not subset"
+    assets.append((FONT, font, note))
+
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED, compresslevel=9) as apk:
+        for name, data, note in assets:
+            if data is None:
+                with open(os.path.join(ROOT, name), "rb") as f:
+                    data = f.read()
+            apk.writestr(f"{ASSETS_DIR}/{name}", data)
+        sizes = [
+            (info.filename, info.file_size, info.compress_size, note)
+            for info, (_, _, note) in zip(apk.infolist(), assets)
+        ]
+    return sizes, modules
+
+
+def check(path=APK_FILE, modules=(), index=INDEX_FILE):
+    """
+    Check that the loader in the page can load the bundle.
+
+    The bundle is unpacked to a folder laid out like the mount point of
+    the loader, and the game is loaded from it by a new interpreter
+    with the SDL dummy video driver: main.py is run as __main__, as the
+    loader runs it, for CHECK_FRAMES passes of its main loop, in which
+    the computer plays X and the game is recorded. Then every bundled
+    module must have been imported from the bundle, the recorded game
+    must have the move of the computer, and the tablebase must open.
+
+    Parameters:
+        path (str): the bundle file
+        modules (list): the names of the bundled modules
+        index (str): the HTML page that loads the bundle
+
+    Returns:
+        list: the problems found, empty if the bundle loads
+    """
+    loader = read_loader(index)
+    problems = []
+    if os.path.basename(path) != loader["apk"]:
+        problems.append(f"the page loads {loader['apk']}, not {os.path.basename(path)}")
+    with zipfile.ZipFile(path) as apk:
+        names = apk.namelist()
+        if loader["main"] not in names:
+            return problems + [f"{loader['main']} is not in the bundle"]
+        with tempfile.TemporaryDirectory() as tmp:
+            appdir = os.path.join(tmp, "data", "data", loader["bundle"])
+            apk.extractall(appdir)
+            assets = os.path.dirname(os.path.join(appdir, loader["main"]))
+            env = dict(
+                os.environ, SDL_VIDEODRIVER="dummy", PYGAME_HIDE_SUPPORT_PROMPT="1"
+            )
+            result = subprocess.run(
+                [sys.executable, "-I", "-c", CHECK_SCRIPT, str(CHECK_FRAMES), *modules],
+                cwd=assets,
+                env=env,
+                capture_output=True,
+                text=True,
+            )
+    if result.returncode:
+        problems.append(result.stderr.strip().splitlines()[-1])
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the web bundle.")
+    parser.add_argument("--output", default=APK_FILE)
+    parser.add_argument("--no-compile", action="store_true")
+    parser.add_argument("--no-subset", action="store_true")
+    args = parser.parse_args()
+
+    previous = os.path.getsize(args.output) if os.path.exists(args.output) else None
+    sizes, modules = build(args.output, not args.no_compile, not args.no_subset)
+    for name, size, compressed, note in sizes:
+        print(f"{name:<24}{size:>9,} B{compressed:>9,} B compressed  {note}")
+    total = os.path.getsize(args.output)
+    print(f"{os.path.basename(args.output)}: {total:,} B", end="")
+    print(f" (was {previous:,} B)" if previous is not None else "")
+
+    problems = check(args.output, modules)
+    for problem in problems:
+        print(f"Check failed: {problem}")
+    if problems:
+        sys.exit(1)
+    print("Check passed: the bundle loads through custom_site()")
+
+
+if __name__ == "__main__":
+    main()
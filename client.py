@@ -0,0 +1,273 @@
+"""
+Test client for the multiplayer game server.
+
+The client opens pairs of connections to a server and starts many games
+at once: the first connection of a pair creates games and plays X, the
+second joins them and plays O. Once every game has been created, and so
+the server holds them all at the same time, each game is played to the
+end with random moves. The round trip of every move is timed, and the
+games/s, moves/s, the percentiles of the round trips and the server's
+own statistics are reported. As every game sends its moves at once,
+the round trip includes the wait behind the moves of the other games;
+the server's handling time of a move is its STATS.
+
+Usage:
+    python server.py &
+    python client.py --games 10000 --connections 100
+    python client.py --local --games 10000  # with a server in this process
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from collections import deque
+
+import rules
+import server
+from profiler import percentile
+
+
+class Connection:
+    def __init__(self, reader, writer):
+        """
+        Initialize a connection to the server.
+
+        Requests about a game wait for the reply with the id of the
+        game, so many games can be played over one connection at once.
+
+        Parameters:
+            reader (asyncio.StreamReader): the stream to read replies from
+            writer (asyncio.StreamWriter): the stream to send requests to
+        """
+        self.reader = reader
+        self.writer = writer
+        # game id -> the future of the reply to the request about the game
+        self._pending = {}
+        # the futures of the replies to NEW and STATS, in the order sent
+        self._unkeyed = deque()
+        self._reading = asyncio.get_running_loop().create_task(self._read())
+
+    @classmethod
+    async def open(cls, host=server.HOST, port=server.PORT):
+        """
+        Connect to a server.
+
+        Returns:
+            Connection: the connection
+        """
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, line, game_id=None):
+        """
+        Send a request and wait for its reply.
+
+        Parameters:
+            line (str): the request, without its line end
+            game_id (int): the game the request is about, None for NEW
+                and STATS
+
+        Returns:
+            list: the words of the reply
+
+        Raises:
+            RuntimeError: if the server replies with an error
+        """
+        future = asyncio.get_running_loop().create_future()
+        if game_id is None:
+            self._unkeyed.append(future)
+        else:
+            self._pending[game_id] = future
+        self.writer.write(f"{line}\n".encode())
+        words = await future
+        if words[0] == "ERROR":
+            raise RuntimeError(f"{line}: {' '.join(words[2:])}")
+        return words
+
+    async def _read(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            words = line.decode().split()
+            kind = words[0]
+            if kind in ("MOVED", "LEFT"):
+                continue
+            # the replies to NEW (GAME <id> X), to STATS and to bad requests
+            # (ERROR -) are not about a known game, and come in order
+            if kind == "STATS" or words[1] == "-" or words[2:3] == [rules.X]:
+                self._unkeyed.popleft().set_result(words)
+            else:
+                self._pending.pop(int(words[1])).set_result(words)
+
+    async def close(self):
+        """
+        Close the connection.
+        """
+        self.writer.close()
+        await self.writer.wait_closed()
+        self._reading.cancel()
+
+
+async def play_game(game_id, players, board_rules, rng, round_trips):
+    """
+    Play one game with random moves.
+
+    Parameters:
+        game_id (int): the game
+        players (tuple): the Connections playing X and O
+        board_rules (rules.Rules): the rules of the server's board
+        rng (random.Random): the random number generator
+        round_trips (list): the round trip of each move is added to it
+
+    Returns:
+        str: the status of the game at its end, "X", "O" or "draw"
+    """
+    empty = list(range(board_rules.num_squares))
+    turn = 0
+    while True:
+        square = empty.pop(rng.randrange(len(empty)))
+        start = time.perf_counter()
+        words = await players[turn].request(f"MOVE {game_id} {square}", game_id)
+        round_trips.append(time.perf_counter() - start)
+        if words[3] != server.PLAYING:
+            return words[3]
+        turn = 1 - turn
+
+
+async def run(host, port, games, connections, board_rules, seed=None):
+    """
+    Play many games against a server at once.
+
+    Parameters:
+        host (str): the address of the server
+        port (int): the port of the server
+        games (int): the number of games to play
+        connections (int): the number of connections, rounded up to even
+        board_rules (rules.Rules): the rules of the server's board
+        seed (int): the seed of the random moves
+
+    Returns:
+        dict: the results and timings of the run
+    """
+    rng = random.Random(seed)
+    pairs = max(1, (connections + 1) // 2)
+    conns = [await Connection.open(host, port) for _ in range(2 * pairs)]
+
+    start = time.perf_counter()
+    players = []
+    created = []
+    for i in range(games):
+        pair = (conns[2 * (i % pairs)], conns[2 * (i % pairs) + 1])
+        players.append(pair)
+        created.append(pair[0].request("NEW"))
+    game_ids = [int(words[1]) for words in await asyncio.gather(*created)]
+    await asyncio.gather(
+        *(
+            pair[1].request(f"JOIN {game_id}", game_id)
+            for game_id, pair in zip(game_ids, players)
+        )
+    )
+    setup = time.perf_counter() - start
+    stats = dict(word.split("=") for word in (await conns[0].request("STATS"))[1:])
+
+    round_trips = []
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            play_game(game_id, pair, board_rules, rng, round_trips)
+            for game_id, pair in zip(game_ids, players)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    final_stats = dict(
+        word.split("=") for word in (await conns[0].request("STATS"))[1:]
+    )
+    for conn in conns:
+        await conn.close()
+    round_trips.sort()
+    return {
+        "games": games,
+        "connections": len(conns),
+        "concurrent_games": int(stats["games"]),
+        "setup_s": setup,
+        "play_s": elapsed,
+        "moves": len(round_trips),
+        "results": {status: results.count(status) for status in sorted(set(results))},
+        "round_trip_p50_ms": percentile(round_trips, 50) * 1000,
+        "round_trip_p99_ms": percentile(round_trips, 99) * 1000,
+        "server": final_stats,
+    }
+
+
+async def run_local(games, connections, board_rules, seed=None):
+    """
+    Start a server in this process on a free loopback port, and run
+    against it.
+
+    Returns:
+        dict: the results and timings of the run, see run()
+    """
+    game_server = server.GameServer(board_rules)
+    listener = await game_server.serve(server.HOST, 0)
+    port = listener.sockets[0].getsockname()[1]
+    async with listener:
+        return await run(server.HOST, port, games, connections, board_rules, seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play many games against a server.")
+    parser.add_argument("--host", default=server.HOST)
+    parser.add_argument("--port", type=int, default=server.PORT)
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--size", type=int, default=3)
+    parser.add_argument("--win-length", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="start a server in this process instead of connecting to one",
+    )
+    args = parser.parse_args()
+    win_length = args.win_length or min(args.size, 5)
+    board_rules = rules.Rules(args.size, args.size, win_length)
+
+    if args.local:
+        result = asyncio.run(
+            run_local(args.games, args.connections, board_rules, args.seed)
+        )
+    else:
+        result = asyncio.run(
+            run(
+                args.host,
+                args.port,
+                args.games,
+                args.connections,
+                board_rules,
+                args.seed,
+            )
+        )
+    print(
+        f"{result['games']:,} games over {result['connections']} connections, "
+        f"{result['concurrent_games']:,} in play at once"
+    )
+    print(f"Results: {result['results']}")
+    print(
+        f"{result['games'] / result['play_s']:,.0f} games/s, "
+        f"{result['moves'] / result['play_s']:,.0f} moves/s"
+    )
+    print(
+        f"Move round trip: p50 {result['round_trip_p50_ms']:.2f} ms, "
+        f"p99 {result['round_trip_p99_ms']:.2f} ms"
+    )
+    server_stats = result["server"]
+    print(
+        f"Server move handling: p50 {server_stats['move_p50_us']} us, "
+        f"p99 {server_stats['move_p99_us']} us"
+    )
+
+
+if __name__ == "__main__":
+    main()
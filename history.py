@@ -0,0 +1,162 @@
+"""
+Undo and redo through the positions of a game.
+
+Every position of a game is a state (see rules.py), a single immutable
+integer, so a move makes a new snapshot of the whole game without
+copying the one before it, and a snapshot can be kept and shared for
+as long as needed. The History of a game is its line of play: the
+state after each move and the square of each move, with a cursor on
+the current position. Undo and redo move the cursor, and jumping to
+any move sets it, so stepping through a game never copies or rebuilds
+a position, however often it is done.
+
+A move played after an undo starts a new line from there: the moves
+after the cursor are dropped, and overwritten as the new line is
+played.
+
+The windowed game keeps a History of its board: the left and right
+arrow keys undo and redo a move, and Home and End jump to the start
+and the end of the game. These only move through the game: the
+computer does not play while there are moves to redo.
+
+Example:
+    history = History(rules.STANDARD)
+    history.play(4)
+    history.play(0)
+    history.undo()      # the state after the first move
+    history.redo()      # the state after both moves
+    history.jump(0)     # the empty board
+"""
+
+import rules
+
+
+class History:
+    def __init__(self, board_rules=rules.STANDARD, state=rules.EMPTY_STATE):
+        """
+        Initialize a History object.
+
+        Parameters:
+            board_rules (rules.Rules): the rules of the board
+            state (int): the state the game starts from, defaults to
+                the empty board
+
+        Attributes:
+            ply (int): the number of moves up to the current position
+            length (int): the number of moves of the line of play,
+                which is more than ply after an undo
+        """
+        self.rules = board_rules
+        self.ply = 0
+        self.length = 0
+        # the state after each move, from the start, and the square of
+        # each move; past length they hold a dropped line, which is
+        # overwritten instead of deleted
+        self._states = [state]
+        self._squares = []
+
+    @property
+    def state(self):
+        """
+        The state of the current position.
+        """
+        return self._states[self.ply]
+
+    @property
+    def last_move(self):
+        """
+        The square of the move that led to the current position, or None
+        at the start.
+        """
+        return self._squares[self.ply - 1] if self.ply else None
+
+    @property
+    def squares(self):
+        """
+        The squares of the moves of the line, in order, without a copy:
+        the first ply are the moves up to the current position, and the
+        first length the whole line. Items past length are stale.
+        """
+        return self._squares
+
+    def clear(self):
+        """
+        Go back to the start and drop every move, for a new game.
+        """
+        self.ply = self.length = 0
+
+    def moves(self):
+        """
+        Return the squares played up to the current position, in order.
+        """
+        return self._squares[: self.ply]
+
+    def play(self, square):
+        """
+        Play a move from the current position.
+
+        The moves after the current position, if any were undone, are
+        dropped.
+
+        Parameters:
+            square (int): the index of the square, row * cols + col
+
+        Returns:
+            int: the state after the move
+
+        Raises:
+            ValueError: if the move is not legal, see Rules.play_state
+        """
+        state = self.rules.play_state(self._states[self.ply], square)
+        ply = self.ply + 1
+        if ply < len(self._states):
+            self._states[ply] = state
+            self._squares[ply - 1] = square
+        else:
+            self._states.append(state)
+            self._squares.append(square)
+        self.ply = self.length = ply
+        return state
+
+    def undo(self):
+        """
+        Go back one move.
+
+        Returns:
+            int: the state before the move, or None at the start
+        """
+        if not self.ply:
+            return None
+        self.ply -= 1
+        return self._states[self.ply]
+
+    def redo(self):
+        """
+        Play the next move of the line again, after an undo.
+
+        Returns:
+            int: the state after the move, or None at the end of the line
+        """
+        if self.ply == self.length:
+            return None
+        self.ply += 1
+        return self._states[self.ply]
+
+    def jump(self, ply):
+        """
+        Go to the position after a number of moves of the line.
+
+        Parameters:
+            ply (int): the number of moves, from 0 for the start to
+                length for the end of the line
+
+        Returns:
+            int: the state of the position
+
+        Raises:
+            ValueError: if the line has no such position
+        """
+        if not 0 <= ply <= self.length:
+            raise ValueError(f"move {ply} is not in the history of {self.length}")
+        self.ply = ply
+        return self._states[ply]
@@ -0,0 +1,687 @@
+"""
+Multi-core game host.
+
+One Python process runs the game logic on one core, so the host runs N
+worker processes, each with a GameServer of its own. Every game belongs
+to exactly one worker, which holds its state and checks its moves: the
+game id picks the worker on a consistent hash ring, so the same game
+always goes to the same worker, and only about 1/N of the games would
+move if a worker were added.
+
+The host listens on the one public port, but does not carry the
+traffic: it reads the first request of each connection, picks the
+worker of its game (or the next worker in turn for a NEW game) and
+hands the socket itself over to that worker, with the bytes read so
+far. From then on the worker serves the connection directly, so the
+requests of different connections are handled on different cores. A
+worker gives the games created over its connections ids of its own
+games, so a client that creates games on one connection and joins them
+on another, as client.py does, is served by one worker without any
+forwarding. Requests about the games of other workers are still
+passed on to them over loopback, so any client works; the replies and
+the MOVED and LEFT notices of the other worker find their way back the
+same way. The replies still go out in the order of the requests, as
+with server.py: a reply from another worker holds its place until it
+arrives, and the replies after it wait for it.
+
+STATS is answered with the statistics of all workers added up,
+including the CPU time of each, which shows how the load is spread.
+
+Handing sockets over needs Unix domain sockets, so the host runs on
+Unix only; server.py runs anywhere.
+
+Usage:
+    python host.py --workers 4 --port 8765
+    python client.py --port 8765 --games 100000
+"""
+
+import argparse
+import asyncio
+import bisect
+import collections
+import hashlib
+import itertools
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+import rules
+import server
+
+# the points of each worker on the hash ring, more spread the games more evenly
+REPLICAS = 64
+# the bytes read from a connection at a time
+CHUNK_SIZE = 1 << 16
+# the most bytes of a connection the host reads before handing it over
+HANDOFF_SIZE = 4096
+# the first word of the lines a worker sends without a request
+NOTICES = (b"MOVED", b"LEFT")
+
+_MASK64 = (1 << 64) - 1
+
+
+def _hash(key):
+    # a point on the ring for a string, only hashed when the ring is built
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+def _mix(key):
+    # a point on the ring for an integer id, the finalizer of splitmix64,
+    # which spreads consecutive ids over the ring in a few integer operations
+    key = (key ^ key >> 30) * 0xBF58476D1CE4E5B9 & _MASK64
+    key = (key ^ key >> 27) * 0x94D049BB133111EB & _MASK64
+    return key ^ key >> 31
+
+
+class HashRing:
+    def __init__(self, nodes, replicas=REPLICAS):
+        """
+        Initialize a consistent hash ring.
+
+        Every node is put on the ring at replicas points. A key belongs
+        to the first node after the hash of the key, going round the
+        ring, so adding or removing a node only moves the keys between
+        its points and the points before them.
+
+        Parameters:
+            nodes (list): the nodes, e.g. worker indices
+            replicas (int): the points of each node on the ring
+        """
+        points = sorted(
+            (_hash(f"{node}:{i}"), node) for node in nodes for i in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def lookup(self, key):
+        """
+        Return the node a key belongs to.
+
+        Parameters:
+            key (int): the key, e.g. a game id
+
+        Returns:
+            the node
+        """
+        index = bisect.bisect(self._hashes, _mix(key))
+        return self._nodes[index % len(self._nodes)]
+
+
+def _game_id(words):
+    # the id of the game of a request, or None if it has none
+    if len(words) > 1 and words[0] in (b"MOVE", b"JOIN", b"STATE", b"NEW"):
+        try:
+            return int(words[1])
+        except ValueError:
+            pass
+    return None
+
+
+def _combine(per_worker):
+    # the statistics of all workers together, from the STATS of each
+    return {
+        "games": sum(int(stats["games"]) for stats in per_worker),
+        "connections": sum(int(stats["connections"]) for stats in per_worker),
+        "moves": sum(int(stats["moves"]) for stats in per_worker),
+        "finished": sum(int(stats["finished"]) for stats in per_worker),
+        "move_p50_us": max(float(stats["move_p50_us"]) for stats in per_worker),
+        "move_p99_us": max(float(stats["move_p99_us"]) for stats in per_worker),
+        "workers": len(per_worker),
+        "worker_games": "/".join(str(stats["games"]) for stats in per_worker),
+        "worker_cpu_s": "/".join(str(stats["cpu_s"]) for stats in per_worker),
+    }
+
+
+async def _ask_stats(connection):
+    # the STATS of a worker, over a connection to its loopback port
+    reader, writer = connection
+    writer.write(b"STATS\n")
+    words = (await reader.readline()).decode().split()[1:]
+    return dict(word.split("=") for word in words)
+
+
+class WorkerServer(server.GameServer):
+    def __init__(self, board_rules, index, workers):
+        """
+        Initialize the GameServer of a worker process.
+
+        The worker listens on a loopback port, where the other workers
+        pass on the requests about its games, and serves the client
+        connections the host hands over to it, see handle_client.
+
+        Parameters:
+            board_rules (rules.Rules): the rules of the board of every game
+            index (int): the index of the worker
+            workers (int): the number of workers
+
+        Attributes:
+            ring (HashRing): game id -> worker index
+            ports (list): the loopback port of each worker, once started
+            clients (int): the number of client connections served
+        """
+        super().__init__(board_rules)
+        self.index = index
+        self.workers = workers
+        self.ring = HashRing(range(workers))
+        self.ports = []
+        self.clients = 0
+        self._id_round = 0
+        # a connection to each other worker to ask for its statistics
+        self._control = {}
+        self._stats_lock = asyncio.Lock()
+
+    def new_id(self):
+        """
+        Return a free id of a game of this worker.
+
+        The ids are tried in the residue class of the worker modulo the
+        number of workers, so no two workers give out the same id, and
+        the first that the ring maps to this worker is taken.
+        """
+        while True:
+            self._id_round += 1
+            game_id = self._id_round * self.workers + self.index
+            if self.ring.lookup(game_id) == self.index and game_id not in self.games:
+                return game_id
+
+    def stats(self):
+        """
+        Return the statistics of this worker.
+
+        Returns:
+            dict: server.GameServer.stats(), with the client connections
+            the worker serves as its connections, and the CPU time the
+            worker has used in seconds
+        """
+        stats = super().stats()
+        stats["connections"] = self.clients
+        stats["cpu_s"] = round(time.process_time(), 2)
+        return stats
+
+    async def all_stats(self):
+        """
+        Return the statistics of all workers together.
+        """
+        async with self._stats_lock:
+            per_worker = []
+            for worker, port in enumerate(self.ports):
+                if worker == self.index:
+                    per_worker.append(self.stats())
+                    continue
+                connection = self._control.get(worker)
+                if connection is None:
+                    connection = await asyncio.open_connection(server.HOST, port)
+                    self._control[worker] = connection
+                per_worker.append(await _ask_stats(connection))
+        return _combine(per_worker)
+
+    def adopt(self, channel):
+        """
+        Serve a client connection the host handed over on the channel.
+
+        Parameters:
+            channel (socket.socket): the worker's end of the channel
+        """
+        try:
+            data, fds, _, _ = socket.recv_fds(channel, 2 * HANDOFF_SIZE, 1)
+        except BlockingIOError:
+            return
+        for fd in fds:
+            asyncio.get_running_loop().create_task(self._adopt(fd, data))
+
+    async def _adopt(self, fd, data):
+        loop = asyncio.get_running_loop()
+        # the bytes the host read come first, then the rest of the stream
+        reader = asyncio.StreamReader(limit=CHUNK_SIZE)
+        reader.feed_data(data)
+        protocol = asyncio.StreamReaderProtocol(reader)
+        transport, _ = await loop.connect_accepted_socket(
+            lambda: protocol, socket.socket(fileno=fd)
+        )
+        writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+        await self.handle_client(reader, writer)
+
+    async def handle_client(self, reader, writer):
+        """
+        Handle the requests of a client connection until it is closed.
+
+        The requests about the games of this worker, and every NEW game,
+        are handled here. The others are passed on to the worker of
+        their game, over a connection of its own for this client.
+
+        Parameters:
+            reader (asyncio.StreamReader): the stream to read requests from
+            writer (asyncio.StreamWriter): the stream to write replies to
+        """
+        self.clients += 1
+        self._player_games[writer] = set()
+        replies = _Replies(writer)
+        # worker index -> the connection to it for this client
+        upstreams = {}
+        pumps = []
+        pending = b""
+        try:
+            while True:
+                data = await reader.read(CHUNK_SIZE)
+                if not data:
+                    break
+                pending += data
+                end = pending.rfind(b"\n")
+                if end < 0:
+                    continue
+                lines = pending[:end].split(b"\n")
+                pending = pending[end + 1 :]
+                # the requests of this chunk for other workers, sent together
+                batches = {}
+                for line in lines:
+                    words = line.split()
+                    game_id = _game_id(words)
+                    if game_id is None or game_id in self.games:
+                        worker = self.index
+                    else:
+                        worker = self.ring.lookup(game_id)
+                    if worker != self.index:
+                        batches.setdefault(worker, []).append(line)
+                        replies.hold(worker)
+                    elif words == [b"NEW"]:
+                        replies.add(self.new_game(writer, self.new_id()))
+                    elif words == [b"STATS"]:
+                        stats = " ".join(
+                            f"{name}={value}"
+                            for name, value in (await self.all_stats()).items()
+                        )
+                        replies.add(f"STATS {stats}\n".encode())
+                    else:
+                        replies.add(self.handle_words(words, writer))
+                replies.flush()
+                for worker, batch in batches.items():
+                    upstream = upstreams.get(worker)
+                    if upstream is None:
+                        upstream_reader, upstream = await asyncio.open_connection(
+                            server.HOST, self.ports[worker]
+                        )
+                        upstreams[worker] = upstream
+                        pumps.append(
+                            asyncio.create_task(_pump(upstream_reader, replies, worker))
+                        )
+                    batch.append(b"")
+                    upstream.write(b"\n".join(batch))
+                for upstream in upstreams.values():
+                    await upstream.drain()
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients -= 1
+            for game_id in self._player_games.pop(writer):
+                self._leave(game_id, writer)
+            # the other workers end the games of the client and tell the
+            # opponents
+            for upstream in upstreams.values():
+                upstream.close()
+            for pump in pumps:
+                pump.cancel()
+            writer.close()
+
+
+class _Replies:
+    def __init__(self, writer):
+        """
+        Initialize the replies to one client connection of a worker.
+
+        The replies are written in the order of the requests. A request
+        passed on to another worker holds the place of its reply, and
+        the replies after it wait until it arrives.
+
+        Parameters:
+            writer (asyncio.StreamWriter): the connection of the client
+        """
+        self.writer = writer
+        # the replies from the first one still to come from another
+        # worker on: bytes, or a one-item list holding the reply of
+        # another worker, None until it arrives
+        self._queue = collections.deque()
+        # worker index -> the places held for its replies, in order
+        self._held = {}
+        # the replies ready to be written, in order
+        self._ready = []
+
+    def add(self, reply):
+        """
+        Add the reply to the next request, handled by this worker.
+        """
+        if self._queue:
+            self._queue.append(reply)
+        else:
+            self._ready.append(reply)
+
+    def hold(self, worker):
+        """
+        Hold the place of the reply to the next request, which is
+        passed on to another worker.
+        """
+        place = [None]
+        self._queue.append(place)
+        self._held.setdefault(worker, collections.deque()).append(place)
+
+    def fill(self, worker, reply):
+        """
+        Put the reply of another worker in its place.
+
+        A worker replies to the requests passed on to it in their order,
+        so the reply is for the oldest place held for the worker.
+        """
+        self._held[worker].popleft()[0] = reply
+        queue = self._queue
+        while queue:
+            reply = queue[0]
+            if isinstance(reply, list):
+                reply = reply[0]
+                if reply is None:
+                    break
+            self._ready.append(reply)
+            queue.popleft()
+
+    def notice(self, line):
+        """
+        Pass on a MOVED or LEFT notice of another worker, which is not a
+        reply and so does not wait for one.
+        """
+        self._ready.append(line)
+
+    def flush(self):
+        """
+        Write the replies that are ready.
+        """
+        if self._ready:
+            self.writer.write(b"".join(self._ready))
+            self._ready.clear()
+
+
+async def _pump(reader, replies, worker):
+    # pass the replies and notices of a worker on to its client, the
+    # replies in the order of the requests
+    pending = b""
+    try:
+        while True:
+            data = await reader.read(CHUNK_SIZE)
+            if not data:
+                break
+            pending += data
+            end = pending.rfind(b"\n")
+            if end < 0:
+                continue
+            for line in pending[: end + 1].splitlines(keepends=True):
+                if line.startswith(NOTICES):
+                    replies.notice(line)
+                else:
+                    replies.fill(worker, line)
+            pending = pending[end + 1 :]
+            replies.flush()
+    except ConnectionError:
+        pass
+
+
+def _run_worker(index, workers, rows, cols, k, pipe, channel):
+    # the main function of a worker process: serve on a free loopback port,
+    # tell the host which one and learn the ports of the others, then serve
+    # the connections the host hands over, until the host terminates it
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    async def serve():
+        game_server = WorkerServer(rules.shared(rows, cols, k), index, workers)
+        listener = await game_server.serve(server.HOST, 0)
+        pipe.send(listener.sockets[0].getsockname()[1])
+        game_server.ports = pipe.recv()
+        pipe.close()
+        channel.setblocking(False)
+        asyncio.get_running_loop().add_reader(channel, game_server.adopt, channel)
+        async with listener:
+            await listener.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+async def _send_fds(channel, data, fd):
+    # send a file descriptor over a non-blocking channel, waiting for room
+    # in it while it is full instead of blocking the event loop
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            return socket.send_fds(channel, [data], [fd])
+        except BlockingIOError:
+            pass
+        ready = loop.create_future()
+        loop.add_writer(channel, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_writer(channel)
+
+
+class Host:
+    def __init__(self, workers=None, board_rules=rules.STANDARD):
+        """
+        Initialize a Host object.
+
+        Parameters:
+            workers (int): the number of worker processes, defaults to
+                the number of CPUs
+            board_rules (rules.Rules): the rules of the board of every game
+
+        Attributes:
+            ring (HashRing): game id -> worker index
+            ports (list): the loopback port of each worker, once started
+            connections (int): the number of connections handed over
+        """
+        self.rules = board_rules
+        self.workers = workers or os.cpu_count() or 1
+        self.ring = HashRing(range(self.workers))
+        self.ports = []
+        self.connections = 0
+        self._processes = []
+        # the host's end of the channel to each worker, to hand sockets over
+        self._channels = []
+        # one handover at a time on each channel, created in serve()
+        self._channel_locks = []
+        # the worker of the next connection that does not name a game
+        self._turns = itertools.cycle(range(self.workers))
+        self._listener = None
+        self._accepting = None
+        # a connection to each worker to ask for its statistics
+        self._control = []
+        self._stats_lock = None
+
+    def start_workers(self):
+        """
+        Start the worker processes and wait until they all listen.
+        """
+        r = self.rules
+        pipes = []
+        for index in range(self.workers):
+            pipe, worker_pipe = multiprocessing.Pipe()
+            channel, worker_channel = socket.socketpair(
+                socket.AF_UNIX, socket.SOCK_SEQPACKET
+            )
+            process = multiprocessing.Process(
+                target=_run_worker,
+                args=(
+                    index,
+                    self.workers,
+                    r.rows,
+                    r.cols,
+                    r.k,
+                    worker_pipe,
+                    worker_channel,
+                ),
+                daemon=True,
+            )
+            process.start()
+            worker_channel.close()
+            # the accept loop must not wait on a worker's full channel
+            channel.setblocking(False)
+            self._processes.append(process)
+            self._channels.append(channel)
+            pipes.append(pipe)
+        self.ports = [pipe.recv() for pipe in pipes]
+        for pipe in pipes:
+            pipe.send(self.ports)
+            pipe.close()
+
+    def stop_workers(self):
+        """
+        Stop the worker processes.
+        """
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+        for channel in self._channels:
+            channel.close()
+        self._processes = []
+        self._channels = []
+
+    async def serve(self, host=server.HOST, port=server.PORT):
+        """
+        Start accepting connections, once the workers are started.
+
+        Parameters:
+            host (str): the address to listen on
+            port (int): the port to listen on, 0 for any free port
+
+        Returns:
+            socket.socket: the listening socket
+        """
+        self._stats_lock = asyncio.Lock()
+        self._channel_locks = [asyncio.Lock() for _ in self._channels]
+        self._control = [
+            await asyncio.open_connection(server.HOST, worker_port)
+            for worker_port in self.ports
+        ]
+        self._listener = socket.create_server((host, port), backlog=1024)
+        self._listener.setblocking(False)
+        self._accepting = asyncio.create_task(self._accept())
+        return self._listener
+
+    def close(self):
+        """
+        Stop accepting connections.
+        """
+        if self._accepting is not None:
+            self._accepting.cancel()
+            self._listener.close()
+            self._accepting = None
+
+    async def stats(self):
+        """
+        Return the statistics of all workers together.
+
+        Returns:
+            dict: the counts of WorkerServer.stats() added up over the
+            workers, the highest p50 and p99 move handling time of a
+            worker, the number of workers, and the games and CPU time
+            of each
+        """
+        async with self._stats_lock:
+            per_worker = [await _ask_stats(connection) for connection in self._control]
+        return _combine(per_worker)
+
+    async def _accept(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            connection, _ = await loop.sock_accept(self._listener)
+            loop.create_task(self._hand_over(connection))
+
+    async def _hand_over(self, connection):
+        # read the first request of a connection and hand the connection
+        # over to the worker of its game
+        loop = asyncio.get_running_loop()
+        data = b""
+        try:
+            while b"\n" not in data and len(data) < HANDOFF_SIZE:
+                chunk = await loop.sock_recv(connection, HANDOFF_SIZE)
+                if not chunk:
+                    return
+                data += chunk
+            game_id = _game_id(data.split(b"\n", 1)[0].split())
+            if game_id is None:
+                worker = next(self._turns)
+            else:
+                worker = self.ring.lookup(game_id)
+            async with self._channel_locks[worker]:
+                await _send_fds(self._channels[worker], data, connection.fileno())
+            self.connections += 1
+        except OSError:
+            pass
+        finally:
+            # the worker has its own copy of the socket, which stays open
+            connection.close()
+
+
+async def run(host, port, workers, board_rules, stats_interval=None):
+    """
+    Start the workers and serve games until cancelled.
+
+    Parameters:
+        host (str): the address to listen on
+        port (int): the port to listen on
+        workers (int): the number of worker processes
+        board_rules (rules.Rules): the rules of the board of every game
+        stats_interval (float): print the statistics every this many
+            seconds, defaults to None to not print them
+    """
+    game_host = Host(workers, board_rules)
+    game_host.start_workers()
+    try:
+        listener = await game_host.serve(host, port)
+        print(
+            f"Serving {board_rules!r} games on {listener.getsockname()} "
+            f"with {game_host.workers} workers"
+        )
+        try:
+            while True:
+                await asyncio.sleep(stats_interval or 3600)
+                if stats_interval:
+                    print(await game_host.stats())
+        finally:
+            game_host.close()
+    finally:
+        game_host.stop_workers()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host games on many cores.")
+    parser.add_argument("--host", default=server.HOST)
+    parser.add_argument("--port", type=int, default=server.PORT)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--size", type=int, default=3)
+    parser.add_argument("--win-length", type=int, default=None)
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=None,
+        help="print the statistics every this many seconds",
+    )
+    args = parser.parse_args()
+    win_length = args.win_length or min(args.size, 5)
+    try:
+        board_rules = rules.Rules(args.size, args.size, win_length)
+    except ValueError as error:
+        parser.error(str(error))
+    # stop on SIGTERM as on Ctrl-C, so the workers are stopped too
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(
+            run(args.host, args.port, args.workers, board_rules, args.stats_interval)
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,20 @@
+import time
+
+# the startup report measures from here, before pygame is imported
+STARTUP_BEGIN = time.perf_counter()
+
+import argparse
 import asyncio
 import pygame
 import sys
 import os
+from collections import OrderedDict
 
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
+import history
+import profiler
+import records
+import rules
 
-# Initialize Pygame
-pygame.init()
 WIDTH, HEIGHT = 1000, 1000
 TITLE_WIDTH = WIDTH
 TITLE_HEIGHT = 100
@@ -25,12 +33,35 @@ BOARD_WIDTH = 3 * SQUARE_SIZE + 4 * LINE_WIDTH
 BOARD_HEIGHT = 3 * SQUARE_SIZE + 4 * LINE_WIDTH
 BOARD_LEFT_MARGIN = (WIDTH - BOARD_WIDTH) // 2
 BOARD_TOP_MARGIN = TITLE_HEIGHT + (BODY_HEIGHT - BOARD_HEIGHT) // 2
-BOARD_ROWS = 3
-BOARD_COLS = 3
+BOARD_ROWS = rules.BOARD_ROWS
+BOARD_COLS = rules.BOARD_COLS
 CIRCLE_RADIUS = 60
 CIRCLE_WIDTH = 15
 CROSS_WIDTH = 25
 SPACE = 55
+# the time the computer may think on boards larger than 3x3
+AI_BUDGET_MS = 200
+# redraw and update only the changed parts of the screen
+DIRTY_RECTS = True
+# the most rendered text surfaces to keep
+TEXT_CACHE_SIZE = 64
+# the most frames per second while there is input or animation
+FPS = 60
+# the time the main loop sleeps while there is no input, in seconds
+IDLE_INTERVAL = 0.05
+# the size of the grid cells of the SpatialIndex of clickable widgets
+SPATIAL_CELL_SIZE = 100
+# the key that shows and hides the frame-time overlay
+OVERLAY_KEY = pygame.K_F3
+# the keys that undo and redo a move, and jump to the start and end of the game
+UNDO_KEY = pygame.K_LEFT
+REDO_KEY = pygame.K_RIGHT
+FIRST_MOVE_KEY = pygame.K_HOME
+LAST_MOVE_KEY = pygame.K_END
+OVERLAY_RECT = (8, 8, 240, 84)
+OVERLAY_FONT_SIZE = 14
+# the frame time at the top of the overlay graph, two frames at 60 fps
+OVERLAY_GRAPH_MS = 33.3
 
 FOOTER_TOP_MARGIN = HEIGHT - FOOTER_HEIGHT
 
@@ -56,13 +87,178 @@ LINE_COLOR = (255, 255, 255)
 CIRCLE_COLOR = (239, 231, 200)
 CROSS_COLOR = (66, 66, 66)
 
-# arial_30 = pygame.font.Font("arial.ttf", size=30)
-TITLE_FONT_FAMILY = "arial"
+# the font file shipped next to this script, loaded without a system font scan
+FONT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "arial.ttf")
 TITLE_FONT_SIZE = 50
-TITLE_FONT = pygame.font.SysFont(TITLE_FONT_FAMILY, TITLE_FONT_SIZE, bold=True)
-BUTTON_FONT_FAMILY = "arial"
 BUTTON_FONT_SIZE = 20
-BUTTON_FONT = pygame.font.SysFont(BUTTON_FONT_FAMILY, size=BUTTON_FONT_SIZE)
+# the fonts are loaded by init(), so the rules can be used without a display
+TITLE_FONT = None
+BUTTON_FONT = None
+# loaded when the overlay is first shown
+OVERLAY_FONT = None
+
+
+class StartupTimer:
+    def __init__(self, begin=None):
+        """
+        Initialize a StartupTimer object.
+
+        The timer records how long each phase of the startup took,
+        up to the first frame on the screen.
+
+        Parameters:
+            begin (float): the time.perf_counter() value the first
+                phase started at, defaults to now
+        """
+        self.begin = time.perf_counter() if begin is None else begin
+        self.last = self.begin
+        self.phases = []
+
+    def mark(self, phase):
+        """
+        Record that a phase of the startup has finished.
+
+        Parameters:
+            phase (str): the name of the phase
+        """
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        """
+        Return the time of each phase and the total time, in milliseconds.
+
+        Returns:
+            str: the report, one phase per line
+        """
+        lines = [
+            f"{phase:<20}{seconds * 1000:8.1f} ms" for phase, seconds in self.phases
+        ]
+        lines.append(
+            f"{'time to first frame':<20}{(self.last - self.begin) * 1000:8.1f} ms"
+        )
+        return "\n".join(lines)
+
+
+STARTUP = StartupTimer(STARTUP_BEGIN)
+
+
+def load_font(size, bold=False):
+    """
+    Load the bundled font file at the given size.
+
+    Parameters:
+        size (int): the size of the font
+        bold (bool): whether to render the font in bold, defaults to False
+
+    Returns:
+        pygame.font.Font: the loaded font
+    """
+    font = pygame.font.Font(FONT_FILE, size)
+    font.set_bold(bold)
+    return font
+
+
+def init():
+    """
+    Initialize the parts of Pygame the game uses and load the fonts.
+
+    Only the display and font modules are initialized. Audio, joystick
+    and the other modules are left alone, as the game does not use
+    them. The fonts are loaded from the bundled font file instead of
+    looking them up among the system fonts. The game's files are found
+    next to this module, so the working directory is left alone and
+    relative paths given on the command line stay relative to it.
+
+    This is only needed to open the game window. The Board rules can
+    be used without calling it, e.g. for headless simulation.
+    """
+    global TITLE_FONT, BUTTON_FONT
+    pygame.display.init()
+    STARTUP.mark("display init")
+    pygame.font.init()
+    STARTUP.mark("font init")
+    TITLE_FONT = load_font(TITLE_FONT_SIZE, bold=True)
+    BUTTON_FONT = load_font(BUTTON_FONT_SIZE)
+    STARTUP.mark("load fonts")
+
+
+class TextCache:
+    def __init__(self, maxsize=TEXT_CACHE_SIZE):
+        """
+        Initialize a TextCache object.
+
+        The cache keeps rendered text surfaces, keyed on (font, text,
+        color, antialias), so the same text is only rendered once. When
+        it is full, the least recently used surface is dropped.
+
+        Parameters:
+            maxsize (int): the most surfaces to keep, defaults to TEXT_CACHE_SIZE
+
+        Attributes:
+            hits (int): the number of renders served from the cache
+            misses (int): the number of renders that had to render the text
+        """
+        self.maxsize = maxsize
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color, antialias=True):
+        """
+        Render text, or return the surface it was rendered to before.
+
+        Parameters:
+            font (pygame.font.Font): the font to render with
+            text (str): the text to render
+            color (tuple): the color of the text
+            antialias (bool): whether to antialias the text, defaults to True
+
+        Returns:
+            pygame.Surface: the rendered text, which must not be drawn on
+        """
+        key = (font, text, tuple(color), antialias)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.maxsize:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):
+        """
+        Drop all cached surfaces and reset the hit and miss counters.
+        """
+        self.surfaces.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+TEXT_CACHE = TextCache()
+
+
+def render_text(font, text, color, antialias=True):
+    """
+    Render text through the shared TEXT_CACHE.
+
+    All text of the game should be rendered with this function.
+
+    Parameters:
+        font (pygame.font.Font): the font to render with
+        text (str): the text to render
+        color (tuple): the color of the text
+        antialias (bool): whether to antialias the text, defaults to True
+
+    Returns:
+        pygame.Surface: the rendered text, which must not be drawn on
+    """
+    return TEXT_CACHE.render(font, text, color, antialias)
 
 
 def create_screen():
@@ -90,7 +286,7 @@ def draw_title(screen):
         The screen to draw the title on.
 
     """
-    title_text = TITLE_FONT.render("TIC TAC TOE", True, TITLE_COLOR)
+    title_text = render_text(TITLE_FONT, "TIC TAC TOE", TITLE_COLOR)
     title_rect = title_text.get_rect(center=(TITLE_WIDTH // 2, TITLE_HEIGHT // 2))
     pygame.draw.rect(screen, TITLE_BG_COLOR, (0, 0, TITLE_WIDTH, TITLE_HEIGHT))
     screen.blit(title_text, title_rect)
@@ -148,6 +344,228 @@ def draw_footer(screen, button=None):
         button.draw(screen)
 
 
+def draw_button(screen, button):
+    """
+    Redraw a footer button on its own, e.g. after its hover state changed.
+
+    The footer background is painted behind the button first, so that
+    its rounded corners are drawn cleanly.
+
+    Parameters
+    ----------
+    screen : pygame.Surface
+        The surface to draw the button on
+    button : Button
+        The button to redraw
+
+    Returns
+    -------
+    pygame.Rect
+        The area of the screen that was redrawn
+    """
+    screen.fill(FOOTER_BG_COLOR, button.rect)
+    button.draw(screen)
+    return button.rect
+
+
+def draw_overlay(screen, frame_profiler):
+    """
+    Draw the frame-time overlay in the corner of the title bar.
+
+    The overlay shows the frame rate, the 50th and 99th percentile
+    frame times, and a graph of the times of the last frames, the
+    newest on the right, with a line at each percentile.
+
+    Parameters:
+        screen (pygame.Surface): the surface to draw on
+        frame_profiler (profiler.FrameProfiler): the profiled frames
+
+    Returns:
+        pygame.Rect: the area of the screen that was drawn
+    """
+    global OVERLAY_FONT
+    if OVERLAY_FONT is None:
+        OVERLAY_FONT = load_font(OVERLAY_FONT_SIZE)
+    rect = pygame.Rect(OVERLAY_RECT)
+    screen.fill(BLACK, rect)
+    times = frame_profiler.frame_times()
+    ordered = sorted(times)
+    p50 = profiler.percentile(ordered, 50) * 1000
+    p99 = profiler.percentile(ordered, 99) * 1000
+    fps = frame_profiler.fps()
+    # the text is an f-string literal, so build_web.py can subset the font for it
+    text = render_text(
+        OVERLAY_FONT, f"{fps:.0f} FPS  p50 {p50:.1f} ms  p99 {p99:.1f} ms", WHITE
+    )
+    screen.blit(text, (rect.x + 4, rect.y + 4))
+
+    graph = rect.inflate(-8, -8)
+    graph.top += OVERLAY_FONT_SIZE + 8
+    graph.height -= OVERLAY_FONT_SIZE + 8
+    scale = graph.height / OVERLAY_GRAPH_MS
+
+    def height(ms):
+        return min(graph.height, round(ms * scale))
+
+    x = graph.right - min(len(times), graph.width)
+    for seconds in times[-graph.width :]:
+        pygame.draw.line(
+            screen,
+            WHITE,
+            (x, graph.bottom - 1),
+            (x, graph.bottom - height(seconds * 1000)),
+        )
+        x += 1
+    for ms, color in ((p50, GREEN), (p99, RED)):
+        y = graph.bottom - height(ms)
+        pygame.draw.line(screen, color, (graph.left, y), (graph.right - 1, y))
+    return rect
+
+
+def theme():
+    """
+    Return the colors that the cached surfaces are drawn with.
+
+    Returns:
+        tuple: the current theme colors, compared by SurfaceCache to
+        notice a change of theme
+    """
+    return (
+        tuple(BG_COLOR),
+        tuple(BOARD_COLOR),
+        tuple(LINE_COLOR),
+        tuple(TITLE_BG_COLOR),
+        tuple(TITLE_COLOR),
+        tuple(FOOTER_BG_COLOR),
+        tuple(X_COLOR),
+        tuple(O_COLOR),
+        tuple(BLACK),
+    )
+
+
+class SurfaceCache:
+    def __init__(self):
+        """
+        Initialize a SurfaceCache object.
+
+        The cache holds pre-rendered surfaces, so frames are composed by
+        blitting instead of rasterizing rectangles, lines and circles:
+
+        Attributes:
+            background (pygame.Surface): the whole screen without any
+                markers or buttons: the title bar, the footer and the
+                empty board with its grid lines
+            sprites (dict): the sprites of each marker, keyed on the
+                marker, as a tuple of the plain and the highlighted
+                sprite, so sprites[marker][highlight] is looked up
+                without building a key
+            builds (int): how often the surfaces have been rendered
+            board (Board): the board the cache was last validated for
+        """
+        self.key = None
+        self.board = None
+        self.background = None
+        self.sprites = {}
+        self.builds = 0
+
+    def invalidate(self):
+        """
+        Drop the cached surfaces, so they are rendered again on next use.
+        """
+        self.key = None
+        self.board = None
+
+    def validate(self, screen, board):
+        """
+        Make sure the cached surfaces match the screen, board and theme.
+
+        The surfaces are only rendered again when the screen size, the
+        board geometry or the theme colors changed since the last call.
+
+        Parameters:
+            screen (pygame.Surface): the surface the board is drawn on
+            board (Board): the board to draw
+
+        Returns:
+            SurfaceCache: this cache
+        """
+        key = (
+            screen.get_size(),
+            board.rules.rows,
+            board.rules.cols,
+            board.layout.square_size,
+            theme(),
+        )
+        if key != self.key:
+            self._render(screen, board)
+            self.key = key
+        self.board = board
+        return self
+
+    def _render(self, screen, board):
+        background = pygame.Surface(screen.get_size())
+        board.draw_background(background)
+        if TITLE_FONT:
+            draw_title(background)
+        draw_footer(background)
+        self.background = self._convert(background)
+        self.sprites = {
+            marker: tuple(
+                self._render_sprite(board, marker, highlight)
+                for highlight in (False, True)
+            )
+            for marker in (rules.X, rules.O)
+        }
+        self.builds += 1
+
+    def _render_sprite(self, board, marker, highlight):
+        """
+        Render the marker of a square.
+
+        If the square is highlighted, it is drawn on the background color.
+        Otherwise, it is drawn on black.
+        """
+        layout = board.layout
+        size = layout.square_size
+        space = layout.space
+        sprite = pygame.Surface((size, size))
+        sprite.fill(BG_COLOR if highlight else BLACK)
+        if marker == rules.X:
+            pygame.draw.line(
+                sprite,
+                X_COLOR,
+                (space, space),
+                (size - space, size - space),
+                layout.cross_width,
+            )
+            pygame.draw.line(
+                sprite,
+                X_COLOR,
+                (size - space, space),
+                (space, size - space),
+                layout.cross_width,
+            )
+        else:
+            pygame.draw.circle(
+                sprite,
+                O_COLOR,
+                (size // 2, size // 2),
+                layout.circle_radius,
+                layout.circle_width,
+            )
+        return self._convert(sprite)
+
+    @staticmethod
+    def _convert(surface):
+        # match the pixel format of the display, which makes blits faster
+        if pygame.display.get_surface() is not None:
+            return surface.convert()
+        return surface
+
+
+SURFACE_CACHE = SurfaceCache()
+
+
 class Button:
     def __init__(
         self,
@@ -189,7 +607,7 @@ class Button:
         if font:
             self.font = font
         else:
-            self.font = pygame.font.SysFont("arial", 30, bold=True)
+            self.font = load_font(30, bold=True)
         self.text_color = text_color
         self.button_color = button_color
         self.button_hover_color = button_hover_color
@@ -198,6 +616,10 @@ class Button:
         self.color = button_color
         self.hover_color = button_hover_color
         self.is_hovered = False
+        # the rendered text and its position, set on the first draw
+        self._label = None
+        self._label_text = None
+        self._label_rect = None
 
     def set_action(self, action):
         """
@@ -229,9 +651,12 @@ class Button:
             surface, current_color, self.rect, border_radius=self.border_radius
         )
 
-        text_surface = self.font.render(self.text, True, BLACK)
-        text_rect = text_surface.get_rect(center=self.rect.center)
-        surface.blit(text_surface, text_rect)
+        # the text is only rendered and centered again when it changed
+        if self._label_text is not self.text:
+            self._label = render_text(self.font, self.text, BLACK)
+            self._label_rect = self._label.get_rect(center=self.rect.center)
+            self._label_text = self.text
+        surface.blit(self._label, self._label_rect)
 
     # return True if the hover state changes or button was clicked
     def update(self, event, screen):
@@ -294,33 +719,92 @@ class Button:
 
 
 class Square:
-    def __init__(self, x, y, size):
+    __slots__ = ("board", "row", "col", "bit", "index")
+
+    def __init__(self, board, row, col):
         """
         Initialize a Square object.
 
+        A Square is a rendering view over one bit of the board state. The
+        marker and highlight of the square are read from the bitboards of
+        the Board it belongs to, and its position on the screen from the
+        BoardLayout of the board.
+
         Parameters:
-            x (int): the x coordinate of the top left corner of the square
-            y (int): the y coordinate of the top left corner of the square
-            size (int): the size of the square
+            board (Board): the board that holds the game state
+            row (int): the row of the square on the board
+            col (int): the column of the square on the board
 
         Attributes:
-            x (int): the x coordinate of the top left corner of the square
-            y (int): the y coordinate of the top left corner of the square
-            xy1 (tuple): the coordinates of the top left corner of the square
-            xy2 (tuple): the coordinates of the bottom right corner of the square
-            size (int): the size of the square
-            marker (str): the marker of the square, can be None, "X", or "O"
-            highlight (bool): whether the square is highlighted
-        """
-        self.x = x
-        self.y = y
-        self.xy1 = (x, y)
-        self.xy2 = (x + size, y + size)
-        self.size = size
-        # marker can be None, "X", or "O"
-        self.marker = None
-        # when 3 markers are in a straight line
-        self.highlight = False
+            bit (int): the bit of the square in the board's bitboards
+            index (int): the index of the square, row * cols + col
+        """
+        self.board = board
+        self.row = row
+        self.col = col
+        self.bit = board.rules.cell_bit(row, col)
+        self.index = row * board.rules.cols + col
+
+    @property
+    def x(self):
+        """
+        The x coordinate of the top left corner of the square.
+        """
+        return self.board.layout.rects[self.index].x
+
+    @property
+    def y(self):
+        """
+        The y coordinate of the top left corner of the square.
+        """
+        return self.board.layout.rects[self.index].y
+
+    @property
+    def size(self):
+        """
+        The size of the square.
+        """
+        return self.board.layout.square_size
+
+    @property
+    def xy1(self):
+        """
+        The coordinates of the top left corner of the square.
+        """
+        return self.board.layout.rects[self.index].topleft
+
+    @property
+    def xy2(self):
+        """
+        The coordinates of the bottom right corner of the square.
+        """
+        return self.board.layout.rects[self.index].bottomright
+
+    @property
+    def rect(self):
+        """
+        The area of the square on the screen, as a pygame.Rect shared by
+        every board of its size, which must not be changed.
+        """
+        return self.board.layout.rects[self.index]
+
+    @property
+    def marker(self):
+        """
+        The marker of the square, can be None, "X", or "O".
+        """
+        return self.board.marker_at(self.bit)
+
+    @marker.setter
+    def marker(self, marker):
+        self.board.set_marker(self.bit, marker)
+
+    @property
+    def highlight(self):
+        """
+        Whether the square is part of the winning line.
+        """
+        return bool(self.board.win_mask & self.bit)
 
     def point_in_square(self, x, y):
         """
@@ -333,193 +817,443 @@ class Square:
         Returns:
             bool: True if the point is inside the square, False otherwise
         """
-        return (
-            x > self.x
-            and x < self.x + self.size
-            and y > self.y
-            and y < self.y + self.size
-        )
+        rect = self.rect
+        return rect.left < x < rect.right and rect.top < y < rect.bottom
 
     def draw(self, screen):
         """
         Draw a square on the given screen.
 
-        If the square has a marker, it will be drawn in the correct color.
-        If the square is highlighted, it will be drawn in the background color.
-        Otherwise, it will be drawn in black.
+        If the square has a marker, its pre-rendered sprite from
+        SURFACE_CACHE is blitted onto the square. The sprites must be up
+        to date for the board, which Board.draw_squares takes care of.
 
         Parameters:
             screen (pygame.Surface): The screen to draw on.
         """
-        if not self.marker:
+        marker = self.marker
+        if not marker:
             return
+        screen.blit(SURFACE_CACHE.sprites[marker][self.highlight], self.rect)
+
+
+class BoardLayout:
+    __slots__ = (
+        "line_width",
+        "square_size",
+        "width",
+        "height",
+        "left",
+        "top",
+        "rect",
+        "space",
+        "cross_width",
+        "circle_radius",
+        "circle_width",
+        "rects",
+    )
 
-        if self.highlight:
-            color = BG_COLOR
-        else:
-            color = BLACK
-        pygame.draw.rect(
-            screen,
-            color,
-            (self.x, self.y, self.size, self.size),
+    def __init__(self, rows, cols):
+        """
+        Initialize a BoardLayout object.
+
+        The layout is the geometry of a board on the screen, which is the
+        same as the module constants on a 3x3 board. The squares, grid
+        lines and markers are scaled down so that boards larger than 3x3
+        fit in the same area. It only depends on the size of the board,
+        so every board of a size shares one, see board_layout.
+
+        Parameters:
+            rows (int): the number of rows
+            cols (int): the number of columns
+
+        Attributes:
+            rect (pygame.Rect): the area of the board on the screen
+            rects (tuple): the pygame.Rect of each square, in bit order
+        """
+        self.line_width = max(2, LINE_WIDTH * BOARD_ROWS // max(rows, cols))
+        self.square_size = min(
+            (BOARD_WIDTH - (cols + 1) * self.line_width) // cols,
+            (BOARD_HEIGHT - (rows + 1) * self.line_width) // rows,
         )
-        if self.marker == "X":
-            start = (self.x + SPACE, self.y + SPACE)
-            end = (self.x + self.size - SPACE, self.y + self.size - SPACE)
-            pygame.draw.line(screen, X_COLOR, start, end, CROSS_WIDTH)
-            start = (self.x + self.size - SPACE, self.y + SPACE)
-            end = (self.x + SPACE, self.y + self.size - SPACE)
-            pygame.draw.line(screen, X_COLOR, start, end, CROSS_WIDTH)
-        elif self.marker == "O":
-            pygame.draw.circle(
-                screen,
-                O_COLOR,
-                (self.x + self.size // 2, self.y + self.size // 2),
-                CIRCLE_RADIUS,
-                CIRCLE_WIDTH,
+        self.width = cols * self.square_size + (cols + 1) * self.line_width
+        self.height = rows * self.square_size + (rows + 1) * self.line_width
+        self.left = (WIDTH - self.width) // 2
+        self.top = TITLE_HEIGHT + (BODY_HEIGHT - self.height) // 2
+        self.rect = pygame.Rect(self.left, self.top, self.width, self.height)
+        scale = self.square_size / SQUARE_SIZE
+        self.space = round(SPACE * scale)
+        self.cross_width = max(1, round(CROSS_WIDTH * scale))
+        self.circle_radius = max(1, round(CIRCLE_RADIUS * scale))
+        self.circle_width = max(1, round(CIRCLE_WIDTH * scale))
+
+        step = self.square_size + self.line_width
+        self.rects = tuple(
+            pygame.Rect(
+                self.left + col * step + self.line_width,
+                self.top + row * step + self.line_width,
+                self.square_size,
+                self.square_size,
             )
+            for row in range(rows)
+            for col in range(cols)
+        )
+
+
+# (rows, cols) -> the BoardLayout shared by every board of that size
+_LAYOUTS = {}
+
+
+def board_layout(rows, cols):
+    """
+    Return the layout of a board, shared by every board of its size.
+    """
+    layout = _LAYOUTS.get((rows, cols))
+    if layout is None:
+        layout = _LAYOUTS[rows, cols] = BoardLayout(rows, cols)
+    return layout
 
 
 class Board:
-    def __init__(self):
+    __slots__ = (
+        "rules",
+        "layout",
+        "winner",
+        "x_bits",
+        "o_bits",
+        "win_mask",
+        "last_move",
+        "moves",
+        "engine",
+        "_squares",
+        "_square_list",
+    )
+
+    def __init__(self, rows=BOARD_ROWS, cols=BOARD_COLS, win_length=BOARD_ROWS):
         """
         Initialize a Board object.
 
-        This function initializes a Board object by creating a 2D list of Square objects
-        and storing them in the Board object's `squares` attribute.
+        The game state is held in two bitboards, `x_bits` and `o_bits`,
+        with one bit per square (see rules.py). The `squares` attribute
+        is a 2D list of Square objects that render that state, created
+        the first time it is used, so a board that is only played on,
+        e.g. by simulate.py, holds the state alone. The rules and the
+        layout are shared with the other boards of the same size.
 
         The Board object represents a Tic Tac Toe game board.
+
+        Parameters:
+            rows (int): the number of rows, defaults to BOARD_ROWS
+            cols (int): the number of columns, defaults to BOARD_COLS
+            win_length (int): the number of markers in a line needed
+                to win, defaults to 3
         """
+        self.rules = rules.shared(rows, cols, win_length)
+        self.layout = board_layout(rows, cols)
         self.winner = None
-        self.squares = [[None] * 3 for _ in range(3)]
-        # create Square objects and store them in the 2D list
-        for row in range(3):
-            for col in range(3):
-                x = BOARD_LEFT_MARGIN + col * (SQUARE_SIZE + LINE_WIDTH) + LINE_WIDTH
-                y = BOARD_TOP_MARGIN + row * (SQUARE_SIZE + LINE_WIDTH) + LINE_WIDTH
-                square = Square(x, y, SQUARE_SIZE)
-                self.squares[row][col] = square
+        self.x_bits = 0
+        self.o_bits = 0
+        # the mask of the winning line, 0 while there is no winner
+        self.win_mask = 0
+        # the bit of the last square played, 0 before the first move
+        self.last_move = 0
+        # the indices of the squares played, in order, for records.py
+        self.moves = []
+        # the search engine for the computer player, an alpha-beta
+        # search.Engine is created on first use if none is set
+        self.engine = None
+        self._squares = None
+        self._square_list = None
+
+    @property
+    def squares(self):
+        """
+        The Square objects of the board, as a 2D list indexed by row and
+        column.
+        """
+        if self._squares is None:
+            self._squares = [
+                [Square(self, row, col) for col in range(self.rules.cols)]
+                for row in range(self.rules.rows)
+            ]
+            self._square_list = tuple(square for row in self._squares for square in row)
+        return self._squares
+
+    @property
+    def square_list(self):
+        """
+        The Square objects of the board in bit order, so drawing walks
+        one flat tuple.
+        """
+        if self._square_list is None:
+            self.squares
+        return self._square_list
+
+    @property
+    def rect(self):
+        """
+        The area of the board on the screen.
+        """
+        return self.layout.rect
 
     def reset(self):
         """
-        Reset the board by setting the marker and highlight of each square
-        to None and False respectively.
+        Reset the board by clearing both bitboards and the winning line.
+        """
+        self.winner = None
+        self.x_bits = 0
+        self.o_bits = 0
+        self.win_mask = 0
+        self.last_move = 0
+        self.moves.clear()
+
+    def load_state(self, state, line, ply):
+        """
+        Set the board to a position of a line of play, e.g. of a
+        history.History.
+
+        The moves of the board must be the start of the same line, as
+        they are when the board follows the history, so only the moves
+        between the two positions are dropped or added: a step back or
+        forth takes the same time however long the game is.
+
+        Parameters:
+            state (int): the state of the position, see rules.py
+            line (list): the squares of the line of play, in order
+            ply (int): the number of moves of the line up to the position
         """
+        self.x_bits, self.o_bits = self.rules.state_bits(state)
+        moves = self.moves
+        if ply < len(moves):
+            del moves[ply:]
+        else:
+            moves.extend(line[len(moves) : ply])
+        self.last_move = 1 << moves[-1] if moves else 0
         self.winner = None
-        for row in range(3):
-            for col in range(3):
-                self.squares[row][col].marker = None
-                self.squares[row][col].highlight = False
+        self.win_mask = 0
+        self.check_winner()
+
+    def marker_at(self, bit):
+        """
+        Return the marker on the square with the given bit.
+
+        Parameters:
+            bit (int): the bit of the square
+
+        Returns:
+            str: "X", "O", or None if the square is empty
+        """
+        if self.x_bits & bit:
+            return rules.X
+        if self.o_bits & bit:
+            return rules.O
+        return None
+
+    def set_marker(self, bit, marker):
+        """
+        Place a marker on the square with the given bit.
+
+        Parameters:
+            bit (int): the bit of the square
+            marker (str): "X", "O", or None to clear the square
+        """
+        square = bit.bit_length() - 1
+        if (self.x_bits | self.o_bits) & bit:
+            self.moves.remove(square)
+        if marker:
+            self.moves.append(square)
+        self.x_bits &= ~bit
+        self.o_bits &= ~bit
+        self.last_move = bit if marker else 0
+        if marker == rules.X:
+            self.x_bits |= bit
+        elif marker == rules.O:
+            self.o_bits |= bit
+
+    def empty_squares(self):
+        """
+        Return a bitboard of the squares that have no marker.
+        """
+        return self.rules.empty_squares(self.x_bits, self.o_bits)
+
+    def turn(self):
+        """
+        Return the marker of the player to move.
+
+        X moves first, so it is X's turn when both players have
+        the same number of markers on the board.
+        """
+        if self.x_bits.bit_count() == self.o_bits.bit_count():
+            return rules.X
+        return rules.O
+
+    def best_move(self, budget_ms=AI_BUDGET_MS):
+        """
+        Return the best move for the player to move.
+
+        On the standard board the move is looked up in the precomputed
+        tablebase, and only searched for if the tablebase file is not
+        available. Larger boards are searched by the board's engine
+        (alpha-beta unless another one is set) for at most budget_ms
+        milliseconds.
+
+        Parameters:
+            budget_ms (float): the time to search on boards larger than
+                3x3, defaults to AI_BUDGET_MS
+
+        Returns:
+            int: the bit of the square to play, or 0 if the game is over
+        """
+        if not self.rules.is_standard:
+            if self.engine is None:
+                import search
+
+                self.engine = search.Engine(self.rules)
+            self.engine.budget_ms = budget_ms
+            return self.engine.best_move(self.x_bits, self.o_bits)
+        # the AI modules are only imported when the computer first moves
+        import tablebase
+
+        table = tablebase.open_default()
+        if table is not None:
+            return table.best_move(self.x_bits, self.o_bits)
+        import ai
+
+        return ai.best_move(self.x_bits, self.o_bits)
+
+    def play(self, bit, marker):
+        """
+        Place a marker on a square and check if the game is over.
+
+        Parameters:
+            bit (int): the bit of the square
+            marker (str): "X" or "O"
+
+        Returns:
+            bool: True if the move won or drew the game
+        """
+        self.set_marker(bit, marker)
+        return self.check_winner() or self.check_draw()
 
     def draw(self, screen):
         """
         Draw the board on the screen.
 
+        This function blits the cached static background of the screen,
+        which holds the title bar, the footer and the empty board, and
+        draws the markers for each square in the grid.
+
+        Parameters:
+            screen (pygame.Surface): the surface to draw on
+        """
+        cache = SURFACE_CACHE.validate(screen, self)
+        screen.blit(cache.background, (0, 0))
+        self.draw_squares(screen, self.rules.full_mask)
+
+    def draw_background(self, screen):
+        """
+        Draw the empty board on the screen.
+
         This function fills the screen with the background color,
-        draws a filled rectangle for the board, draws horizontal and
-        vertical lines for the grid, and draws the markers for each
-        square in the grid.
+        draws a filled rectangle for the board, and draws horizontal and
+        vertical lines for the grid. It is used to render the cached
+        background, see SurfaceCache.
 
         Parameters:
             screen (pygame.Surface): the surface to draw on
         """
+        layout = self.layout
         screen.fill(BG_COLOR)
         # draw a filled rectangle before the lines
         pygame.draw.rect(
             screen,
             BOARD_COLOR,
-            (BOARD_LEFT_MARGIN, BOARD_TOP_MARGIN, BOARD_WIDTH, BOARD_HEIGHT),
+            (layout.left, layout.top, layout.width, layout.height),
         )
-        x = BOARD_LEFT_MARGIN
-        y = BOARD_TOP_MARGIN + LINE_WIDTH_2
+        x = layout.left
+        y = layout.top + layout.line_width // 2
         # draw horizontal lines
-        for row in range(BOARD_ROWS + 1):
+        for row in range(self.rules.rows + 1):
             pygame.draw.line(
                 screen,
                 LINE_COLOR,
                 (x, y),
-                (x + BOARD_WIDTH, y),
-                LINE_WIDTH,
+                (x + layout.width, y),
+                layout.line_width,
             )
-            y += SQUARE_SIZE + LINE_WIDTH
+            y += layout.square_size + layout.line_width
 
         # draw vertical lines
-        x = BOARD_LEFT_MARGIN + LINE_WIDTH_2
-        y = BOARD_TOP_MARGIN
-        for col in range(BOARD_COLS + 1):
+        x = layout.left + layout.line_width // 2
+        y = layout.top
+        for col in range(self.rules.cols + 1):
             pygame.draw.line(
                 screen,
                 LINE_COLOR,
                 (x, y),
-                (x, y + BOARD_HEIGHT),
-                LINE_WIDTH,
+                (x, y + layout.height),
+                layout.line_width,
             )
-            x += SQUARE_SIZE + LINE_WIDTH
+            x += layout.square_size + layout.line_width
+
+    def draw_squares(self, screen, bits, updates=None):
+        """
+        Redraw only some of the squares of the board.
+
+        Each square is restored from the cached background and its
+        marker sprite is blitted again, without touching the rest of
+        the screen.
 
-        # draw the markers
-        for row in range(3):
-            for col in range(3):
-                square = self.squares[row][col]
+        The cache is fully validated by draw(), which runs whenever
+        the whole screen is redrawn, e.g. after a change of theme. In
+        between, only a switch to another board validates it again, so
+        redrawing squares builds no validation key.
+
+        Parameters:
+            screen (pygame.Surface): the surface to draw on
+            bits (int): the bits of the squares to redraw
+            updates (list): if given, the pygame.Rect of each redrawn
+                square is stored in it at the index of the square, so a
+                list can be reused from frame to frame
+        """
+        cache = SURFACE_CACHE
+        if cache.board is not self:
+            cache.validate(screen, self)
+        background = cache.background
+        index = 0
+        for square in self.square_list:
+            if square.bit & bits:
+                rect = square.rect
+                screen.blit(background, rect, rect)
                 square.draw(screen)
+                if updates is not None:
+                    updates[index] = rect
+            index += 1
 
     def check_winner(self):
         """
         Check if there is a winner in the game.
 
-        This function checks if there is a winner in the game by
-        checking rows, columns, and diagonals. If there is a winner,
-        it highlights the winning row, column, or diagonal and
-        sets the winner attribute to the winner's marker.
+        A game can only be won by the last move, so only the up to 4
+        lines through the last move are checked instead of the whole
+        board. If there is a winner, it stores the winning line in
+        `win_mask` (which highlights its squares) and sets the winner
+        attribute to the winner's marker.
 
         Returns:
             bool: True if there is a winner, False otherwise
         """
-        board = self
-        for row in range(3):
-            if board.squares[row][0].marker and (
-                board.squares[row][0].marker
-                == board.squares[row][1].marker
-                == board.squares[row][2].marker
-            ):
-                # add highlight to the winning row
-                for col in range(3):
-                    board.squares[row][col].highlight = True
-                self.winner = board.squares[row][0].marker
-                return True
-        for col in range(3):
-            if board.squares[0][col].marker and (
-                board.squares[0][col].marker
-                == board.squares[1][col].marker
-                == board.squares[2][col].marker
-            ):
-                # add highlight to the winning column
-                for row in range(3):
-                    board.squares[row][col].highlight = True
-                self.winner = board.squares[0][col].marker
-                return True
-        # if the center square is not filled, there can be
-        # no diagonal winner
-        if not board.squares[1][1].marker:
-            return False
-        if (
-            board.squares[0][0].marker
-            == board.squares[1][1].marker
-            == board.squares[2][2].marker
-        ):
-            # add highlight to the diagonal
-            for row in range(3):
-                board.squares[row][row].highlight = True
-            self.winner = board.squares[0][0].marker
+        if self.winner:
             return True
-        if (
-            board.squares[0][2].marker
-            == board.squares[1][1].marker
-            == board.squares[2][0].marker
-        ):
-            # add highlight to the diagonal
-            for row in range(3):
-                board.squares[row][2 - row].highlight = True
-            self.winner = board.squares[0][2].marker
+        if not self.last_move:
+            return False
+        marker = self.marker_at(self.last_move)
+        bits = self.x_bits if marker == rules.X else self.o_bits
+        row, col = rules.bit_square(self.last_move, self.rules.cols)
+        mask = self.rules.line_through(bits, row, col)
+        if mask:
+            self.win_mask = mask
+            self.winner = marker
             return True
         return False
 
@@ -533,29 +1267,30 @@ class Board:
         Returns:
             bool: True if the game is a draw, False otherwise
         """
-        for row in range(3):
-            for col in range(3):
-                if not self.squares[row][col].marker:
-                    return False
+        if not self.rules.is_full(self.x_bits, self.o_bits):
+            return False
         return not self.check_winner()
 
     def handle_click(self, x, y):
         """
         Handle a click event on the board.
 
-        Iterate through the rows and columns of the board,
-        checking if the click is inside any of the squares. If
-        a square is found, return the square object.
-
-        If no square is found, return None.
+        The row and column of the click are computed directly from
+        the grid geometry. If the click is inside a square, return the
+        square object. Clicks on the grid lines or outside the board
+        return None, the same as Square.point_in_square would.
         """
-        board = self
-        for row in range(3):
-            for col in range(3):
-                square = board.squares[row][col]
-                if square.point_in_square(x, y):
-                    # return row, col
-                    return square
+        layout = self.layout
+        step = layout.square_size + layout.line_width
+        row, offset_y = divmod(y - layout.top - layout.line_width, step)
+        col, offset_x = divmod(x - layout.left - layout.line_width, step)
+        if (
+            0 <= row < self.rules.rows
+            and 0 <= col < self.rules.cols
+            and 0 < offset_x < layout.square_size
+            and 0 < offset_y < layout.square_size
+        ):
+            return self.squares[row][col]
         return None
 
 
@@ -581,90 +1316,709 @@ def is_running_in_browser():
     return False
 
 
-async def main():
+def print_result(board):
     """
-    Main game loop.
+    Print the result of a finished game.
 
-    Initializes the game board, screen, and buttons. Then,
-    enters a loop where it processes events, updates the game
-    state, and redraws the screen.
+    Parameters:
+        board (Board): the board of the finished game
+    """
+    if board.winner:
+        print(f"Player {board.winner} wins!")
+    else:
+        print("It's a draw!")
 
-    Exits the loop when the user closes the window or presses the
-    'q' key when not running in a browser.
+
+class SpatialIndex:
+    def __init__(self, cell_size=SPATIAL_CELL_SIZE, width=WIDTH):
+        """
+        Initialize a SpatialIndex object.
+
+        The index finds the clickable widget under a point without
+        testing every widget. The screen is divided into a grid of
+        cells, and each widget is stored in the cells its rect covers,
+        so a lookup only tests the few widgets of one cell.
+
+        Cells are keyed on their number, row by row, rather than on a
+        (column, row) tuple, so a lookup does not build a key.
+
+        Parameters:
+            cell_size (int): the size of the grid cells in pixels,
+                defaults to SPATIAL_CELL_SIZE
+            width (int): the width of the screen, defaults to WIDTH
+        """
+        self.cell_size = cell_size
+        self.width = width
+        self.columns = (width - 1) // cell_size + 1
+        self.cells = {}
+
+    def insert(self, widget):
+        """
+        Add a widget to the index.
+
+        Widgets added later are on top of widgets added before.
+
+        Parameters:
+            widget: an object with a pygame.Rect `rect` attribute
+        """
+        rect = widget.rect
+        size = self.cell_size
+        left = max(0, rect.left) // size
+        right = (min(self.width, rect.right) - 1) // size
+        for cell_y in range(rect.top // size, (rect.bottom - 1) // size + 1):
+            for cell_x in range(left, right + 1):
+                cell = cell_y * self.columns + cell_x
+                self.cells.setdefault(cell, []).append(widget)
+
+    def at(self, x, y):
+        """
+        Return the topmost widget under a point.
+
+        Parameters:
+            x (int): the x coordinate of the point
+            y (int): the y coordinate of the point
+
+        Returns:
+            the widget whose rect contains the point, or None
+        """
+        if not 0 <= x < self.width:
+            return None
+        size = self.cell_size
+        widgets = self.cells.get(y // size * self.columns + x // size)
+        if widgets:
+            for widget in reversed(widgets):
+                if widget.rect.collidepoint(x, y):
+                    return widget
+        return None
+
+
+def event_position(event, screen):
     """
-    browser = is_running_in_browser()
-    board = Board()
-    screen = create_screen()
-    board.draw(screen)
-    draw_title(screen)
-    button = create_button(action=board.reset)
-    draw_footer(screen, button)
-    # refresh the screen
-    pygame.display.flip()
-    running = True
-    current_marker = "X"
-    game_started = False
-    update = False
-    while running:
-        for event in pygame.event.get():
-            # Check if the user closed the window
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            # Check if the user pressed a key or clicked the mouse
-            if (
-                event.type == pygame.KEYDOWN
-                or event.type == pygame.MOUSEBUTTONDOWN
-                or event.type == pygame.FINGERDOWN
+    Return the screen position of a mouse or touch event.
+
+    Parameters:
+        event (pygame.event.Event): the event
+        screen (pygame.Surface): the screen, to scale touch positions
+
+    Returns:
+        tuple: (x, y) of the event, or None if it has no position
+    """
+    if event.type == pygame.MOUSEMOTION or event.type == pygame.MOUSEBUTTONDOWN:
+        return event.pos
+    if event.type == pygame.FINGERDOWN or event.type == pygame.FINGERMOTION:
+        return int(event.x * screen.get_height()), int(event.y * screen.get_width())
+    return None
+
+
+class Game:
+    def __init__(
+        self,
+        screen,
+        board,
+        computer=None,
+        budget_ms=AI_BUDGET_MS,
+        dirty_rects=DIRTY_RECTS,
+        browser=False,
+        recorder=None,
+    ):
+        """
+        Initialize a Game object.
+
+        A Game holds the state of the main loop and handles its events
+        one at a time, so every event of a frame is processed.
+
+        Parameters:
+            screen (pygame.Surface): the screen to draw on
+            board (Board): the board to play on
+            computer (str): the marker played by the computer, "X" or "O",
+                defaults to None for two human players
+            budget_ms (float): the time the computer may think on boards
+                larger than 3x3, in milliseconds
+            dirty_rects (bool): if True, only the squares and button that
+                changed are redrawn and updated on the display, otherwise
+                the whole screen is redrawn and flipped
+            browser (bool): whether the game runs in a browser, where the
+                'q' key does not quit
+            recorder (records.RecordWriter): the writer to record every
+                game to, defaults to None to not record games
+        """
+        self.screen = screen
+        self.board = board
+        self.button = create_button(action=self.new_game)
+        # the clickable widgets, to find the one under the pointer
+        self.widgets = SpatialIndex()
+        self.widgets.insert(board)
+        self.widgets.insert(self.button)
+        self.computer = computer
+        self.budget_ms = budget_ms
+        self.dirty_rects = dirty_rects
+        self.browser = browser
+        self.running = True
+        self.started = False
+        # whether the screen needs to be redrawn
+        self.needs_update = False
+        # the bits of the squares and whether the button changed since the last draw
+        self.changed_squares = 0
+        self.button_changed = False
+        # the areas to update on the display, reused from frame to frame:
+        # a slot per square, then the button and the overlay, with None
+        # in the empty slots, which pygame.display.update skips
+        self.updates = [None] * (board.rules.num_squares + 2)
+        self._no_updates = (None,) * len(self.updates)
+        self.overlay_rect = pygame.Rect(OVERLAY_RECT)
+        # the times of the last frames, see main()
+        self.profiler = profiler.FrameProfiler()
+        self.show_overlay = False
+        self.overlay_changed = False
+        self.recorder = recorder
+        # whether the game on the board has been recorded
+        self.recorded = False
+        # the moves of the game on the board, to undo and redo them
+        self.history = history.History(board.rules)
+
+    @property
+    def computer_to_move(self):
+        """
+        Whether the computer has a move to make.
+
+        It has none while an undo has left moves to redo: stepping
+        through the game does not play on from where it stops.
+        """
+        board = self.board
+        return bool(
+            self.computer
+            and not board.winner
+            and board.empty_squares()
+            and board.turn() == self.computer
+            and self.history.ply == self.history.length
+        )
+
+    def record_game(self):
+        """
+        Record the game on the board, if it has moves and was not recorded yet.
+
+        A game that is neither won nor drawn is recorded as unfinished.
+        """
+        board = self.board
+        if self.recorder and board.moves and not self.recorded:
+            finished = bool(board.winner) or not board.empty_squares()
+            self.recorder.write(board.moves, records.outcome_of(board.winner, finished))
+            self.recorded = True
+
+    def end_game(self):
+        """
+        Report and record the game, after the move that ended it.
+        """
+        print_result(self.board)
+        self.record_game()
+
+    def new_game(self):
+        """
+        Record the game on the board, if it was left unfinished, and
+        clear the board for a new one.
+        """
+        self.record_game()
+        self.board.reset()
+        self.history.clear()
+        self.recorded = False
+
+    def play(self, bit, marker):
+        """
+        Play a move on the board and in the history, and mark its squares
+        to be redrawn.
+
+        Parameters:
+            bit (int): the bit of the square
+            marker (str): "X" or "O"
+        """
+        board = self.board
+        if self.history.ply < self.history.length:
+            # a new line after an undo is another game to record
+            self.recorded = False
+        self.history.play(bit.bit_length() - 1)
+        if board.play(bit, marker):
+            self.end_game()
+        self.changed_squares |= bit | board.win_mask
+        self.needs_update = True
+
+    def step(self, key):
+        """
+        Undo or redo moves, or jump to the start or end of the game.
+
+        Against the computer, moves are undone and redone until it is the
+        player's turn. Stepping never lets the computer move: it plays
+        on once the player moves, which drops the moves after it, or
+        once the end of the game is reached again.
+
+        Parameters:
+            key (int): UNDO_KEY, REDO_KEY, FIRST_MOVE_KEY or LAST_MOVE_KEY
+        """
+        game_history = self.history
+        if key == FIRST_MOVE_KEY:
+            game_history.jump(0)
+        elif key == LAST_MOVE_KEY:
+            game_history.jump(game_history.length)
+        else:
+            step = game_history.undo if key == UNDO_KEY else game_history.redo
+            state = step()
+            while (
+                state is not None
+                and self.computer
+                and game_history.rules.state_turn(state) == self.computer
             ):
-                if not game_started:
-                    game_started = True
-                    # Skip the rest of the loop to get next event
-                    continue
+                state = step()
+        board = self.board
+        # the squares of both positions, as a square may change marker
+        self.changed_squares |= board.x_bits | board.o_bits | board.win_mask
+        board.load_state(game_history.state, game_history.squares, game_history.ply)
+        self.changed_squares |= board.x_bits | board.o_bits | board.win_mask
+        self.needs_update = True
+
+    def handle_event(self, event):
+        """
+        Handle one event.
 
-        update = False
-        keys = pygame.key.get_pressed()
+        Parameters:
+            event (pygame.event.Event): the event to be handled
+        """
+        board = self.board
+        screen = self.screen
+        # Check if the user closed the window
+        if event.type == pygame.QUIT:
+            pygame.quit()
+            sys.exit()
         # q quits the game if not running in a browser
-        if keys[pygame.K_q] and not browser:
-            running = False
-        # update the screen if the button is clicked or hovered
-        if button.update(event, screen):
-            update = True
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_q:
+            if not self.browser:
+                self.running = False
+                return
+        if event.type == pygame.KEYDOWN and event.key == OVERLAY_KEY:
+            self.show_overlay = not self.show_overlay
+            self.overlay_changed = True
+            self.needs_update = True
+            return
+        if (
+            event.type == pygame.KEYDOWN
+            and self.started
+            and event.key
+            in (
+                UNDO_KEY,
+                REDO_KEY,
+                FIRST_MOVE_KEY,
+                LAST_MOVE_KEY,
+            )
+        ):
+            self.step(event.key)
+            return
+        # Skip the first key press, click or touch, which starts the game
+        if (
+            event.type == pygame.KEYDOWN
+            or event.type == pygame.MOUSEBUTTONDOWN
+            or event.type == pygame.FINGERDOWN
+        ):
+            if not self.started:
+                self.started = True
+                return
+        position = event_position(event, screen)
+        if position is None:
+            return
+        widget = self.widgets.at(*position)
+        button = self.button
+        # update the screen if the button is clicked or hovered, the
+        # button also needs mouse motion off it to clear its hover state
+        if (widget is button or button.is_hovered) and button.update(event, screen):
+            self.needs_update = True
+            self.button_changed = True
             button.handle_event(event, screen)
+            if event.type != pygame.MOUSEMOTION:
+                # the button was clicked and reset the board
+                self.changed_squares = board.rules.full_mask
         # handle a mouse click or touch event only if the game is still in play
-        elif not board.winner and (
-            event.type == pygame.MOUSEBUTTONDOWN or event.type == pygame.FINGERDOWN
+        elif (
+            widget is board
+            and not board.winner
+            and (
+                event.type == pygame.MOUSEBUTTONDOWN
+                and event.button == 1
+                or event.type == pygame.FINGERDOWN
+            )
         ):
-            x, y = None, None
-            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-                x, y = event.pos
-            elif event.type == pygame.FINGERDOWN:
-                x = int(event.x * screen.get_height())
-                y = int(event.y * screen.get_width())
-            if x and y:
-                square = board.handle_click(x, y)
-                # update the screen if the user clicked on an empty square
-                if square and square.marker is None:
-                    square.marker = current_marker
-                    current_marker = "O" if current_marker == "X" else "X"
-                    # after a move, check if there is a winner
-                    if board.check_winner():
-                        print(f"Player {board.winner} wins!")
-                    elif board.check_draw():
-                        print("It's a draw!")
-                    update = True
-
-        # the update flag prevents unnecessary redraws
-        if update:
-            update = False
+            square = board.handle_click(*position)
+            # update the screen if the user clicked on an empty square,
+            # but not for the computer, which waits at an undone move
+            if square and square.marker is None and board.turn() != self.computer:
+                self.play(square.bit, board.turn())
+
+    def update(self):
+        """
+        Let the computer move when it is its turn.
+        """
+        if self.computer_to_move:
+            self.play(self.board.best_move(self.budget_ms), self.computer)
+
+    def draw(self, full=False):
+        """
+        Redraw the screen if anything changed, and show it.
+
+        Parameters:
+            full (bool): redraw and flip the whole screen even if
+                nothing changed, defaults to False
+        """
+        self.present(self.render(full))
+
+    def render(self, full=False):
+        """
+        Redraw the parts of the screen that changed, without showing them.
+
+        Parameters:
+            full (bool): redraw the whole screen even if nothing
+                changed, defaults to False
+
+        Returns:
+            list: the updates list of the game, with the pygame.Rect of
+            each redrawn area in its slot; an empty tuple if nothing was
+            redrawn; or None if the whole screen was redrawn
+        """
+        board = self.board
+        screen = self.screen
+        updates = self.updates
+        drawn = full or self.needs_update
+        result = ()
+        if full or not self.dirty_rects and self.needs_update:
             board.draw(screen)
-            draw_title(screen)
-            draw_footer(screen, button)
+            draw_button(screen, self.button)
+            result = None
+        elif self.needs_update:
+            board.draw_squares(screen, self.changed_squares, updates)
+            if self.button_changed:
+                updates[-2] = draw_button(screen, self.button)
+            result = updates
+        if self.show_overlay and drawn:
+            rect = draw_overlay(screen, self.profiler)
+        elif self.overlay_changed:
+            # the overlay was hidden, restore the title bar under it
+            rect = self.overlay_rect
+            screen.blit(SURFACE_CACHE.background, rect, rect)
+        else:
+            rect = None
+        if rect is not None and result is not None:
+            updates[-1] = rect
+            result = updates
+        self.needs_update = False
+        self.changed_squares = 0
+        self.button_changed = False
+        self.overlay_changed = False
+        return result
+
+    def present(self, updates):
+        """
+        Show what render() redrew on the display.
+
+        Parameters:
+            updates (list): what render() returned: the areas to
+                update, or None to flip the whole screen
+        """
+        if updates is None:
             pygame.display.flip()
+        elif updates:
+            pygame.display.update(updates)
+            # empty the slots for the next frame, without a new list
+            updates[:] = self._no_updates
+
+
+async def main(
+    computer=None,
+    size=BOARD_ROWS,
+    win_length=BOARD_ROWS,
+    budget_ms=AI_BUDGET_MS,
+    engine="alphabeta",
+    dirty_rects=DIRTY_RECTS,
+    fps=FPS,
+    idle_interval=IDLE_INTERVAL,
+    startup_report=False,
+    trace_file=None,
+    track_allocations=False,
+    record_file=None,
+    record_input=None,
+    replay=None,
+    frames=None,
+):
+    """
+    Main game loop.
+
+    Initializes the game board, screen, and buttons. Then,
+    enters a loop where it processes all queued events, updates the
+    game state, and redraws the screen.
+
+    While there is no input and the computer has no move to make, the
+    loop sleeps instead of spinning. On the desktop it waits for the
+    next event, which returns as soon as one arrives; in the browser it
+    yields to the event loop for idle_interval seconds. While active,
+    the loop runs at most fps frames per second.
+
+    Each frame is timed by the FrameProfiler of the game, phase by
+    phase: the events, the update, the drawing and the flip. F3 shows
+    the frame times on the screen.
 
-        # Let other tasks run
-        await asyncio.sleep(0)
+    Every game played is recorded to record_file, see records.py. A
+    game left unfinished is recorded when the board is reset or the
+    game exits.
 
+    The input events of every frame can be recorded to a file, and a
+    recording replayed through the same loop instead of the events of
+    the window, see replay.py.
+
+    Exits the loop when the user closes the window or presses the
+    'q' key when not running in a browser, when a replay ends, or after
+    a given number of frames.
+
+    Parameters:
+        computer (str): the marker played by the computer, "X" or "O",
+            defaults to None for two human players
+        size (int): the number of rows and columns of the board
+        win_length (int): the number of markers in a line needed to win
+        budget_ms (float): the time the computer may think on boards larger
+            than 3x3, in milliseconds
+        engine (str): the search used by the computer on boards larger
+            than 3x3, "alphabeta" or "mcts"
+        dirty_rects (bool): if True, only the squares and button that
+            changed are redrawn and updated on the display, otherwise the
+            whole screen is redrawn and flipped
+        fps (float): the most frames per second while active
+        idle_interval (float): the time to sleep while idle, in seconds
+        startup_report (bool): print how long each phase of the startup
+            took once the first frame is on the screen
+        trace_file (str): write the times of the last frames to this
+            Chrome trace-event file when the game ends
+        track_allocations (bool): trace the memory allocated by each
+            frame, and print the lines that allocated the most when the
+            game ends
+        record_file (str): the file to append the records of the games
+            to, defaults to None to not record games. If it cannot be
+            opened, a warning is printed and the games are not recorded.
+        record_input (str): record the input events of every frame to
+            this file, defaults to None to not record them
+        replay (replay.InputReplay): the recording to replay instead of
+            handling the input of the window, the frames are timed by its
+            profiler; defaults to None
+        frames (int): exit after this many passes of the loop, idle ones
+            included, defaults to None to run until the game is closed
+    """
+    browser = is_running_in_browser()
+    board = Board(size, size, win_length)
+    search_engine = None
+    if computer and engine == "mcts":
+        import mcts
+
+        search_engine = board.engine = mcts.MCTS(board.rules)
+    screen = create_screen()
+    STARTUP.mark("create screen")
+    recorder = None
+    if record_file:
+        try:
+            recorder = records.RecordWriter(record_file, board.rules)
+        except (OSError, ValueError) as error:
+            # e.g. a read-only install, play on without recording
+            print(f"Not recording games: {error}", file=sys.stderr)
+    game = Game(screen, board, computer, budget_ms, dirty_rects, browser, recorder)
+    # draw and refresh the whole screen
+    game.draw(full=True)
+    STARTUP.mark("first frame")
+    if startup_report:
+        print(STARTUP.report())
+    frame_time = 1 / fps
+    if replay:
+        game.profiler = replay.profiler
+    frame_profiler = game.profiler
+    input_recorder = None
+    if record_input:
+        import replay as input_replay
+
+        settings = dict(
+            computer=computer,
+            size=size,
+            win_length=win_length,
+            budget_ms=budget_ms,
+            engine=engine,
+            dirty_rects=dirty_rects,
+            fps=fps,
+        )
+        input_recorder = input_replay.InputRecorder(record_input, settings)
+    tracker = profiler.AllocationTracker() if track_allocations else None
+    if tracker:
+        tracker.start()
+    loop_start = time.perf_counter()
+    try:
+        while game.running:
+            if frames is not None:
+                if not frames:
+                    break
+                frames -= 1
+            if tracker:
+                tracker.begin_frame()
+            if recorder:
+                recorder.flush_if_due()
+            if replay:
+                frame = replay.next_frame()
+                if frame is None:
+                    break
+                when, events = frame
+                if replay.realtime:
+                    await asyncio.sleep(
+                        max(0.0, loop_start + when - time.perf_counter())
+                    )
+                # keep the window responsive, its own events are ignored
+                pygame.event.pump()
+                start = time.perf_counter()
+            else:
+                start = time.perf_counter()
+                events = pygame.event.get()
+            if not events and not game.computer_to_move and not replay:
+                # nothing to do: sleep until there is input
+                if browser:
+                    await asyncio.sleep(idle_interval)
+                    continue
+                event = pygame.event.wait(round(idle_interval * 1000))
+                if event.type == pygame.NOEVENT:
+                    # Let other tasks run
+                    await asyncio.sleep(0)
+                    continue
+                start = time.perf_counter()
+                events = [event] + pygame.event.get()
+
+            frame_profiler.begin_frame(start)
+            if input_recorder:
+                input_recorder.record(start - loop_start, events)
+            for event in events:
+                game.handle_event(event)
+            frame_profiler.lap(profiler.EVENTS)
+            game.update()
+            frame_profiler.lap(profiler.UPDATE)
+            # the needs_update flag prevents unnecessary redraws
+            updates = game.render()
+            frame_profiler.lap(profiler.DRAW)
+            game.present(updates)
+            frame_profiler.lap(profiler.FLIP)
+            frame_profiler.end_frame()
+            # free the events now rather than when the next frame starts
+            events = event = None
+            if tracker:
+                tracker.end_frame()
+
+            # cap the frame rate, and let other tasks run
+            if replay and not replay.realtime:
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(
+                    max(0.0, frame_time - (time.perf_counter() - start))
+                )
+    finally:
+        if input_recorder:
+            input_recorder.close()
+        if recorder:
+            game.record_game()
+            recorder.close()
+        if search_engine:
+            # stop its worker processes now, not at exit after pygame.quit()
+            search_engine.close()
+        if trace_file:
+            frame_profiler.write_chrome_trace(trace_file)
+        if tracker:
+            tracker.stop()
+            print(tracker.report())
+
+
+STARTUP.mark("import")
 
 # This is the program entry point
-asyncio.run(main())
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play Tic Tac Toe.")
+    parser.add_argument(
+        "--computer",
+        choices=(rules.X, rules.O),
+        help="let the computer play X or O",
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=BOARD_ROWS,
+        help="the number of rows and columns of the board",
+    )
+    parser.add_argument(
+        "--win-length",
+        type=int,
+        help="the number of markers in a line needed to win, defaults to "
+        "the board size up to 5",
+    )
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=AI_BUDGET_MS,
+        help="the time the computer may think on boards larger than 3x3",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("alphabeta", "mcts"),
+        default="alphabeta",
+        help="the search used by the computer on boards larger than 3x3",
+    )
+    parser.add_argument(
+        "--startup-report",
+        action="store_true",
+        help="print how long each phase of the startup took",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="write the times of the last frames to a Chrome trace-event file",
+    )
+    parser.add_argument(
+        "--track-allocations",
+        action="store_true",
+        help="print the lines that allocate the most memory per frame",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        default=records.FILENAME,
+        help="append a record of every game to this file, defaults to "
+        "games.ttr next to the game",
+    )
+    parser.add_argument(
+        "--no-record",
+        action="store_true",
+        help="do not record the games",
+    )
+    parser.add_argument(
+        "--record-input",
+        metavar="FILE",
+        help="record the input events to FILE, to replay with replay.py",
+    )
+    parser.add_argument(
+        "--frames",
+        type=int,
+        metavar="N",
+        help="exit after N passes of the main loop, idle ones included",
+    )
+    args, _ = parser.parse_known_args()
+    win_length = args.win_length or min(args.size, 5)
+    try:
+        rules.Rules(args.size, args.size, win_length)
+    except ValueError as error:
+        parser.error(str(error))
+    init()
+    asyncio.run(
+        main(
+            computer=args.computer,
+            size=args.size,
+            win_length=win_length,
+            budget_ms=args.budget_ms,
+            engine=args.engine,
+            startup_report=args.startup_report,
+            trace_file=args.trace,
+            track_allocations=args.track_allocations,
+            record_file=None if args.no_record else args.record,
+            record_input=args.record_input,
+            frames=args.frames,
+        )
+    )
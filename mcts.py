@@ -0,0 +1,292 @@
+"""
+Monte Carlo Tree Search opponent.
+
+Each search grows a UCT tree from the current position and scores its
+leaves with random playouts, which end by the same win and draw rules as
+the Board. The search is parallelized at the root: every worker process
+of a ProcessPoolExecutor grows its own tree from the same position with
+its own random seed, and the visit counts of the root moves are summed
+over all trees to choose the move.
+
+Usage:
+    python mcts.py --size 9 --win-length 5 --budget-ms 2000 --workers 4
+"""
+
+import argparse
+import math
+import os
+import random
+import time
+
+import rules
+import search
+
+EXPLORATION = 1.4
+
+
+class Node:
+    __slots__ = ("move", "parent", "children", "untried", "terminal", "visits", "wins")
+
+    def __init__(self, move, parent, untried, terminal=None):
+        """
+        Initialize a Node of the search tree.
+
+        Parameters:
+            move (int): the bit of the move that led to this node
+            parent (Node): the node before the move, None for the root
+            untried (list): the bits of the moves not expanded yet
+            terminal (float): if the game is over, 1 if the move won it
+                and 0.5 for a draw, otherwise None
+        """
+        self.move = move
+        self.parent = parent
+        self.children = []
+        self.untried = untried
+        self.terminal = terminal
+        self.visits = 0
+        # wins of the player who made the move, draws count half
+        self.wins = 0.0
+
+    def select_child(self, exploration):
+        """
+        Return the child with the highest UCT score.
+        """
+        log_visits = math.log(self.visits)
+        return max(
+            self.children,
+            key=lambda child: child.wins / child.visits
+            + exploration * math.sqrt(log_visits / child.visits),
+        )
+
+
+def playout(board_rules, own, opp, rng):
+    """
+    Play random moves until the game is over.
+
+    Parameters:
+        board_rules (rules.Rules): the rules of the board
+        own (int): the bitboard of the player to move
+        opp (int): the bitboard of the other player
+        rng (random.Random): the random number generator
+
+    Returns:
+        float: 1 if the player to move wins, 0 if they lose, 0.5 for a draw
+    """
+    cols = board_rules.cols
+    empty = board_rules.empty_squares(own, opp)
+    squares = [bit.bit_length() - 1 for bit in rules.iter_bits(empty)]
+    rng.shuffle(squares)
+    to_move = True
+    for square in squares:
+        bit = 1 << square
+        if to_move:
+            own |= bit
+            bits = own
+        else:
+            opp |= bit
+            bits = opp
+        if board_rules.line_through(bits, *divmod(square, cols)):
+            return 1.0 if to_move else 0.0
+        to_move = not to_move
+    return 0.5
+
+
+def search_tree(rows, cols, k, own, opp, budget_ms, seed, exploration=EXPLORATION):
+    """
+    Grow one UCT tree from a position until the time budget runs out.
+
+    This is run in the worker processes, so it only takes picklable
+    arguments.
+
+    Parameters:
+        rows (int): the number of rows of the board
+        cols (int): the number of columns of the board
+        k (int): the number of markers in a line needed to win
+        own (int): the bitboard of the player to move
+        opp (int): the bitboard of the other player
+        budget_ms (float): the time to search, in milliseconds
+        seed (int): the seed of the random playouts
+        exploration (float): the UCT exploration constant
+
+    Returns:
+        tuple: (dict of root move bit -> visits, number of playouts)
+    """
+    # built once per worker process, not once per search
+    board_rules = rules.shared(rows, cols, k)
+    engine = search.Engine(board_rules)
+    rng = random.Random(seed)
+    deadline = time.perf_counter() + budget_ms / 1000
+
+    def moves(own, opp):
+        untried = list(rules.iter_bits(engine.candidates(own, opp)))
+        rng.shuffle(untried)
+        return untried
+
+    root = Node(0, None, moves(own, opp))
+    playouts = 0
+    while time.perf_counter() < deadline:
+        node = root
+        # bitboards of the player to move at node and the other player
+        to_move, moved = own, opp
+        # selection
+        while not node.untried and node.children:
+            node = node.select_child(exploration)
+            to_move, moved = moved, to_move | node.move
+        # expansion
+        if node.untried:
+            bit = node.untried.pop()
+            moved_now = to_move | bit
+            if board_rules.line_through(moved_now, *rules.bit_square(bit, cols)):
+                child = Node(bit, node, [], terminal=1.0)
+            else:
+                untried = moves(moved, moved_now)
+                child = Node(bit, node, untried, None if untried else 0.5)
+            node.children.append(child)
+            node = child
+            to_move, moved = moved, moved_now
+        # simulation, scored for the player who made the move into node
+        if node.terminal is not None:
+            result = node.terminal
+        else:
+            result = 1.0 - playout(board_rules, to_move, moved, rng)
+        playouts += 1
+        # backpropagation
+        while node is not None:
+            node.visits += 1
+            node.wins += result
+            result = 1.0 - result
+            node = node.parent
+    return {child.move: child.visits for child in root.children}, playouts
+
+
+class MCTS:
+    def __init__(self, board_rules, budget_ms=1000, workers=None, seed=None):
+        """
+        Initialize a Monte Carlo Tree Search opponent.
+
+        Parameters:
+            board_rules (rules.Rules): the rules of the board to play on
+            budget_ms (float): the time to search for each move, in milliseconds
+            workers (int): the number of worker processes, defaults to the
+                number of CPUs. With 1 worker, or where processes are not
+                available (e.g. in the browser), the search runs in this
+                process.
+            seed (int): the seed of the random playouts
+        """
+        self.rules = board_rules
+        self.budget_ms = budget_ms
+        self.workers = workers or os.cpu_count() or 1
+        self.rng = random.Random(seed)
+        self.playouts = 0
+        self.playouts_per_second = 0.0
+        self._executor = None
+        # picks the candidate moves when no playout finished, see best_move
+        self._engine = None
+
+    def _get_executor(self):
+        if self._executor is None and self.workers > 1:
+            try:
+                from concurrent.futures import ProcessPoolExecutor
+
+                self._executor = ProcessPoolExecutor(self.workers)
+            except (ImportError, NotImplementedError, OSError):
+                self.workers = 1
+        return self._executor
+
+    def close(self):
+        """
+        Shut down the worker processes.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def best_move(self, x_bits, o_bits):
+        """
+        Find the best move for the player whose turn it is.
+
+        Every worker searches for the whole time budget, and the root
+        move with the most visits over all workers is returned. If no
+        playout finished in time, e.g. with a tiny budget or while the
+        workers start, a move that wins at once is returned, else one
+        that blocks a win of the opponent, else the first candidate.
+
+        Parameters:
+            x_bits (int): the bitboard of player X
+            o_bits (int): the bitboard of player O
+
+        Returns:
+            int: the bit of the square to play, or 0 if the board is full
+        """
+        if x_bits.bit_count() == o_bits.bit_count():
+            own, opp = x_bits, o_bits
+        else:
+            own, opp = o_bits, x_bits
+        if not self.rules.empty_squares(own, opp):
+            return 0
+        r = self.rules
+        start = time.perf_counter()
+        executor = self._get_executor()
+        seeds = [self.rng.getrandbits(32) for _ in range(self.workers)]
+        args = (r.rows, r.cols, r.k, own, opp, self.budget_ms)
+        if executor is None:
+            results = [search_tree(*args, seeds[0])]
+        else:
+            futures = [executor.submit(search_tree, *args, seed) for seed in seeds]
+            results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+        visits = {}
+        self.playouts = 0
+        for tree_visits, playouts in results:
+            self.playouts += playouts
+            for bit, count in tree_visits.items():
+                visits[bit] = visits.get(bit, 0) + count
+        self.playouts_per_second = self.playouts / elapsed if elapsed else 0.0
+        if not visits:
+            return self._fallback_move(own, opp)
+        return max(visits, key=visits.get)
+
+    def _fallback_move(self, own, opp):
+        # a legal move without searching: win, block, or the first candidate
+        if self._engine is None:
+            self._engine = search.Engine(self.rules)
+        candidates = list(rules.iter_bits(self._engine.candidates(own, opp)))
+        cols = self.rules.cols
+        for bits in (own, opp):
+            for bit in candidates:
+                if self.rules.line_through(bits | bit, *rules.bit_square(bit, cols)):
+                    return bit
+        return candidates[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MCTS opponent.")
+    parser.add_argument("--size", type=int, default=9)
+    parser.add_argument("--win-length", type=int, default=None)
+    parser.add_argument("--budget-ms", type=float, default=2000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    win_length = args.win_length or min(args.size, 5)
+    board_rules = rules.Rules(args.size, args.size, win_length)
+
+    # compare a single process against the pool to show the scaling
+    for workers in sorted({1, args.workers}):
+        with MCTS(board_rules, args.budget_ms, workers) as player:
+            # the first search also starts the worker processes
+            player.best_move(0, 0)
+            bit = player.best_move(0, 0)
+        row, col = rules.bit_square(bit, board_rules.cols)
+        print(
+            f"{workers} worker(s): {player.playouts_per_second:,.0f} playouts/s, "
+            f"best move {row}, {col}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+Per-frame profiling of the main loop.
+
+The main loop times the phases of each frame: processing the events,
+updating the game, drawing and flipping the display. The times of the
+last frames are kept in a fixed-size ring buffer, which the game reads
+for its frame-time overlay and which can be written as a Chrome
+trace-event file, to be opened in chrome://tracing or Perfetto.
+
+The AllocationTracker finds the memory each frame allocates with
+tracemalloc, by the line of the game that allocated it.
+
+Usage:
+    profiler = FrameProfiler()
+    profiler.begin_frame()
+    handle_events()
+    profiler.lap(EVENTS)
+    ...
+    profiler.end_frame()
+"""
+
+import json
+import math
+import os
+import time
+import tracemalloc
+from array import array
+
+EVENTS = 0
+UPDATE = 1
+DRAW = 2
+FLIP = 3
+PHASES = ("events", "update", "draw", "flip")
+
+# the number of frames kept, 4 seconds at 60 frames per second
+CAPACITY = 240
+
+# each frame takes one start time and the time of each phase in the buffer
+_FIELDS = 1 + len(PHASES)
+
+# the allocations of the game's own modules are tracked, by the line that
+# allocated them, or that called into pygame or the standard library
+_GAME_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py")
+
+
+def percentile(values, p):
+    """
+    Return the p-th percentile of sorted values, by the nearest rank.
+
+    Parameters:
+        values (list): the values, sorted
+        p (float): the percentile, from 0 to 100
+
+    Returns:
+        float: the value at the percentile, or 0.0 if there are no values
+    """
+    if not values:
+        return 0.0
+    # the smallest rank with at least p percent of the values at or below it,
+    # multiplied out before dividing so e.g. 70 * 10 / 100 is exactly 7
+    rank = max(0, min(len(values) - 1, math.ceil(p * len(values) / 100) - 1))
+    return values[rank]
+
+
+class FrameProfiler:
+    def __init__(self, capacity=CAPACITY, clock=time.perf_counter):
+        """
+        Initialize a FrameProfiler object.
+
+        The buffer is allocated once, and the oldest frame is overwritten
+        when it is full, so profiling takes the same memory however long
+        the game runs.
+
+        Parameters:
+            capacity (int): the number of frames to keep
+            clock (callable): the clock to time with, in seconds
+        """
+        self.capacity = capacity
+        self.clock = clock
+        self._data = array("d", bytes(8 * _FIELDS * capacity))
+        # the buffer index of the next frame, and the number of frames kept
+        self._next = 0
+        self._count = 0
+        # the start of the frame and the end of the last phase, kept in an
+        # array so timing a frame leaves no float objects behind
+        self._marks = array("d", (0.0, 0.0))
+
+    def __len__(self):
+        return self._count
+
+    def begin_frame(self, start=None):
+        """
+        Start timing a frame.
+
+        Parameters:
+            start (float): the clock time the frame started at, defaults to now
+        """
+        marks = self._marks
+        marks[0] = marks[1] = self.clock() if start is None else start
+
+    def lap(self, phase):
+        """
+        Record that a phase of the frame has finished.
+
+        The phase took the time since the previous lap, or since the
+        start of the frame for the first phase.
+
+        Parameters:
+            phase (int): the phase, one of EVENTS, UPDATE, DRAW or FLIP
+        """
+        now = self.clock()
+        marks = self._marks
+        self._data[self._next * _FIELDS + 1 + phase] = now - marks[1]
+        marks[1] = now
+
+    def end_frame(self):
+        """
+        Finish the frame and add it to the buffer.
+        """
+        self._data[self._next * _FIELDS] = self._marks[0]
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def clear(self):
+        """
+        Drop all frames.
+        """
+        self._next = 0
+        self._count = 0
+
+    def frames(self):
+        """
+        Return the frames in the buffer, oldest first.
+
+        Returns:
+            list: a tuple per frame of its start time and the time of
+            each phase, in seconds
+        """
+        first = (self._next - self._count) % self.capacity
+        frames = []
+        for i in range(self._count):
+            offset = (first + i) % self.capacity * _FIELDS
+            frames.append(tuple(self._data[offset : offset + _FIELDS]))
+        return frames
+
+    def frame_times(self, phase=None):
+        """
+        Return the time of each frame in the buffer, oldest first.
+
+        Parameters:
+            phase (int): only count this phase, defaults to all phases
+
+        Returns:
+            list: the times in seconds
+        """
+        # read the buffer directly, as the overlay calls this every frame
+        data = self._data
+        first = (self._next - self._count) % self.capacity
+        times = []
+        for i in range(self._count):
+            offset = (first + i) % self.capacity * _FIELDS
+            if phase is None:
+                times.append(
+                    data[offset + 1]
+                    + data[offset + 2]
+                    + data[offset + 3]
+                    + data[offset + 4]
+                )
+            else:
+                times.append(data[offset + 1 + phase])
+        return times
+
+    def percentile(self, p, phase=None):
+        """
+        Return a percentile of the frame times in the buffer.
+
+        Parameters:
+            p (float): the percentile, from 0 to 100
+            phase (int): only count this phase, defaults to all phases
+
+        Returns:
+            float: the frame time at the percentile, in seconds
+        """
+        return percentile(sorted(self.frame_times(phase)), p)
+
+    def fps(self, window=1.0):
+        """
+        Return the frame rate over the last frames.
+
+        The main loop sleeps while there is nothing to do, so this is
+        the number of frames that were drawn, not the most the game
+        could draw.
+
+        Parameters:
+            window (float): the time to count frames over, in seconds,
+                up to the start of the last frame
+
+        Returns:
+            float: the frames per second
+        """
+        frames = self.frames()
+        if not frames:
+            return 0.0
+        since = frames[-1][0] - window
+        return sum(1 for frame in frames if frame[0] > since) / window
+
+    def chrome_trace(self):
+        """
+        Return the frames in the buffer as Chrome trace events.
+
+        Every frame is a "frame" event, with an event per phase
+        inside it.
+
+        Returns:
+            dict: the trace, in the JSON object format of the Trace
+            Event Format
+        """
+        events = []
+        for number, (start, *phases) in enumerate(self.frames()):
+            events.append(
+                {
+                    "name": "frame",
+                    "ph": "X",
+                    "ts": start * 1e6,
+                    "dur": sum(phases) * 1e6,
+                    "pid": 0,
+                    "tid": 0,
+                    "args": {"frame": number},
+                }
+            )
+            for name, duration in zip(PHASES, phases):
+                events.append(
+                    {
+                        "name": name,
+                        "ph": "X",
+                        "ts": start * 1e6,
+                        "dur": duration * 1e6,
+                        "pid": 0,
+                        "tid": 0,
+                    }
+                )
+                start += duration
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        """
+        Write the frames in the buffer to a Chrome trace-event file.
+
+        Parameters:
+            path (str): the file to write
+        """
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+class AllocationTracker:
+    def __init__(self):
+        """
+        Initialize an AllocationTracker object.
+
+        Between begin_frame() and end_frame(), the tracker records the
+        memory blocks allocated by the game's modules that are still
+        alive at the end of the frame, by the line that allocated them.
+        Those are the objects a frame leaves behind: they are garbage
+        the next frames must free, or the cyclic garbage collector
+        must find, which is what causes pauses. The peak of all memory
+        allocated during the frame, including what was freed again
+        within it, is recorded too.
+
+        Tracking slows the game down a lot, so it is only for finding
+        allocations, not for timing.
+
+        A float freed during the frame goes back to the free list of
+        CPython, not to the allocator, so tracemalloc still counts its
+        memory block as alive: a line making floats can look like it
+        left a block behind when it did not. The frame times recorded
+        by the FrameProfiler are such floats, made every frame, so this
+        module's own lines are left out of the tracking.
+
+        Attributes:
+            frames (int): the number of frames tracked
+            frames_allocating (int): the number of frames that left
+                memory blocks behind
+            peak (int): the largest peak of a frame, in bytes
+            sites (dict): (filename, line) -> [blocks, bytes] over all
+                frames
+        """
+        self.frames = 0
+        self.frames_allocating = 0
+        self.peak = 0
+        self.sites = {}
+        # the peak of the frame is read into an array before the snapshot,
+        # so the int object holding it is not in the snapshot
+        self._frame_peak = array("q", (0,))
+        self._filters = [
+            tracemalloc.Filter(True, _GAME_FILES),
+            tracemalloc.Filter(False, os.path.abspath(__file__)),
+        ]
+
+    def start(self):
+        """
+        Start tracing memory allocations.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self):
+        """
+        Stop tracing memory allocations.
+        """
+        tracemalloc.stop()
+
+    def begin_frame(self):
+        """
+        Start tracking a frame, forgetting the allocations before it.
+        """
+        tracemalloc.clear_traces()
+        tracemalloc.reset_peak()
+
+    def end_frame(self):
+        """
+        Record the allocations of the frame.
+        """
+        self._frame_peak[0] = tracemalloc.get_traced_memory()[1]
+        snapshot = tracemalloc.take_snapshot().filter_traces(self._filters)
+        self.frames += 1
+        self.peak = max(self.peak, self._frame_peak[0])
+        stats = snapshot.statistics("lineno")
+        if stats:
+            self.frames_allocating += 1
+        for stat in stats:
+            frame = stat.traceback[0]
+            site = self.sites.setdefault((frame.filename, frame.lineno), [0, 0])
+            site[0] += stat.count
+            site[1] += stat.size
+
+    def report(self, limit=10):
+        """
+        Return the call sites that allocated the most, per frame.
+
+        Parameters:
+            limit (int): the most call sites to list
+
+        Returns:
+            str: the report, one call site per line
+        """
+        frames = max(1, self.frames)
+        blocks = sum(count for count, _ in self.sites.values())
+        size = sum(size for _, size in self.sites.values())
+        lines = [
+            f"{self.frames} frames, {self.frames_allocating} left memory behind: "
+            f"{blocks / frames:.1f} blocks, {size / frames:.0f} B per frame, "
+            f"peak {self.peak:,} B"
+        ]
+        sites = sorted(self.sites.items(), key=lambda item: item[1][1], reverse=True)
+        for (filename, lineno), (count, size) in sites[:limit]:
+            lines.append(
+                f"{os.path.basename(filename)}:{lineno}: "
+                f"{count / frames:.1f} blocks, {size / frames:.0f} B per frame"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,377 @@
+"""
+Compact binary records of played games.
+
+Every game is stored as a few bytes: when it ended, how it ended, and
+its moves. Records are appended to a file as games end, and read back
+one at a time, so a file of millions of games is scanned in constant
+memory.
+
+File layout (little endian):
+    header: MAGIC (4 bytes), VERSION (1 byte), rows, cols and k of the
+        board (1 byte each)
+    records, one after the other:
+        timestamp: the time the game ended, in seconds since the epoch
+            (unsigned 32-bit integer)
+        info: the outcome (OUTCOME_*) in the top 2 bits and the number
+            of moves n in the other bits, 1 byte on boards of up to 63
+            squares and 2 bytes on larger ones
+        moves: the n moves packed into one number, in the fewest bytes
+            that hold every sequence of n moves
+
+The moves are packed by their rank among the squares still empty: the
+i-th move is one of N - i squares, so a sequence of n moves is a number
+below N * (N - 1) * ... * (N - n + 1). A full 3x3 game fits in 3 bytes,
+and a whole record in 8. X always moves first.
+
+Usage:
+    python records.py games.ttr  # prints a summary of the file
+"""
+
+import argparse
+import collections
+import os
+import struct
+import time
+
+import rules
+
+MAGIC = b"TTTR"
+VERSION = 1
+HEADER = struct.Struct("<4sBBBB")
+TIMESTAMP = struct.Struct("<I")
+FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "games.ttr")
+
+OUTCOME_UNFINISHED = 0
+OUTCOME_X_WINS = 1
+OUTCOME_O_WINS = 2
+OUTCOME_DRAW = 3
+
+# the records written before the writer flushes them to the file
+BATCH_SIZE = 256
+# the most seconds a record waits in the writer before it is flushed
+FLUSH_INTERVAL = 5.0
+# the bytes the reader reads from the file at a time
+CHUNK_SIZE = 1 << 16
+
+# a played game: the time it ended, its outcome (OUTCOME_*) and its moves
+# as a tuple of square indices (row * cols + col), X first
+GameRecord = collections.namedtuple("GameRecord", "timestamp outcome moves")
+
+
+def outcome_of(winner, finished=True):
+    """
+    Return the outcome code of a game.
+
+    Parameters:
+        winner (str): the winning marker, or None
+        finished (bool): whether the game was played to the end
+
+    Returns:
+        int: one of the OUTCOME_* codes
+    """
+    if winner == rules.X:
+        return OUTCOME_X_WINS
+    if winner == rules.O:
+        return OUTCOME_O_WINS
+    return OUTCOME_DRAW if finished else OUTCOME_UNFINISHED
+
+
+class RecordFormat:
+    def __init__(self, board_rules):
+        """
+        Initialize the record format of a board.
+
+        Parameters:
+            board_rules (rules.Rules): the rules of the board
+
+        Raises:
+            ValueError: if the board is too large to record
+        """
+        squares = board_rules.num_squares
+        if max(board_rules.rows, board_rules.cols) > 255 or squares >= 1 << 14:
+            raise ValueError(f"cannot record games on a {board_rules!r} board")
+        self.rules = board_rules
+        self.squares = squares
+        self.info = struct.Struct("<B" if squares < 1 << 6 else "<H")
+        self.count_bits = self.info.size * 8 - 2
+        # number of moves -> the bytes that hold every sequence of that many
+        sizes = []
+        sequences = 1
+        for n in range(squares + 1):
+            sizes.append(((sequences - 1).bit_length() + 7) // 8)
+            sequences *= squares - n
+        self.move_bytes = tuple(sizes)
+
+    def header(self):
+        """
+        Return the file header for this board.
+        """
+        r = self.rules
+        return HEADER.pack(MAGIC, VERSION, r.rows, r.cols, r.k)
+
+    def pack(self, moves, outcome, timestamp):
+        """
+        Pack one game into a record.
+
+        Parameters:
+            moves (sequence): the squares played, as square indices
+            outcome (int): one of the OUTCOME_* codes
+            timestamp (float): the time the game ended, in seconds since
+                the epoch
+
+        Returns:
+            bytes: the record
+
+        Raises:
+            ValueError: if a move is off the board or played twice
+        """
+        empty = list(range(self.squares))
+        value = 0
+        for square in moves:
+            try:
+                rank = empty.index(square)
+            except ValueError:
+                raise ValueError(f"square {square} is not empty") from None
+            value = value * len(empty) + rank
+            del empty[rank]
+        n = len(moves)
+        return (
+            TIMESTAMP.pack(int(timestamp))
+            + self.info.pack(outcome << self.count_bits | n)
+            + value.to_bytes(self.move_bytes[n], "little")
+        )
+
+    def unpack_moves(self, value, n):
+        """
+        Unpack the moves of a record.
+
+        Parameters:
+            value (int): the packed moves
+            n (int): the number of moves
+
+        Returns:
+            tuple: the squares played, as square indices
+        """
+        ranks = [0] * n
+        for i in range(n - 1, -1, -1):
+            value, ranks[i] = divmod(value, self.squares - i)
+        empty = list(range(self.squares))
+        return tuple(empty.pop(rank) for rank in ranks)
+
+
+def read_header(f):
+    """
+    Read the header of a record file.
+
+    Parameters:
+        f (file): the file, opened in binary mode at its start
+
+    Returns:
+        rules.Rules: the rules of the board the games were played on
+
+    Raises:
+        ValueError: if the file is not a record file of this version
+    """
+    data = f.read(HEADER.size)
+    if len(data) < HEADER.size:
+        raise ValueError(f"{f.name} is not a game record file")
+    magic, version, rows, cols, k = HEADER.unpack(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{f.name} is not a version {VERSION} game record file")
+    return rules.Rules(rows, cols, k)
+
+
+class RecordWriter:
+    def __init__(
+        self,
+        path=FILENAME,
+        board_rules=rules.STANDARD,
+        batch_size=BATCH_SIZE,
+        flush_interval=FLUSH_INTERVAL,
+    ):
+        """
+        Open a record file to append games to.
+
+        Records are collected in memory and written to the file in
+        batches: when batch_size records are waiting, when a record
+        has waited flush_interval seconds, or when the writer is
+        flushed or closed. The wait is checked on every write and by
+        flush_if_due(), which a game loop calls so a lone game does not
+        wait for the next one to be written.
+
+        Parameters:
+            path (str): the file to append to, created if it is missing
+            board_rules (rules.Rules): the rules of the board the games
+                are played on
+            batch_size (int): the records to collect before writing them
+            flush_interval (float): the most seconds a record is kept
+                before it is written
+
+        Raises:
+            OSError: if the file cannot be opened
+            ValueError: if the file is not a record file, or records
+                games of another board
+        """
+        self.format = RecordFormat(board_rules)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.records = 0
+        self._pending = bytearray()
+        self._pending_count = 0
+        self._pending_since = 0.0
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(self.format.header())
+            self._file.flush()
+        else:
+            try:
+                with open(path, "rb") as f:
+                    recorded = read_header(f)
+                if (recorded.rows, recorded.cols, recorded.k) != (
+                    board_rules.rows,
+                    board_rules.cols,
+                    board_rules.k,
+                ):
+                    raise ValueError(f"{path} records games on a {recorded!r} board")
+            except (OSError, ValueError):
+                self._file.close()
+                raise
+
+    def write(self, moves, outcome, timestamp=None):
+        """
+        Add a game to the file.
+
+        Parameters:
+            moves (sequence): the squares played, as square indices
+            outcome (int): one of the OUTCOME_* codes
+            timestamp (float): the time the game ended, defaults to now
+        """
+        now = time.time()
+        if not self._pending_count:
+            self._pending_since = now
+        self._pending += self.format.pack(
+            moves, outcome, now if timestamp is None else timestamp
+        )
+        self._pending_count += 1
+        self.records += 1
+        if self._pending_count >= self.batch_size:
+            self.flush()
+        else:
+            self.flush_if_due(now)
+
+    def flush_if_due(self, now=None):
+        """
+        Write the collected records if the oldest has waited flush_interval
+        seconds.
+
+        This does nothing while no record is waiting, so it can be
+        called every frame.
+
+        Parameters:
+            now (float): the current time.time(), defaults to now
+        """
+        if self._pending_count and (
+            (time.time() if now is None else now) - self._pending_since
+            >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the collected records to the file.
+        """
+        if self._pending:
+            self._file.write(self._pending)
+            self._file.flush()
+            self._pending.clear()
+            self._pending_count = 0
+
+    def close(self):
+        """
+        Write the collected records and close the file.
+        """
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_records(path=FILENAME, chunk_size=CHUNK_SIZE):
+    """
+    Iterate over the games of a record file.
+
+    The file is read in chunks, so only one chunk is in memory however
+    many games the file holds. A record cut off at the end of the
+    file, e.g. by a crash while it was written, is skipped.
+
+    Parameters:
+        path (str): the file to read
+        chunk_size (int): the bytes to read at a time
+
+    Yields:
+        GameRecord: each game, oldest first
+
+    Raises:
+        ValueError: if the file is not a record file of this version
+    """
+    with open(path, "rb") as f:
+        record_format = RecordFormat(read_header(f))
+        info = record_format.info
+        count_bits = record_format.count_bits
+        count_mask = (1 << count_bits) - 1
+        move_bytes = record_format.move_bytes
+        unpack_moves = record_format.unpack_moves
+        fixed = TIMESTAMP.size + info.size
+        data = b""
+        offset = 0
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            data = data[offset:] + chunk
+            offset = 0
+            end = len(data)
+            while offset + fixed <= end:
+                (timestamp,) = TIMESTAMP.unpack_from(data, offset)
+                (value,) = info.unpack_from(data, offset + TIMESTAMP.size)
+                n = value & count_mask
+                size = move_bytes[n]
+                if offset + fixed + size > end:
+                    break
+                start = offset + fixed
+                moves = int.from_bytes(data[start : start + size], "little")
+                offset = start + size
+                yield GameRecord(timestamp, value >> count_bits, unpack_moves(moves, n))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a game record file.")
+    parser.add_argument("path", nargs="?", default=FILENAME)
+    args = parser.parse_args()
+
+    outcomes = [0, 0, 0, 0]
+    moves = 0
+    start = time.perf_counter()
+    for record in read_records(args.path):
+        outcomes[record.outcome] += 1
+        moves += len(record.moves)
+    elapsed = time.perf_counter() - start
+    games = sum(outcomes)
+    print(f"{games:,} games, {os.path.getsize(args.path):,} bytes")
+    print(f"X wins: {outcomes[OUTCOME_X_WINS]}")
+    print(f"O wins: {outcomes[OUTCOME_O_WINS]}")
+    print(f"Draws:  {outcomes[OUTCOME_DRAW]}")
+    print(f"Unfinished: {outcomes[OUTCOME_UNFINISHED]}")
+    if games:
+        print(
+            f"{moves / games:.1f} moves per game, {games / elapsed:,.0f} games/s read"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Record the input of a game session and replay it.
+
+With --record-input, main() writes the input events of every frame it
+draws to a file: the clicks, mouse motion, touches and key presses, with
+the time of the frame. Replaying the file feeds the same events to the
+same main loop, frame by frame, with the SDL dummy video driver, so a
+user's session can be reproduced exactly without a window, touch
+positions included. The frame times of the replay are then reported,
+to benchmark the game on real input and to catch latency regressions.
+
+The replay runs as fast as it can by default, or with the timing of the
+recording with --realtime.
+
+The file is JSON lines: the first line holds the settings of the game,
+and every other line is one frame, with its time since the loop started
+in seconds and its events.
+
+Usage:
+    python main.py --record-input session.jsonl
+    python replay.py session.jsonl --realtime
+"""
+
+import argparse
+import asyncio
+import json
+import os
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+import profiler
+
+VERSION = 1
+
+# the events the game handles, and the attributes of each that are recorded
+FIELDS = {
+    "KEYDOWN": ("key", "mod", "unicode", "scancode"),
+    "MOUSEBUTTONDOWN": ("pos", "button", "touch"),
+    "MOUSEMOTION": ("pos", "rel", "buttons", "touch"),
+    "FINGERDOWN": ("x", "y", "dx", "dy", "touch_id", "finger_id", "pressure"),
+    "FINGERMOTION": ("x", "y", "dx", "dy", "touch_id", "finger_id", "pressure"),
+}
+# pygame event type -> name in the file
+_NAMES = {getattr(pygame, name): name for name in FIELDS}
+
+
+def _encode(event):
+    # the recorded attributes of an event, as JSON values
+    name = _NAMES[event.type]
+    data = {"type": name}
+    for field in FIELDS[name]:
+        data[field] = getattr(event, field)
+    return data
+
+
+def _decode(data):
+    # an event from its recorded attributes, with the tuples restored
+    fields = {
+        field: tuple(value) if isinstance(value, list) else value
+        for field, value in data.items()
+        if field != "type"
+    }
+    return pygame.event.Event(getattr(pygame, data["type"]), fields)
+
+
+class InputRecorder:
+    def __init__(self, path, settings):
+        """
+        Open a file to record the input of a session to.
+
+        Parameters:
+            path (str): the file to write, replaced if it exists
+            settings (dict): the arguments of main() the session runs
+                with, so the replay runs the same game
+        """
+        self.path = path
+        self.frames = 0
+        self._file = open(path, "w")
+        self._file.write(json.dumps({"version": VERSION, "settings": settings}) + "\n")
+
+    def record(self, when, events):
+        """
+        Record the events of a frame.
+
+        Every frame is recorded, even without input, so the replay draws
+        the same frames, including the ones where the computer moves.
+
+        Parameters:
+            when (float): the start of the frame, in seconds since the
+                main loop started
+            events (list): the pygame events of the frame
+        """
+        recorded = [_encode(event) for event in events if event.type in _NAMES]
+        self._file.write(
+            json.dumps({"t": round(when, 6), "events": recorded}, separators=(",", ":"))
+            + "\n"
+        )
+        self.frames += 1
+
+    def close(self):
+        """
+        Close the file.
+        """
+        self._file.close()
+
+
+class InputReplay:
+    def __init__(self, path, realtime=False):
+        """
+        Load a recorded session to replay.
+
+        Parameters:
+            path (str): the file written by an InputRecorder
+            realtime (bool): whether to replay each frame at the time it
+                was recorded at, rather than as fast as possible
+
+        Attributes:
+            settings (dict): the arguments of main() the session ran with
+            frames (list): a (time, events) tuple per frame
+            profiler (profiler.FrameProfiler): the frame times of the
+                replay, with room for every frame
+
+        Raises:
+            ValueError: if the file is not a recording of this version
+        """
+        with open(path) as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("version") != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} input recording")
+            self.settings = header["settings"]
+            self.frames = []
+            for line in f:
+                frame = json.loads(line)
+                self.frames.append(
+                    (frame["t"], [_decode(data) for data in frame["events"]])
+                )
+        self.realtime = realtime
+        self.profiler = profiler.FrameProfiler(capacity=max(1, len(self.frames)))
+        self._next = 0
+
+    def next_frame(self):
+        """
+        Return the next frame to replay.
+
+        Returns:
+            tuple: (time, events) of the frame, or None after the last frame
+        """
+        if self._next == len(self.frames):
+            return None
+        frame = self.frames[self._next]
+        self._next += 1
+        return frame
+
+
+def report(frame_profiler):
+    """
+    Summarize the frame times of a replay.
+
+    Parameters:
+        frame_profiler (profiler.FrameProfiler): the frames of the replay
+
+    Returns:
+        str: the report, the frame times and then the time of each phase
+    """
+    times = sorted(frame_profiler.frame_times())
+    total = sum(times)
+    lines = [
+        f"{len(times)} frames in {total * 1000:.1f} ms of frame time, "
+        f"{len(times) / total if total else 0.0:,.0f} frames/s"
+    ]
+    header = f"{'':<8}" + "".join(
+        f"{name:>10}" for name in ("p50 ms", "p90 ms", "p99 ms", "max ms")
+    )
+    lines.append(header)
+    rows = [("frame", times)]
+    rows.extend(
+        (name, sorted(frame_profiler.frame_times(phase)))
+        for phase, name in enumerate(profiler.PHASES)
+    )
+    for name, values in rows:
+        lines.append(
+            f"{name:<8}"
+            + "".join(
+                f"{profiler.percentile(values, p) * 1000:>10.3f}" for p in (50, 90, 99)
+            )
+            + f"{(values[-1] if values else 0.0) * 1000:>10.3f}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded game session.")
+    parser.add_argument("path", help="the file written with --record-input")
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="replay with the timing of the recording, not as fast as possible",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="write the frame times to a Chrome trace-event file",
+    )
+    args = parser.parse_args()
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import main as game
+
+    try:
+        replay = InputReplay(args.path, args.realtime)
+    except ValueError as error:
+        parser.error(str(error))
+    game.init()
+    asyncio.run(game.main(**replay.settings, trace_file=args.trace, replay=replay))
+    print(report(replay.profiler))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""
+Bitboard rules for Tic Tac Toe.
+
+The state of a game is kept as one integer per player. Bit
+``row * cols + col`` of a player's integer is set when that player has a
+marker on the square at ``row``, ``col``. A player wins with ``k`` markers
+in a row, column or diagonal.
+
+The Rules class describes a board of any size. The module level functions
+and constants are those of the standard 3x3 board, where a win is detected
+by testing against the 8 precomputed line masks.
+
+A whole game can also be packed into a single integer, its state: the
+bitboard of X in bits 0 to N - 1, the bitboard of O in bits N to 2N - 1,
+whether O is to move in bit 2N and the result (RESULT_*) in the 2 bits
+above it, for a board of N squares. States are immutable, so a game
+held as a state takes a few dozen bytes, and positions can be kept and
+shared freely.
+"""
+
+X = "X"
+O = "O"
+
+# (row, col) steps of the 4 line directions: across, down and both diagonals
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+# the result of a game, as packed into its state
+RESULT_PLAYING = 0
+RESULT_X_WINS = 1
+RESULT_O_WINS = 2
+RESULT_DRAW = 3
+
+# the state of a game before the first move, on any board
+EMPTY_STATE = 0
+
+
+class Rules:
+    def __init__(self, rows=3, cols=3, k=3):
+        """
+        Initialize the rules of a board.
+
+        Parameters:
+            rows (int): the number of rows of the board
+            cols (int): the number of columns of the board
+            k (int): the number of markers in a line needed to win
+
+        Raises:
+            ValueError: if k does not fit on the board
+        """
+        if rows < 1 or cols < 1 or k < 1 or k > max(rows, cols):
+            raise ValueError(f"cannot get {k} in a row on a {rows}x{cols} board")
+        self.rows = rows
+        self.cols = cols
+        self.k = k
+        self.num_squares = rows * cols
+        self.full_mask = (1 << self.num_squares) - 1
+        self._win_masks = None
+        self._cell_lines = None
+
+    def __repr__(self):
+        return f"Rules(rows={self.rows}, cols={self.cols}, k={self.k})"
+
+    @property
+    def is_standard(self):
+        """
+        Whether this is the standard 3x3 board with 3 in a row.
+        """
+        return self.rows == 3 and self.cols == 3 and self.k == 3
+
+    def cell_bit(self, row, col):
+        """
+        Return the bit of the square at the given row and column.
+
+        Parameters:
+            row (int): the row of the square
+            col (int): the column of the square
+
+        Returns:
+            int: an integer with only the bit of the square set
+        """
+        return 1 << (row * self.cols + col)
+
+    @property
+    def win_masks(self):
+        """
+        The masks of every line of k squares on the board.
+
+        They are only built on first use, as there are thousands of
+        them on large boards.
+        """
+        if self._win_masks is None:
+            masks = []
+            for row in range(self.rows):
+                for col in range(self.cols):
+                    for d_row, d_col in DIRECTIONS:
+                        end_row = row + d_row * (self.k - 1)
+                        end_col = col + d_col * (self.k - 1)
+                        if not (0 <= end_row < self.rows and 0 <= end_col < self.cols):
+                            continue
+                        mask = 0
+                        for i in range(self.k):
+                            mask |= self.cell_bit(row + d_row * i, col + d_col * i)
+                        masks.append(mask)
+            self._win_masks = tuple(masks)
+        return self._win_masks
+
+    def winning_mask(self, bits):
+        """
+        Find a completed line anywhere in a player's bitboard.
+
+        This scans every line of the board. After a move, line_through
+        only needs to test the lines through that move.
+
+        Parameters:
+            bits (int): the bitboard of one player
+
+        Returns:
+            int: the mask of the first completed line, or 0 if there is none
+        """
+        for mask in self.win_masks:
+            if bits & mask == mask:
+                return mask
+        return 0
+
+    def lines_through(self, row, col):
+        """
+        Return the masks of the lines of k squares through one square.
+
+        There are at most 4 * k of them, one per direction and offset
+        of the square in the line.
+
+        Parameters:
+            row (int): the row of the square
+            col (int): the column of the square
+
+        Returns:
+            tuple: the line masks that contain the square
+        """
+        if self._cell_lines is None:
+            cell_lines = [[] for _ in range(self.num_squares)]
+            for mask in self.win_masks:
+                bits = mask
+                while bits:
+                    low = bits & -bits
+                    cell_lines[low.bit_length() - 1].append(mask)
+                    bits ^= low
+            self._cell_lines = tuple(tuple(lines) for lines in cell_lines)
+        return self._cell_lines[row * self.cols + col]
+
+    def line_through(self, bits, row, col):
+        """
+        Find a completed line through one square of a player's bitboard.
+
+        Only the lines through the square are tested, so after a move
+        this is O(k) however large the board is.
+
+        Parameters:
+            bits (int): the bitboard of one player
+            row (int): the row of the square, usually the last move
+            col (int): the column of the square
+
+        Returns:
+            int: the mask of the completed line, or 0 if there is none
+        """
+        for mask in self.lines_through(row, col):
+            if bits & mask == mask:
+                return mask
+        return 0
+
+    def is_full(self, x_bits, o_bits):
+        """
+        Check if every square of the board holds a marker.
+
+        Parameters:
+            x_bits (int): the bitboard of player X
+            o_bits (int): the bitboard of player O
+
+        Returns:
+            bool: True if there are no empty squares left
+        """
+        return (x_bits | o_bits) == self.full_mask
+
+    def empty_squares(self, x_bits, o_bits):
+        """
+        Return a bitboard of the empty squares.
+
+        Parameters:
+            x_bits (int): the bitboard of player X
+            o_bits (int): the bitboard of player O
+
+        Returns:
+            int: an integer with the bits of all empty squares set
+        """
+        return self.full_mask & ~(x_bits | o_bits)
+
+    def pack_state(self, x_bits, o_bits, result=RESULT_PLAYING):
+        """
+        Pack a position into a state.
+
+        Parameters:
+            x_bits (int): the bitboard of player X
+            o_bits (int): the bitboard of player O
+            result (int): the result of the game, one of RESULT_*
+
+        Returns:
+            int: the state
+        """
+        n = self.num_squares
+        o_to_move = x_bits.bit_count() != o_bits.bit_count()
+        return x_bits | o_bits << n | o_to_move << 2 * n | result << 2 * n + 1
+
+    def state_bits(self, state):
+        """
+        Return the bitboards of a state.
+
+        Returns:
+            tuple: (x_bits, o_bits)
+        """
+        n = self.num_squares
+        return state & self.full_mask, state >> n & self.full_mask
+
+    def state_turn(self, state):
+        """
+        Return the marker of the player to move in a state.
+        """
+        return O if state >> 2 * self.num_squares & 1 else X
+
+    def state_result(self, state):
+        """
+        Return the result of the game of a state, one of RESULT_*.
+        """
+        return state >> 2 * self.num_squares + 1
+
+    def play_state(self, state, square):
+        """
+        Play a move, with the same rules as Board.play.
+
+        The marker of the player to move is placed on the square. A line
+        of k through it wins, otherwise a full board is a draw.
+
+        Parameters:
+            state (int): the state before the move
+            square (int): the index of the square, row * cols + col
+
+        Returns:
+            int: the state after the move
+
+        Raises:
+            ValueError: if the game is over, or the square is not an
+                empty square of the board
+        """
+        n = self.num_squares
+        if state >> 2 * n + 1:
+            raise ValueError("the game is over")
+        if not 0 <= square < n:
+            raise ValueError(f"square {square} is not on the board")
+        bit = 1 << square
+        o_to_move = state >> 2 * n & 1
+        if (state | state >> n) & bit:
+            raise ValueError(f"square {square} is taken")
+        bits = (state >> n * o_to_move & self.full_mask) | bit
+        state = (state | bit << n * o_to_move) ^ 1 << 2 * n
+        row, col = divmod(square, self.cols)
+        if self.line_through(bits, row, col):
+            return state | (RESULT_O_WINS if o_to_move else RESULT_X_WINS) << 2 * n + 1
+        if (state | state >> n) & self.full_mask == self.full_mask:
+            return state | RESULT_DRAW << 2 * n + 1
+        return state
+
+
+# (rows, cols, k) -> the Rules shared by every board of that size, see shared
+_SHARED = {}
+
+
+def shared(rows=3, cols=3, k=3):
+    """
+    Return the Rules of a board, shared by every board of its size.
+
+    A Rules object builds the line masks of its board on first use,
+    which takes thousands of masks on large boards, so games of the
+    same size share one instead of each building its own.
+
+    Parameters:
+        rows (int): the number of rows of the board
+        cols (int): the number of columns of the board
+        k (int): the number of markers in a line needed to win
+
+    Returns:
+        Rules: the rules of the board
+
+    Raises:
+        ValueError: if k does not fit on the board
+    """
+    key = (rows, cols, k)
+    board_rules = _SHARED.get(key)
+    if board_rules is None:
+        board_rules = _SHARED[key] = Rules(rows, cols, k)
+    return board_rules
+
+
+STANDARD = shared()
+
+BOARD_ROWS = STANDARD.rows
+BOARD_COLS = STANDARD.cols
+NUM_SQUARES = STANDARD.num_squares
+FULL_MASK = STANDARD.full_mask
+
+# the 8 winning lines of the standard board: 3 rows, 3 columns and 2 diagonals
+WIN_MASKS = STANDARD.win_masks
+
+cell_bit = STANDARD.cell_bit
+is_full = STANDARD.is_full
+empty_squares = STANDARD.empty_squares
+
+
+def winning_mask(bits):
+    """
+    Find a completed line in a player's bitboard on the standard board.
+
+    Parameters:
+        bits (int): the bitboard of one player
+
+    Returns:
+        int: the mask of the first completed line, or 0 if there is none
+    """
+    for mask in WIN_MASKS:
+        if bits & mask == mask:
+            return mask
+    return 0
+
+
+def other(marker):
+    """
+    Return the marker of the opponent of the given marker.
+    """
+    return O if marker == X else X
+
+
+def iter_bits(bits):
+    """
+    Yield each set bit of a bitboard, lowest first.
+
+    Parameters:
+        bits (int): the bitboard to split
+
+    Yields:
+        int: an integer with a single bit set
+    """
+    while bits:
+        low = bits & -bits
+        yield low
+        bits ^= low
+
+
+def bit_square(bit, cols=BOARD_COLS):
+    """
+    Return the row and column of the square with the given bit.
+
+    Parameters:
+        bit (int): an integer with only the bit of the square set
+        cols (int): the number of columns of the board
+
+    Returns:
+        tuple: (row, col) of the square
+    """
+    return divmod(bit.bit_length() - 1, cols)
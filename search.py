@@ -0,0 +1,235 @@
+"""
+Alpha-beta search for boards that are too large to solve.
+
+The engine searches with iterative deepening: it searches to depth 1,
+then 2, and so on, until its time budget runs out, and returns the best
+move of the deepest search that finished. Moves are ordered with killer
+moves and a history heuristic, so the best moves are usually searched
+first and alpha-beta can cut off the rest.
+
+Positions at the search horizon are scored by counting the lines of k
+squares that only one player has markers in.
+"""
+
+import time
+
+import rules
+
+WIN_SCORE = 1 << 40
+
+# the search looks at the clock every this many nodes (a power of 2 minus 1),
+# often enough to stop within a millisecond or two of the budget on a 19x19 board
+CLOCK_CHECK_INTERVAL = 15
+
+# on boards with more squares than this only the empty squares next to a
+# marker are searched
+FULL_WIDTH_SQUARES = 25
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the time budget has run out.
+    """
+
+
+class Engine:
+    def __init__(self, board_rules, budget_ms=200, max_depth=None):
+        """
+        Initialize a search engine.
+
+        Parameters:
+            board_rules (rules.Rules): the rules of the board to play on
+            budget_ms (float): the time to search for each move, in milliseconds
+            max_depth (int): the deepest search, defaults to the number
+                of squares on the board
+        """
+        self.rules = board_rules
+        self.budget_ms = budget_ms
+        self.max_depth = max_depth or board_rules.num_squares
+        cols = board_rules.cols
+        first_col = last_col = 0
+        for row in range(board_rules.rows):
+            first_col |= board_rules.cell_bit(row, 0)
+            last_col |= board_rules.cell_bit(row, cols - 1)
+        self._not_first_col = board_rules.full_mask & ~first_col
+        self._not_last_col = board_rules.full_mask & ~last_col
+        # line score by number of markers, a line of k is a win
+        self._line_scores = tuple(4**count for count in range(board_rules.k))
+        # square index -> history score, kept between moves
+        self.history = [0] * board_rules.num_squares
+        self.killers = []
+        self.nodes = 0
+        self.depth = 0
+        self._deadline = 0.0
+
+    def neighbours(self, bits):
+        """
+        Return the squares next to any square of a bitboard.
+
+        Parameters:
+            bits (int): the bitboard to grow
+
+        Returns:
+            int: the bitboard of all squares at most one step away from a
+            square in bits, in any of the 8 directions
+        """
+        cols = self.rules.cols
+        not_first, not_last = self._not_first_col, self._not_last_col
+        grown = (
+            bits
+            | bits << cols
+            | bits >> cols
+            | (bits << 1 | bits << cols + 1 | bits >> cols - 1) & not_first
+            | (bits >> 1 | bits >> cols + 1 | bits << cols - 1) & not_last
+        )
+        return grown & self.rules.full_mask
+
+    def candidates(self, own, opp):
+        """
+        Return the squares worth searching.
+
+        Parameters:
+            own (int): the bitboard of the player to move
+            opp (int): the bitboard of the other player
+
+        Returns:
+            int: the bitboard of the candidate moves
+        """
+        empty = self.rules.empty_squares(own, opp)
+        occupied = own | opp
+        if self.rules.num_squares <= FULL_WIDTH_SQUARES:
+            return empty
+        if not occupied:
+            center = self.rules.cell_bit(self.rules.rows // 2, self.rules.cols // 2)
+            return center
+        # fall back to every empty square if the markers are walled in
+        return empty & self.neighbours(occupied) or empty
+
+    def evaluate(self, own, opp):
+        """
+        Score a position for the player to move.
+
+        Every line of k squares that holds markers of only one player
+        counts for that player, more so the more markers it holds.
+
+        Parameters:
+            own (int): the bitboard of the player to move
+            opp (int): the bitboard of the other player
+
+        Returns:
+            int: the score, positive if the player to move is better off
+        """
+        line_scores = self._line_scores
+        score = 0
+        for mask in self.rules.win_masks:
+            mine = own & mask
+            theirs = opp & mask
+            if mine:
+                if not theirs:
+                    score += line_scores[mine.bit_count()]
+            elif theirs:
+                score -= line_scores[theirs.bit_count()]
+        return score
+
+    def _ordered(self, moves, ply, first=0):
+        # killer moves first, then by history score
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+        history = self.history
+        ordered = sorted(
+            rules.iter_bits(moves),
+            key=lambda bit: (
+                bit == first,
+                bit in killers,
+                history[bit.bit_length() - 1],
+            ),
+            reverse=True,
+        )
+        return ordered
+
+    def _store_killer(self, bit, ply):
+        while len(self.killers) <= ply:
+            self.killers.append([0, 0])
+        killers = self.killers[ply]
+        if killers[0] != bit:
+            killers[1] = killers[0]
+            killers[0] = bit
+
+    def _negamax(self, own, opp, depth, alpha, beta, ply):
+        self.nodes += 1
+        if not self.nodes & CLOCK_CHECK_INTERVAL:
+            if time.perf_counter() >= self._deadline:
+                raise SearchTimeout
+        moves = self.candidates(own, opp)
+        if not moves:
+            return 0
+        if depth == 0:
+            return self.evaluate(own, opp)
+        cols = self.rules.cols
+        for bit in self._ordered(moves, ply):
+            placed = own | bit
+            if self.rules.line_through(placed, *rules.bit_square(bit, cols)):
+                score = WIN_SCORE - ply
+            else:
+                score = -self._negamax(opp, placed, depth - 1, -beta, -alpha, ply + 1)
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    self._store_killer(bit, ply)
+                    self.history[bit.bit_length() - 1] += depth * depth
+                    break
+        return alpha
+
+    def _search_root(self, own, opp, depth, first):
+        cols = self.rules.cols
+        best_bit, alpha = 0, -WIN_SCORE - 1
+        for bit in self._ordered(self.candidates(own, opp), 0, first):
+            placed = own | bit
+            if self.rules.line_through(placed, *rules.bit_square(bit, cols)):
+                return bit, WIN_SCORE
+            score = -self._negamax(opp, placed, depth - 1, -WIN_SCORE, -alpha, 1)
+            if score > alpha:
+                best_bit, alpha = bit, score
+        return best_bit, alpha
+
+    def best_move(self, x_bits, o_bits):
+        """
+        Find the best move for the player whose turn it is.
+
+        The search deepens one ply at a time until the time budget runs
+        out, and the move found by the deepest finished search is
+        returned. The clock is checked every few nodes, so the
+        search never runs much past its budget.
+
+        Parameters:
+            x_bits (int): the bitboard of player X
+            o_bits (int): the bitboard of player O
+
+        Returns:
+            int: the bit of the square to play, or 0 if the board is full
+        """
+        if x_bits.bit_count() == o_bits.bit_count():
+            own, opp = x_bits, o_bits
+        else:
+            own, opp = o_bits, x_bits
+        moves = self.candidates(own, opp)
+        if not moves & moves - 1:
+            # no move or only one move, nothing to search
+            return moves
+        self._deadline = time.perf_counter() + self.budget_ms / 1000
+        self.nodes = 0
+        self.killers = []
+        best_bit = self._ordered(moves, 0)[0]
+        self.depth = 0
+        for depth in range(1, self.max_depth + 1):
+            try:
+                bit, score = self._search_root(own, opp, depth, best_bit)
+            except SearchTimeout:
+                break
+            best_bit = bit
+            self.depth = depth
+            # stop once a forced win or loss has been found
+            if abs(score) >= WIN_SCORE - self.max_depth:
+                break
+            if depth >= self.rules.empty_squares(own, opp).bit_count():
+                break
+        return best_bit
@@ -0,0 +1,368 @@
+"""
+Multiplayer game server.
+
+The server hosts many games at once for remote players, over TCP with
+asyncio streams. Each game is kept as its state, a single integer
+packing the two bitboards, the player to move and the result (see
+rules.py), and the connections of its players, not as a Board with its
+Squares. Moves are checked with the same rules as Board by
+Rules.play_state: a move must be on an empty square by the player whose
+turn it is, a line of k through the move wins (Rules.line_through, as
+Board.check_winner) and a full board without a winner is a draw.
+
+The protocol is one line of ASCII text per message, words separated by
+spaces. Clients send:
+    NEW [<game>]        start a game and play X in it, with the given
+                        id if there is one
+    JOIN <game>         play O in a game
+    MOVE <game> <sq>    play a square, by its index row * cols + col
+    STATE <game>        ask for the position of a game
+    STATS               ask for the statistics of the server
+and the server replies, in the order of the requests:
+    GAME <game> <marker>
+    OK <game> <sq> <status>
+    STATE <game> <x_bits> <o_bits> <status>
+    STATS <name>=<value> ...
+    ERROR <game> <reason>    (the game is - if there is none)
+where the status is "play" while the game goes on, then "X" or "O" for
+the winner, or "draw". The other player of a game is sent
+    MOVED <game> <sq> <status>   after each move of its opponent
+    LEFT <game>                  if its opponent disconnected
+A game ends with its last move, or when a player disconnects, and is
+then removed from the server.
+
+A connection may play both sides of a game, and any number of games.
+client.py plays many games against the server over loopback.
+
+Usage:
+    python server.py --port 8765
+"""
+
+import argparse
+import asyncio
+import time
+from array import array
+
+import rules
+from profiler import percentile
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+# the number of recent moves whose handling time is kept for STATS
+LATENCY_SAMPLES = 4096
+
+PLAYING = "play"
+DRAW = "draw"
+
+
+# the status of a game by its result, see rules.py
+STATUSES = {
+    rules.RESULT_PLAYING: PLAYING,
+    rules.RESULT_X_WINS: rules.X,
+    rules.RESULT_O_WINS: rules.O,
+    rules.RESULT_DRAW: DRAW,
+}
+
+
+class ServerGame:
+    # a server holds many thousands of games, so they have no __dict__
+    __slots__ = ("id", "state", "player_x", "player_o")
+
+    def __init__(self, game_id, player_x):
+        """
+        Initialize a game hosted by the server.
+
+        Parameters:
+            game_id (int): the id of the game
+            player_x (asyncio.StreamWriter): the connection playing X
+
+        Attributes:
+            state (int): the state of the game, see rules.py
+            player_o (asyncio.StreamWriter): the connection playing O,
+                None until a player joins
+        """
+        self.id = game_id
+        self.state = rules.EMPTY_STATE
+        self.player_x = player_x
+        self.player_o = None
+
+
+class GameServer:
+    def __init__(self, board_rules=rules.STANDARD):
+        """
+        Initialize a GameServer object.
+
+        Parameters:
+            board_rules (rules.Rules): the rules of the board of every game
+
+        Attributes:
+            games (dict): game id -> ServerGame, for the games in play
+            connections (int): the number of open connections
+            moves (int): the number of moves played
+            games_finished (int): the number of games won or drawn
+        """
+        self.rules = board_rules
+        self.games = {}
+        self.connections = 0
+        self.moves = 0
+        self.games_finished = 0
+        self._next_id = 1
+        # connection -> the ids of the games it plays in
+        self._player_games = {}
+        # the time taken to handle the last moves, in seconds, as a ring buffer
+        self._latencies = array("d", bytes(8 * LATENCY_SAMPLES))
+        self._latency_count = 0
+
+    async def serve(self, host=HOST, port=PORT, **kwargs):
+        """
+        Start listening for connections.
+
+        Parameters:
+            host (str): the address to listen on
+            port (int): the port to listen on, 0 for any free port
+            **kwargs: passed on to asyncio.start_server
+
+        Returns:
+            asyncio.Server: the server, already serving
+        """
+        return await asyncio.start_server(self.handle_connection, host, port, **kwargs)
+
+    async def handle_connection(self, reader, writer):
+        """
+        Handle the requests of one connection until it is closed.
+
+        Parameters:
+            reader (asyncio.StreamReader): the stream to read requests from
+            writer (asyncio.StreamWriter): the stream to write replies to
+        """
+        self.connections += 1
+        self._player_games[writer] = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(self.handle_request(line, writer))
+                await writer.drain()
+        except (ValueError, asyncio.IncompleteReadError):
+            # a line longer than the limit of the stream
+            writer.write(b"ERROR - bad request\n")
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            for game_id in self._player_games.pop(writer):
+                self._leave(game_id, writer)
+            writer.close()
+
+    def handle_request(self, line, writer):
+        """
+        Handle one request.
+
+        Parameters:
+            line (bytes): the request, with or without its line end
+            writer (asyncio.StreamWriter): the connection that sent it
+
+        Returns:
+            bytes: the reply, with its line end
+        """
+        return self.handle_words(line.split(), writer)
+
+    def handle_words(self, words, writer):
+        """
+        Handle one request, already split into its words.
+
+        Parameters:
+            words (list): the words of the request, as bytes
+            writer (asyncio.StreamWriter): the connection that sent it
+
+        Returns:
+            bytes: the reply, with its line end
+        """
+        command = words[0] if words else b""
+        try:
+            if command == b"MOVE" and len(words) == 3:
+                return self.move(int(words[1]), int(words[2]), writer)
+            if command == b"NEW" and len(words) <= 2:
+                return self.new_game(writer, int(words[1]) if len(words) == 2 else None)
+            if command == b"JOIN" and len(words) == 2:
+                return self.join(int(words[1]), writer)
+            if command == b"STATE" and len(words) == 2:
+                return self.state(int(words[1]))
+            if command == b"STATS" and len(words) == 1:
+                stats = " ".join(
+                    f"{name}={value}" for name, value in self.stats().items()
+                )
+                return f"STATS {stats}\n".encode()
+        except ValueError:
+            pass
+        return b"ERROR - bad request\n"
+
+    def new_game(self, writer, game_id=None):
+        """
+        Start a game with the connection as X.
+
+        The id of the game is the next free one, unless it is given.
+        Ids given by host.py are kept below the next free one, so the
+        two never hand out the same id. A given id must be 1 or more.
+        """
+        if game_id is None:
+            game_id = self._next_id
+            while game_id in self.games:
+                game_id += 1
+        elif game_id < 1:
+            return f"ERROR {game_id} bad id\n".encode()
+        elif game_id in self.games:
+            return f"ERROR {game_id} game exists\n".encode()
+        self._next_id = max(self._next_id, game_id + 1)
+        self.games[game_id] = ServerGame(game_id, writer)
+        self._player_games[writer].add(game_id)
+        return f"GAME {game_id} {rules.X}\n".encode()
+
+    def join(self, game_id, writer):
+        """
+        Join a game as O.
+        """
+        game = self.games.get(game_id)
+        if game is None:
+            return f"ERROR {game_id} no such game\n".encode()
+        if game.player_o is not None:
+            return f"ERROR {game_id} game is full\n".encode()
+        game.player_o = writer
+        self._player_games[writer].add(game_id)
+        return f"GAME {game_id} {rules.O}\n".encode()
+
+    def state(self, game_id):
+        """
+        Describe the position of a game.
+        """
+        game = self.games.get(game_id)
+        if game is None:
+            return f"ERROR {game_id} no such game\n".encode()
+        x_bits, o_bits = self.rules.state_bits(game.state)
+        return f"STATE {game_id} {x_bits} {o_bits} {PLAYING}\n".encode()
+
+    def move(self, game_id, square, writer):
+        """
+        Play a move, and tell the other player about it.
+
+        Returns:
+            bytes: the reply to the player who moved
+        """
+        start = time.perf_counter()
+        game = self.games.get(game_id)
+        if game is None:
+            return f"ERROR {game_id} no such game\n".encode()
+        x_to_move = self.rules.state_turn(game.state) == rules.X
+        if (game.player_x if x_to_move else game.player_o) is not writer:
+            return f"ERROR {game_id} not your turn\n".encode()
+        if not 0 <= square < self.rules.num_squares:
+            return f"ERROR {game_id} no such square\n".encode()
+        try:
+            game.state = self.rules.play_state(game.state, square)
+        except ValueError:
+            return f"ERROR {game_id} square is taken\n".encode()
+
+        status = STATUSES[self.rules.state_result(game.state)]
+        self.moves += 1
+        if status != PLAYING:
+            self.games_finished += 1
+            self._remove(game)
+
+        opponent = game.player_o if x_to_move else game.player_x
+        if opponent is not None and opponent is not writer:
+            opponent.write(f"MOVED {game_id} {square} {status}\n".encode())
+        self._latencies[self._latency_count % LATENCY_SAMPLES] = (
+            time.perf_counter() - start
+        )
+        self._latency_count += 1
+        return f"OK {game_id} {square} {status}\n".encode()
+
+    def stats(self):
+        """
+        Return the statistics of the server.
+
+        Returns:
+            dict: the number of games in play, of open connections, of
+            moves played and of games finished, and the 50th and 99th
+            percentile time to handle a move over the last moves, in
+            microseconds
+        """
+        count = min(self._latency_count, LATENCY_SAMPLES)
+        latencies = sorted(self._latencies[:count])
+        return {
+            "games": len(self.games),
+            "connections": self.connections,
+            "moves": self.moves,
+            "finished": self.games_finished,
+            "move_p50_us": round(percentile(latencies, 50) * 1e6, 1),
+            "move_p99_us": round(percentile(latencies, 99) * 1e6, 1),
+        }
+
+    def _remove(self, game):
+        del self.games[game.id]
+        for player in (game.player_x, game.player_o):
+            if player is not None:
+                self._player_games[player].discard(game.id)
+
+    def _leave(self, game_id, writer):
+        # a player disconnected: the game ends and its opponent is told
+        game = self.games.get(game_id)
+        if game is None:
+            return
+        del self.games[game_id]
+        for player in (game.player_x, game.player_o):
+            if player is not None and player is not writer:
+                self._player_games[player].discard(game_id)
+                player.write(f"LEFT {game_id}\n".encode())
+
+
+async def run(host=HOST, port=PORT, board_rules=rules.STANDARD, stats_interval=None):
+    """
+    Serve games until cancelled.
+
+    Parameters:
+        host (str): the address to listen on
+        port (int): the port to listen on
+        board_rules (rules.Rules): the rules of the board of every game
+        stats_interval (float): print the statistics every this many
+            seconds, defaults to None to not print them
+    """
+    game_server = GameServer(board_rules)
+    server = await game_server.serve(host, port)
+    addresses = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+    print(f"Serving {board_rules!r} games on {addresses}")
+    async with server:
+        while True:
+            await asyncio.sleep(stats_interval or 3600)
+            if stats_interval:
+                print(game_server.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host Tic Tac Toe games.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--size", type=int, default=3)
+    parser.add_argument("--win-length", type=int, default=None)
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=None,
+        help="print the statistics every this many seconds",
+    )
+    args = parser.parse_args()
+    win_length = args.win_length or min(args.size, 5)
+    try:
+        board_rules = rules.Rules(args.size, args.size, win_length)
+    except ValueError as error:
+        parser.error(str(error))
+    try:
+        asyncio.run(run(args.host, args.port, board_rules, args.stats_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
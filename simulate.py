@@ -0,0 +1,169 @@
+"""
+Headless simulation of Tic Tac Toe games.
+
+Games are played on the same Board rules as the windowed game, but
+without opening a window, initializing Pygame or loading fonts, so they
+can run in batch on machines without a display.
+
+Usage:
+    python simulate.py --games 100000 --seed 1
+    python simulate.py --games 1000000 --record games.ttr
+"""
+
+import argparse
+import os
+import random
+import time
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import records
+import rules
+from main import Board
+
+
+def random_player(rng=None):
+    """
+    Create a bot that plays a random empty square.
+
+    Parameters:
+        rng (random.Random): the random number generator, defaults to a new one
+
+    Returns:
+        function: a player that takes a Board and a marker and returns the
+        bit of the square to play
+    """
+    rng = rng or random.Random()
+
+    def play(board, marker):
+        return rng.choice(list(rules.iter_bits(board.empty_squares())))
+
+    return play
+
+
+def scripted_player(moves):
+    """
+    Create a player that plays a fixed sequence of moves.
+
+    Parameters:
+        moves (iterable): the squares to play, as (row, col) tuples
+
+    Returns:
+        function: a player that takes a Board and a marker and returns the
+        bit of the square to play
+    """
+    moves = iter(moves)
+
+    def play(board, marker):
+        row, col = next(moves)
+        return board.rules.cell_bit(row, col)
+
+    return play
+
+
+def play_game(player_x, player_o, board=None):
+    """
+    Play one game to the end.
+
+    Parameters:
+        player_x (function): the player for X, see random_player
+        player_o (function): the player for O, see random_player
+        board (Board): the board to play on, defaults to a new Board
+
+    Returns:
+        str: the winning marker, or None if the game is a draw
+
+    Raises:
+        ValueError: if a player chooses a square that is not empty
+    """
+    if board is None:
+        board = Board()
+    else:
+        board.reset()
+    players = {rules.X: player_x, rules.O: player_o}
+    marker = rules.X
+    while True:
+        bit = players[marker](board, marker)
+        if not board.empty_squares() & bit:
+            raise ValueError(f"Player {marker} played an occupied square")
+        board.set_marker(bit, marker)
+        if board.check_winner():
+            return board.winner
+        if board.check_draw():
+            return None
+        marker = rules.other(marker)
+
+
+def simulate(
+    games,
+    player_x=None,
+    player_o=None,
+    seed=None,
+    size=3,
+    win_length=3,
+    recorder=None,
+):
+    """
+    Play a batch of games and count the results.
+
+    Parameters:
+        games (int): the number of games to play
+        player_x (function): the player for X, defaults to a random player
+        player_o (function): the player for O, defaults to a random player
+        seed (int): the seed for the default random players
+        size (int): the number of rows and columns of the board
+        win_length (int): the number of markers in a line needed to win
+        recorder (records.RecordWriter): the writer to record every game
+            to, defaults to None to not record the games
+
+    Returns:
+        dict: the number of games won by "X" and "O" and of draws (None)
+    """
+    rng = random.Random(seed)
+    player_x = player_x or random_player(rng)
+    player_o = player_o or random_player(rng)
+    results = {rules.X: 0, rules.O: 0, None: 0}
+    board = Board(size, size, win_length)
+    for _ in range(games):
+        winner = play_game(player_x, player_o, board)
+        results[winner] += 1
+        if recorder:
+            recorder.write(board.moves, records.outcome_of(winner))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate Tic Tac Toe games.")
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--size", type=int, default=3)
+    parser.add_argument("--win-length", type=int, default=None)
+    parser.add_argument("--record", metavar="FILE", help="append the games to FILE")
+    args = parser.parse_args()
+    win_length = args.win_length or min(args.size, 5)
+
+    recorder = None
+    if args.record:
+        board_rules = rules.Rules(args.size, args.size, win_length)
+        recorder = records.RecordWriter(args.record, board_rules)
+    start = time.perf_counter()
+    try:
+        results = simulate(
+            args.games,
+            seed=args.seed,
+            size=args.size,
+            win_length=win_length,
+            recorder=recorder,
+        )
+    finally:
+        if recorder:
+            recorder.close()
+    elapsed = time.perf_counter() - start
+    print(f"X wins: {results[rules.X]}")
+    print(f"O wins: {results[rules.O]}")
+    print(f"Draws:  {results[None]}")
+    print(f"{args.games / elapsed:,.0f} games/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Precomputed Tic Tac Toe tablebase.
+
+Every legal position reachable from the empty board is stored with its
+game-theoretic value and its best moves in a small binary file, so the
+result of any position is an O(1) lookup instead of a search.
+
+File layout (little endian):
+    header: MAGIC (4 bytes), VERSION (1 byte), 3 bytes padding
+    entries: 3**9 unsigned 16-bit integers, one per position
+
+A position is indexed by reading the board as a base-3 number where
+square ``row * 3 + col`` is the digit for 3**(row * 3 + col), with 0 for
+an empty square, 1 for X and 2 for O. Each entry holds:
+    bits 0-8:   the best moves for the player to move, one bit per square
+    bits 9-10:  the value for the player to move (VALUE_*)
+    bits 12-15: the number of plies to the end of the game with best play
+
+Usage:
+    python tablebase.py  # regenerates tablebase.bin
+"""
+
+import os
+import struct
+
+import rules
+
+MAGIC = b"TTTB"
+VERSION = 1
+HEADER = struct.Struct("<4sB3x")
+ENTRY = struct.Struct("<H")
+NUM_ENTRIES = 3**rules.NUM_SQUARES
+FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebase.bin")
+
+# entries of positions that cannot be reached in a game are left 0
+VALUE_ILLEGAL = 0
+VALUE_WIN = 1
+VALUE_DRAW = 2
+VALUE_LOSS = 3
+
+_MOVES_MASK = rules.FULL_MASK
+_VALUE_SHIFT = 9
+_PLIES_SHIFT = 12
+
+
+def _ternary(bits):
+    value = 0
+    for square in range(rules.NUM_SQUARES):
+        if bits & (1 << square):
+            value += 3**square
+    return value
+
+
+# bitboard -> its squares as base-3 digits of 1, for O multiply by 2
+_TERNARY = tuple(_ternary(bits) for bits in range(rules.FULL_MASK + 1))
+
+
+def position_index(x_bits, o_bits):
+    """
+    Return the index of a position in the tablebase.
+
+    Parameters:
+        x_bits (int): the bitboard of player X
+        o_bits (int): the bitboard of player O
+
+    Returns:
+        int: the index of the position's entry
+    """
+    return _TERNARY[x_bits] + 2 * _TERNARY[o_bits]
+
+
+def _solve(own, opp):
+    # return (value, best moves, plies to the end) for the player to move
+    import ai
+
+    empty = rules.empty_squares(own, opp)
+    if rules.winning_mask(opp):
+        return VALUE_LOSS, 0, 0
+    if not empty:
+        return VALUE_DRAW, 0, 0
+    scores = {bit: -ai.negamax(opp, own | bit) for bit in rules.iter_bits(empty)}
+    best_score = max(scores.values())
+    best_moves = 0
+    for bit, score in scores.items():
+        if score == best_score:
+            best_moves |= bit
+    # a game won with e empty squares left scores e + 1 (see ai.negamax),
+    # and a drawn game always ends with the board full
+    plies = empty.bit_count()
+    if best_score:
+        plies -= abs(best_score) - 1
+    if best_score > 0:
+        return VALUE_WIN, best_moves, plies
+    if best_score < 0:
+        return VALUE_LOSS, best_moves, plies
+    return VALUE_DRAW, best_moves, plies
+
+
+def generate():
+    """
+    Enumerate every legal position and solve it.
+
+    Returns:
+        list: the entries of the tablebase, indexed by position_index
+    """
+    entries = [0] * NUM_ENTRIES
+    stack = [(0, 0)]
+    while stack:
+        x_bits, o_bits = stack.pop()
+        index = position_index(x_bits, o_bits)
+        if entries[index]:
+            continue
+        x_to_move = x_bits.bit_count() == o_bits.bit_count()
+        if x_to_move:
+            value, moves, plies = _solve(x_bits, o_bits)
+        else:
+            value, moves, plies = _solve(o_bits, x_bits)
+        entries[index] = moves | value << _VALUE_SHIFT | plies << _PLIES_SHIFT
+        if rules.winning_mask(x_bits) or rules.winning_mask(o_bits):
+            continue
+        for bit in rules.iter_bits(rules.empty_squares(x_bits, o_bits)):
+            if x_to_move:
+                stack.append((x_bits | bit, o_bits))
+            else:
+                stack.append((x_bits, o_bits | bit))
+    return entries
+
+
+def write(path=FILENAME):
+    """
+    Generate the tablebase and write it to a file.
+
+    Parameters:
+        path (str): the file to write, defaults to tablebase.bin
+
+    Returns:
+        int: the number of legal positions written
+    """
+    entries = generate()
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION))
+        f.write(struct.pack(f"<{NUM_ENTRIES}H", *entries))
+    return sum(1 for entry in entries if entry)
+
+
+class Tablebase:
+    def __init__(self, path=FILENAME):
+        """
+        Open a tablebase file.
+
+        The file is memory-mapped, so only the pages that are looked
+        up are read from disk. Where mmap is not available (e.g. in
+        the browser) the file is read into memory instead.
+
+        Parameters:
+            path (str): the file to open, defaults to tablebase.bin
+
+        Raises:
+            ValueError: if the file is not a tablebase of this version
+        """
+        with open(path, "rb") as f:
+            try:
+                import mmap
+
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ImportError, OSError, ValueError):
+                self.data = f.read()
+        magic, version = HEADER.unpack_from(self.data)
+        expected_size = HEADER.size + NUM_ENTRIES * ENTRY.size
+        if magic != MAGIC or version != VERSION or len(self.data) != expected_size:
+            raise ValueError(f"{path} is not a version {VERSION} tablebase")
+
+    def lookup(self, x_bits, o_bits):
+        """
+        Look up a position.
+
+        Parameters:
+            x_bits (int): the bitboard of player X
+            o_bits (int): the bitboard of player O
+
+        Returns:
+            tuple: (value, best moves, plies) for the player to move, or
+            None if the position cannot be reached in a game
+        """
+        offset = HEADER.size + position_index(x_bits, o_bits) * ENTRY.size
+        (entry,) = ENTRY.unpack_from(self.data, offset)
+        if not entry:
+            return None
+        return (
+            entry >> _VALUE_SHIFT & 3,
+            entry & _MOVES_MASK,
+            entry >> _PLIES_SHIFT,
+        )
+
+    def best_move(self, x_bits, o_bits):
+        """
+        Return one of the best moves of a position.
+
+        Parameters:
+            x_bits (int): the bitboard of player X
+            o_bits (int): the bitboard of player O
+
+        Returns:
+            int: the bit of the square to play, or 0 if the game is over
+            or the position cannot be reached in a game
+        """
+        result = self.lookup(x_bits, o_bits)
+        if result is None:
+            return 0
+        moves = result[1]
+        return moves & -moves
+
+
+_tablebase = None
+
+
+def open_default():
+    """
+    Return the shared Tablebase for tablebase.bin, opening it on first use.
+
+    Returns:
+        Tablebase: the tablebase, or None if the file is missing or invalid
+    """
+    global _tablebase
+    if _tablebase is None:
+        try:
+            _tablebase = Tablebase()
+        except (OSError, ValueError):
+            return None
+    return _tablebase
+
+
+if __name__ == "__main__":
+    positions = write()
+    print(f"Wrote {positions} positions to {FILENAME}")
@@ -0,0 +1,30 @@
+import rules
+from mcts import MCTS
+
+
+def test_zero_budget_returns_a_legal_move():
+    board_rules = rules.Rules(9, 9, 5)
+    player = MCTS(board_rules, 0, workers=1)
+    bit = player.best_move(0, 0)
+    assert player.playouts == 0
+    assert bit == board_rules.cell_bit(4, 4)
+
+    x_bits = board_rules.cell_bit(4, 4)
+    bit = player.best_move(x_bits, 0)
+    assert bit & board_rules.empty_squares(x_bits, 0)
+
+
+def test_zero_budget_wins_then_blocks():
+    board_rules = rules.Rules(9, 9, 5)
+    player = MCTS(board_rules, 0, workers=1)
+    # X to move with four in a row, and O with four in a column
+    x_bits = sum(board_rules.cell_bit(0, col) for col in range(1, 5))
+    o_bits = sum(board_rules.cell_bit(row, 8) for row in range(1, 5))
+    win = player.best_move(x_bits, o_bits)
+    assert board_rules.line_through(x_bits | win, *rules.bit_square(win, 9))
+
+    # O to move, X has four in a row and O has nothing to win with
+    o_bits = sum(board_rules.cell_bit(8, col) for col in (0, 2, 4))
+    x_bits |= board_rules.cell_bit(6, 6)
+    block = player.best_move(x_bits, o_bits)
+    assert board_rules.line_through(x_bits | block, *rules.bit_square(block, 9))
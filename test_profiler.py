@@ -0,0 +1,30 @@
+from profiler import FrameProfiler, percentile
+
+
+def test_percentile_odd_lengths():
+    assert percentile([1, 2, 3, 4, 5], 50) == 3
+    assert percentile(list(range(1, 10)), 50) == 5
+    assert percentile([1, 2, 3], 50) == 2
+    assert percentile([7], 50) == 7
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 11))
+    assert percentile(values, 50) == 5
+    assert percentile(values, 70) == 7
+    assert percentile(values, 90) == 9
+    assert percentile(values, 99) == 10
+    assert percentile(values, 0) == 1
+    assert percentile(values, 100) == 10
+    assert percentile([], 50) == 0.0
+
+
+def test_profiler_percentile():
+    times = iter(range(100))
+    frame_profiler = FrameProfiler(capacity=8, clock=lambda: float(next(times)))
+    for _ in range(5):
+        frame_profiler.begin_frame()
+        frame_profiler.lap(0)
+        frame_profiler.end_frame()
+    assert len(frame_profiler) == 5
+    assert frame_profiler.percentile(50) == 1.0
@@ -0,0 +1,92 @@
+import random
+
+import pytest
+
+import records
+import rules
+
+
+def _games(board_rules, count, seed=1):
+    # random games of every length, with every outcome
+    rng = random.Random(seed)
+    squares = list(range(board_rules.num_squares))
+    games = []
+    for i in range(count):
+        rng.shuffle(squares)
+        n = rng.randint(0, len(squares))
+        games.append(records.GameRecord(1_700_000_000 + i, i % 4, tuple(squares[:n])))
+    return games
+
+
+def _write(path, board_rules, games):
+    with records.RecordWriter(path, board_rules) as writer:
+        for game in games:
+            writer.write(game.moves, game.outcome, game.timestamp)
+
+
+@pytest.mark.parametrize("size, k", [(3, 3), (9, 5), (15, 5)])
+def test_pack_unpack_round_trip(size, k):
+    board_rules = rules.Rules(size, size, k)
+    record_format = records.RecordFormat(board_rules)
+    for game in _games(board_rules, 50):
+        data = record_format.pack(game.moves, game.outcome, game.timestamp)
+        info_size = record_format.info.size
+        n = len(game.moves)
+        assert len(data) == records.TIMESTAMP.size + info_size + (
+            record_format.move_bytes[n]
+        )
+        value = int.from_bytes(data[records.TIMESTAMP.size + info_size :], "little")
+        assert record_format.unpack_moves(value, n) == game.moves
+
+
+def test_full_game_fits_in_8_bytes():
+    record_format = records.RecordFormat(rules.STANDARD)
+    data = record_format.pack(range(9), records.OUTCOME_DRAW, 0)
+    assert len(data) == 8
+
+
+def test_pack_rejects_a_square_played_twice():
+    record_format = records.RecordFormat(rules.STANDARD)
+    with pytest.raises(ValueError):
+        record_format.pack([4, 4], records.OUTCOME_UNFINISHED, 0)
+
+
+@pytest.mark.parametrize("size, k", [(3, 3), (15, 5)])
+def test_read_records_returns_what_was_written(tmp_path, size, k):
+    board_rules = rules.Rules(size, size, k)
+    games = _games(board_rules, 300)
+    path = tmp_path / "games.ttr"
+    _write(path, board_rules, games[:100])
+    # appending to the file keeps its header and the games before
+    _write(path, board_rules, games[100:])
+    # small chunks split records between reads
+    assert list(records.read_records(path, chunk_size=7)) == games
+    assert list(records.read_records(path)) == games
+
+
+def test_truncated_record_is_skipped(tmp_path):
+    games = _games(rules.STANDARD, 3)
+    path = tmp_path / "games.ttr"
+    _write(path, rules.STANDARD, games)
+    with open(path, "r+b") as f:
+        f.truncate(path.stat().st_size - 1)
+    assert list(records.read_records(path)) == games[:2]
+
+
+def test_writer_rejects_other_files_and_closes_them(tmp_path, monkeypatch):
+    opened = []
+
+    def tracking_open(*args, **kwargs):
+        f = open(*args, **kwargs)
+        opened.append(f)
+        return f
+
+    monkeypatch.setattr(records, "open", tracking_open, raising=False)
+    not_records = tmp_path / "notes.txt"
+    not_records.write_bytes(b"not a record file")
+    other_board = tmp_path / "games.ttr"
+    _write(other_board, rules.Rules(4, 4, 4), [])
+    for path in (not_records, other_board):
+        with pytest.raises(ValueError):
+            records.RecordWriter(path, rules.STANDARD)
+    assert opened and all(f.closed for f in opened)
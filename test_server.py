@@ -0,0 +1,48 @@
+import asyncio
+
+from server import GameServer
+
+
+async def _request(server, lines):
+    listener = await server.serve("127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(lines)
+    writer.write_eof()
+    await writer.drain()
+    replies = await asyncio.wait_for(reader.read(), 5)
+    writer.close()
+    listener.close()
+    await listener.wait_closed()
+    return replies.decode().splitlines()
+
+
+def test_given_ids_must_be_positive():
+    server = GameServer()
+    replies = asyncio.run(_request(server, b"NEW 0\nNEW -5\nNEW 3\nNEW\n"))
+    assert replies == [
+        "ERROR 0 bad id",
+        "ERROR -5 bad id",
+        "GAME 3 X",
+        "GAME 4 X",
+    ]
+
+
+def test_line_over_the_limit_closes_the_connection():
+    server = GameServer()
+    errors = []
+
+    async def send_long_line():
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: errors.append(context)
+        )
+        try:
+            await _request(server, b"NEW\n" + b"x" * (1 << 17) + b"\n")
+        except ConnectionResetError:
+            # the server closes with the rest of the line unread
+            pass
+
+    asyncio.run(send_long_line())
+    assert server.connections == 0
+    assert not server.games
+    assert errors == []